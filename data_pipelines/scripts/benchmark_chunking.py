@@ -0,0 +1,82 @@
+"""Measure the chunking throughput in pages per second.
+
+Compares langchain's TokenTextSplitter with TokenChunker, with and without
+markdown boundaries and with several process counts, on the pages of the
+sample `data/documents_processed.json` repeated to reach the requested size.
+This benchmark runs locally, it does not need AWS access.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from langchain.text_splitter import TokenTextSplitter
+
+sys.path.append(os.path.abspath("."))
+from utils.chunking import TokenChunker
+from utils.document_ingestion import iter_processed_pages, page_record_to_document
+
+
+def load_pages(processed_documents_path, num_pages):
+    sample_pages = [
+        page_record_to_document(page_record)
+        for page_record in iter_processed_pages(processed_documents_path)
+    ]
+    return [sample_pages[index % len(sample_pages)] for index in range(num_pages)]
+
+
+def benchmark(name, split_pages, pages):
+    start = time.perf_counter()
+    num_chunks = sum(len(page_chunks) for page_chunks in split_pages(pages))
+    elapsed = time.perf_counter() - start
+    result = {
+        "splitter": name,
+        "pages": len(pages),
+        "chunks": num_chunks,
+        "seconds": round(elapsed, 3),
+        "pages_per_second": round(len(pages) / elapsed, 1),
+    }
+    print(result)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processed-documents-path", default="data/documents_processed.json")
+    parser.add_argument("--num-pages", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--chunk-overlap", type=int, default=64)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    pages = load_pages(args.processed_documents_path, args.num_pages)
+
+    token_text_splitter = TokenTextSplitter(
+        chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap
+    )
+    results = [
+        benchmark(
+            "TokenTextSplitter",
+            lambda pages: (token_text_splitter.split_documents([page]) for page in pages),
+            pages,
+        )
+    ]
+
+    for respect_markdown in (False, True):
+        for processes in args.processes:
+            chunker = TokenChunker(
+                chunk_size=args.chunk_size,
+                chunk_overlap=args.chunk_overlap,
+                respect_markdown=respect_markdown,
+                processes=processes,
+            )
+            results.append(
+                benchmark(
+                    f"TokenChunker(respect_markdown={respect_markdown}, processes={processes})",
+                    chunker.iter_split_documents,
+                    pages,
+                )
+            )
+
+    print(json.dumps(results, indent=2))
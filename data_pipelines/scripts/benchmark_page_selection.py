@@ -0,0 +1,100 @@
+"""Measure the speedup of the parallel page selection per core.
+
+Keeps a few pages of each pdf of a folder, e.g. the `raw_documents` folder
+of `prepare_documents.py`, or of synthetic pdfs generated with pypdf, with
+an increasing number of processes. The selection state is reset between
+runs so that no document is skipped. This benchmark runs locally, it does
+not need AWS access.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject
+
+sys.path.append(os.path.abspath("."))
+from utils.pdf_pages import PAGE_SELECTION_FILENAME, select_pages_in_documents
+
+
+def make_synthetic_pdf(file_path, num_pages, lines_per_page=60):
+    writer = PdfWriter()
+    for page_index in range(num_pages):
+        page = writer.add_blank_page(width=612, height=792)
+        content = DecodedStreamObject()
+        content.set_data(
+            b"".join(
+                f"BT /F1 10 Tf 40 {760 - 12 * line} Td (Page {page_index} line {line} of a synthetic"
+                f" annual report with revenue, risks and human capital figures.) Tj ET\n".encode()
+                for line in range(lines_per_page)
+            )
+        )
+        page.replace_contents(content)
+    with open(file_path, "wb") as f:
+        writer.write(f)
+
+
+def benchmark(documents, prepared_directory, processes):
+    selection_path = os.path.join(prepared_directory, PAGE_SELECTION_FILENAME)
+    if os.path.exists(selection_path):
+        os.remove(selection_path)
+
+    start = time.perf_counter()
+    for _ in select_pages_in_documents(documents, prepared_directory, processes):
+        pass
+    elapsed = time.perf_counter() - start
+    return {
+        "processes": processes,
+        "documents": len(documents),
+        "seconds": round(elapsed, 3),
+        "documents_per_second": round(len(documents) / elapsed, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--pdf-directory", default=None,
+        help="Folder of pdfs to use, synthetic pdfs are generated when not set."
+    )
+    parser.add_argument("--num-documents", type=int, default=16)
+    parser.add_argument("--num-pages", type=int, default=300)
+    parser.add_argument("--pages-to-keep", type=int, nargs="+", default=[15, 17, 18, 47, 48])
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    work_directory = tempfile.mkdtemp()
+    try:
+        if args.pdf_directory:
+            input_pdf_paths = sorted(
+                glob.glob(os.path.join(args.pdf_directory, "**", "*.pdf"), recursive=True)
+            )
+        else:
+            synthetic_pdf_path = os.path.join(work_directory, "synthetic.pdf")
+            make_synthetic_pdf(synthetic_pdf_path, args.num_pages)
+            input_pdf_paths = []
+            for index in range(args.num_documents):
+                input_pdf_path = os.path.join(work_directory, f"synthetic_{index}.pdf")
+                shutil.copyfile(synthetic_pdf_path, input_pdf_path)
+                input_pdf_paths.append(input_pdf_path)
+
+        prepared_directory = os.path.join(work_directory, "prepared")
+        os.makedirs(prepared_directory)
+        documents = []
+        for index, input_pdf_path in enumerate(input_pdf_paths):
+            num_pages = len(PdfReader(input_pdf_path).pages)
+            pages = [page for page in args.pages_to_keep if page <= num_pages]
+            output_pdf_path = os.path.join(prepared_directory, f"{index}.pdf")
+            documents.append((input_pdf_path, output_pdf_path, pages, {"index": index}))
+
+        results = [benchmark(documents, prepared_directory, processes) for processes in args.processes]
+        for result in results:
+            result["speedup"] = round(results[0]["seconds"] / result["seconds"], 2)
+        print(json.dumps(results, indent=2))
+    finally:
+        shutil.rmtree(work_directory)
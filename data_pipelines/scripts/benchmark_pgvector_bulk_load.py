@@ -0,0 +1,121 @@
+"""Compare PGVector.add_embeddings with the COPY based bulk loader.
+
+Both paths load the same synthetic chunks with random embeddings into two
+benchmark collections, so no Bedrock calls are needed. The benchmark
+collections are deleted at the end.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import boto3
+import psycopg2
+from langchain_community.embeddings import FakeEmbeddings
+from langchain_community.vectorstores.pgvector import PGVector
+
+sys.path.append(os.path.abspath("."))
+from utils.pgvector_bulk_load import bulk_load_embeddings
+
+secretsmanager = boto3.client("secretsmanager")
+secret_response = secretsmanager.get_secret_value(
+    SecretId=os.environ["SQL_DB_SECRET_ID"]
+)
+database_secrets = json.loads(secret_response["SecretString"])
+
+# Extract credentials
+host = database_secrets['host']
+dbname = database_secrets['dbname']
+username = database_secrets['username']
+password = database_secrets['password']
+port = database_secrets["port"]
+
+CONNECTION_STRING = PGVector.connection_string_from_db_params(
+    driver="psycopg2",
+    host=host,
+    port=port,
+    database=dbname,
+    user=username,
+    password=password,
+)
+
+
+def generate_rows(num_rows, dimensions, chunk_size_chars=2000):
+    for row_index in range(num_rows):
+        yield (
+            f"benchmark-{row_index}",
+            [random.uniform(-1, 1) for _ in range(dimensions)],
+            f"chunk {row_index} " + "x" * chunk_size_chars,
+            {"document_name": "benchmark.pdf", "page_number": row_index // 4},
+        )
+
+
+def benchmark_add_embeddings(collection_name, num_rows, dimensions, batch_size):
+    vector_store = PGVector(
+        collection_name=collection_name,
+        connection_string=CONNECTION_STRING,
+        embedding_function=FakeEmbeddings(size=dimensions),
+        pre_delete_collection=True,
+    )
+    start = time.perf_counter()
+    batch = []
+    for row in generate_rows(num_rows, dimensions):
+        batch.append(row)
+        if len(batch) == batch_size:
+            ids, embeddings, texts, metadatas = zip(*batch)
+            vector_store.add_embeddings(texts, embeddings, metadatas, ids=ids)
+            batch = []
+    if batch:
+        ids, embeddings, texts, metadatas = zip(*batch)
+        vector_store.add_embeddings(texts, embeddings, metadatas, ids=ids)
+    elapsed = time.perf_counter() - start
+    vector_store.delete_collection()
+    return elapsed
+
+
+def benchmark_bulk_load(db_connection, collection_name, num_rows, dimensions):
+    vector_store = PGVector(
+        collection_name=collection_name,
+        connection_string=CONNECTION_STRING,
+        embedding_function=FakeEmbeddings(size=dimensions),
+        pre_delete_collection=True,
+    )
+    start = time.perf_counter()
+    bulk_load_embeddings(db_connection, collection_name, generate_rows(num_rows, dimensions))
+    elapsed = time.perf_counter() - start
+    vector_store.delete_collection()
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-rows", type=int, default=20000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    db_connection = psycopg2.connect(
+        host=host,
+        port=port,
+        database=dbname,
+        user=username,
+        password=password,
+    )
+
+    results = {}
+    results["add_embeddings_seconds"] = benchmark_add_embeddings(
+        "benchmark_add_embeddings", args.num_rows, args.dimensions, args.batch_size
+    )
+    results["copy_bulk_load_seconds"] = benchmark_bulk_load(
+        db_connection, "benchmark_copy_bulk_load", args.num_rows, args.dimensions
+    )
+    for path in ("add_embeddings", "copy_bulk_load"):
+        results[f"{path}_rows_per_second"] = round(args.num_rows / results[f"{path}_seconds"], 1)
+    results["speedup"] = round(
+        results["add_embeddings_seconds"] / results["copy_bulk_load_seconds"], 2
+    )
+
+    db_connection.close()
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,136 @@
+"""Compare full, half and binary precision indexes of the embeddings collection.
+
+For each precision, this builds the reduced precision index, then reports
+the index size, the search latency and the recall@k against an exact full
+precision search, with and without the full precision rescoring step.
+The queries are sampled from the embeddings already stored in the collection,
+so no Bedrock calls are needed.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import boto3
+import psycopg2
+
+sys.path.append(os.path.abspath("."))
+from utils.vector_precision import (
+    EMBEDDING_PRECISIONS,
+    create_reduced_precision_index,
+    get_collection_id,
+    get_index_size,
+    similarity_search,
+)
+
+secretsmanager = boto3.client("secretsmanager")
+secret_response = secretsmanager.get_secret_value(
+    SecretId=os.environ["SQL_DB_SECRET_ID"]
+)
+database_secrets = json.loads(secret_response["SecretString"])
+
+# Extract credentials
+host = database_secrets['host']
+dbname = database_secrets['dbname']
+username = database_secrets['username']
+password = database_secrets['password']
+port = database_secrets["port"]
+
+
+def sample_query_embeddings(db_connection, collection_id, num_queries):
+    with db_connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT embedding::text FROM langchain_pg_embedding"
+            " WHERE collection_id = %s ORDER BY random() LIMIT %s;",
+            (collection_id, num_queries),
+        )
+        return [json.loads(row[0]) for row in cursor.fetchall()]
+
+
+def exact_search(db_connection, collection_name, query_embedding, k):
+    # Sequential scan to get the ground truth neighbours.
+    with db_connection.cursor() as cursor:
+        cursor.execute("SET enable_indexscan = off;")
+    results = similarity_search(
+        db_connection, collection_name, query_embedding, k=k, precision="full"
+    )
+    with db_connection.cursor() as cursor:
+        cursor.execute("SET enable_indexscan = on;")
+    return results
+
+
+def benchmark_precision(db_connection, collection_name, queries, ground_truth, k, precision, rescore_factor):
+    latencies = []
+    recalls = []
+    for query_embedding, expected in zip(queries, ground_truth):
+        start = time.perf_counter()
+        results = similarity_search(
+            db_connection,
+            collection_name,
+            query_embedding,
+            k=k,
+            precision=precision,
+            rescore_factor=rescore_factor,
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        retrieved = {document for document, _, _ in results}
+        recalls.append(len(retrieved & expected) / len(expected))
+
+    latencies.sort()
+    return {
+        "precision": precision,
+        "rescore_factor": rescore_factor,
+        "p50_latency_ms": round(statistics.median(latencies), 2),
+        "p95_latency_ms": round(latencies[int(0.95 * (len(latencies) - 1))], 2),
+        f"recall@{k}": round(statistics.mean(recalls), 4),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--collection-name", default="agentic_assistant_vector_store")
+    parser.add_argument("--num-queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument(
+        "--precisions", nargs="+", choices=list(EMBEDDING_PRECISIONS),
+        default=list(EMBEDDING_PRECISIONS)
+    )
+    args = parser.parse_args()
+
+    db_connection = psycopg2.connect(
+        host=host,
+        port=port,
+        database=dbname,
+        user=username,
+        password=password,
+    )
+    collection_id = get_collection_id(db_connection, args.collection_name)
+    queries = sample_query_embeddings(db_connection, collection_id, args.num_queries)
+    ground_truth = [
+        {document for document, _, _ in exact_search(db_connection, args.collection_name, query, args.k)}
+        for query in queries
+    ]
+
+    results = []
+    for precision in args.precisions:
+        index_name = create_reduced_precision_index(db_connection, args.collection_name, precision)
+        index_size = get_index_size(db_connection, index_name)
+        for rescore_factor in (None, args.rescore_factor):
+            result = benchmark_precision(
+                db_connection,
+                args.collection_name,
+                queries,
+                ground_truth,
+                args.k,
+                precision,
+                rescore_factor,
+            )
+            result["index_size_mb"] = round(index_size / 1024**2, 2)
+            results.append(result)
+            print(result)
+
+    db_connection.close()
+    print(json.dumps(results, indent=2))
@@ -1,11 +1,21 @@
+import argparse
 import json
 import os
+import sys
 
 import boto3
-import dask.dataframe as dd
+from botocore.config import Config
+from langchain_aws import BedrockEmbeddings
 import psycopg2
 import sqlalchemy
 
+sys.path.append(os.path.abspath("."))
+from utils.sql_table_catalog import update_table_catalog
+from utils.sql_table_loader import load_sql_tables
+from utils.vector_precision import get_embedding_model_kwargs
+
+ssm = boto3.client("ssm")
+
 secretsmanager = boto3.client("secretsmanager")
 
 secret_response = secretsmanager.get_secret_value(
@@ -64,41 +74,40 @@ def test_db_connection():
     conn.close()
 
 
-def load_sql_tables(raw_tables_base_path, raw_tables_data_paths, columns_to_load, engine):
-    """Load csv files as SQL tables into an Amazon Aurora PostgreSQL DB.
-
-    Note:
-        raw_tables_data_paths (List, str): a list of strings, each string
-        can be a csv file, or a folder that contains a partitioned csv file.
-    """
-
-    for raw_table_path in raw_tables_data_paths:
-        data_loading_path = os.path.join(
-            raw_tables_base_path,
-            raw_table_path
-        )
-
-        if os.path.isdir(data_loading_path):
-            data_loading_path = os.path.join(data_loading_path, "*")
-            table_name = raw_table_path
-        else:
-            table_name = raw_table_path.split(".")[0]
-
-        print(f"Loading {table_name} data into a pandas dataframe")
-        current_data_df = dd.read_csv(data_loading_path).compute()
-        if columns_to_load == "all":
-            columns_to_load = current_data_df.columns
-
-        current_data_df = current_data_df[columns_to_load]
-
-        current_data_df.to_sql(
-            table_name, engine, if_exists='replace', index=False
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sql-load-workers", type=int, default=4,
+        help="Number of csv partitions of a SQL table loaded in parallel with COPY."
+    )
+    parser.add_argument(
+        "--sql-load-mode", choices=["replace", "upsert"], default="replace",
+        help="Swap in freshly loaded SQL tables, or upsert the csv rows on --sql-key-columns."
+    )
+    parser.add_argument(
+        "--sql-key-columns", nargs="+", default=None,
+        help="Columns identifying a row of the SQL tables, e.g. company year. Required to upsert."
+    )
+    parser.add_argument(
+        "--embedding-model-id", default=None,
+        help=(
+            "When set, embed the table descriptions into the SQL table catalog with this Bedrock model,"
+            " which must be the embedding model of the SQL assistant."
         )
-
-    return True
+    )
+    parser.add_argument(
+        "--embedding-dimensions", type=int, default=None,
+        help="Embedding size of the table catalog, must match the embedding dimensions of the SQL assistant."
+    )
+    parser.add_argument(
+        "--sql-table-descriptions", default=None,
+        help="JSON file mapping SQL table names to a description of their content, for the table catalog."
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_args()
     test_db_connection()
 
     url_object = sqlalchemy.URL.create(
@@ -117,11 +126,44 @@ if __name__ == "__main__":
     columns_to_load = "all"
 
     print(raw_sql_tables_base_path, tables_raw_data_paths)
-    load_sql_tables(
+    loaded_table_names = load_sql_tables(
         raw_sql_tables_base_path,
         tables_raw_data_paths,
         columns_to_load,
-        db_engine
+        db_engine,
+        max_workers=args.sql_load_workers,
+        mode=args.sql_load_mode,
+        key_columns=args.sql_key_columns,
     )
 
+    if args.embedding_model_id:
+        table_descriptions = None
+        if args.sql_table_descriptions:
+            with open(args.sql_table_descriptions, "r") as table_descriptions_file:
+                table_descriptions = json.load(table_descriptions_file)
+        bedrock_region_parameter = "/AgenticLLMAssistantWorkshop/bedrock_region"
+        BEDROCK_REGION = ssm.get_parameter(Name=bedrock_region_parameter)
+        BEDROCK_REGION = BEDROCK_REGION["Parameter"]["Value"]
+        retry_config = Config(
+            region_name=BEDROCK_REGION,
+            retries={"max_attempts": 10, "mode": "standard"}
+        )
+        embedding_model = BedrockEmbeddings(
+            model_id=args.embedding_model_id,
+            client=boto3.client("bedrock-runtime", config=retry_config),
+            model_kwargs=get_embedding_model_kwargs(
+                args.embedding_model_id, args.embedding_dimensions
+            )
+        )
+        catalog_db_connection = db_engine.raw_connection()
+        update_table_catalog(
+            catalog_db_connection,
+            loaded_table_names,
+            embedding_model,
+            args.embedding_model_id,
+            table_descriptions,
+            args.embedding_dimensions,
+        )
+        catalog_db_connection.close()
+
     test_db_connection()
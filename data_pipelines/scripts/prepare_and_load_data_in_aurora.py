@@ -1,16 +1,36 @@
+import argparse
 import json
 import os
+import sys
 from botocore.config import Config
 import boto3
-import dask.dataframe as dd
 from langchain_aws import BedrockEmbeddings
-from langchain.schema.document import Document
-from langchain.text_splitter import TokenTextSplitter
 from langchain_community.vectorstores.pgvector import PGVector
 
 import psycopg2
 import sqlalchemy
 
+sys.path.append(os.path.abspath("."))
+from utils.bedrock_calls import TokenBucketRateLimiter
+from utils.chunking import TokenChunker
+from utils.document_ingestion import (
+    add_ingestion_arguments,
+    check_ingestion_arguments,
+    index_processed_documents,
+)
+from utils.embedding import ConcurrentEmbedder
+from utils.embedding_cache import EmbeddingCache
+from utils.helpers import parse_s3_uri, s3_client
+from utils.sql_table_catalog import update_table_catalog
+from utils.sql_table_loader import load_sql_tables
+from utils.vector_precision import (
+    EMBEDDING_PRECISIONS,
+    create_reduced_precision_index,
+    get_embedding_model_kwargs,
+    get_index_size,
+    similarity_search,
+)
+
 ssm = boto3.client("ssm")
 
 secretsmanager = boto3.client("secretsmanager")
@@ -55,6 +75,12 @@ retry_config = Config(
 )
 bedrock_runtime = boto3.client("bedrock-runtime", config=retry_config)
 bedrock = boto3.client("bedrock", config=retry_config)
+# Throttling is handled by the adaptive rate limiter of the ConcurrentEmbedder,
+# so the client used for bulk embedding must not retry on its own.
+embedding_bedrock_runtime = boto3.client(
+    "bedrock-runtime",
+    config=Config(region_name=BEDROCK_REGION, retries={"total_max_attempts": 1, "mode": "standard"})
+)
 
 
 def activate_vector_extension(db_connection):
@@ -91,98 +117,47 @@ def test_db_connection():
     conn.close()
 
 
-def load_sql_tables(raw_tables_base_path, raw_tables_data_paths, columns_to_load, engine):
-    """Load csv files as SQL tables into an Amazon Aurora PostgreSQL DB.
-
-    Note:
-        raw_tables_data_paths (List, str): a list of strings, each string
-        can be a csv file, or a folder that contains a partitioned csv file.
-    """
-
-    for raw_table_path in raw_tables_data_paths:
-        data_loading_path = os.path.join(
-            raw_tables_base_path,
-            raw_table_path
-        )
-
-        if os.path.isdir(data_loading_path):
-            data_loading_path = os.path.join(data_loading_path, "*")
-            table_name = raw_table_path
-        else:
-            table_name = raw_table_path.split(".")[0]
-
-        print(f"Loading {table_name} data into a pandas dataframe")
-        current_data_df = dd.read_csv(data_loading_path).compute()
-        if columns_to_load == "all":
-            columns_to_load = current_data_df.columns
-
-        current_data_df = current_data_df[columns_to_load]
-
-        current_data_df.to_sql(
-            table_name, engine, if_exists='replace', index=False
-        )
-
-    return True
-
-
-def prepare_documents_with_metadata(documents_processed):
-
-    langchain_documents_text = []
-    langchain_documents_tables = []
-
-    for document in documents_processed:
-        document_name = document['name']
-        document_source_location = document['source_location']
-        document_s3_metadata = document['metadata']
-
-        mapping_to_original_page_numbers = {
-            idx: pg_num for idx, pg_num
-            in enumerate(document_s3_metadata["pages_kept"])
-        }
-        # remove pages_kept since we already put the original page number.
-        del document_s3_metadata["pages_kept"]
-
-        for page in document['pages']:
-            # Turn each page into a Langchain Document.
-            # Note: you could choose to also prepend part of the previous document
-            # and append part of the next document to include more context for documents
-            # that have many pages which continue their text on the next page.
-            current_metadata = {
-                'document_name': document_name,
-                'document_source_location': document_source_location,
-                'page_number': page['page'],
-                'original_page_number': mapping_to_original_page_numbers[page['page']]
-            }
-            # merge the document_s3_metadata into the langchain Document metadata
-            # to be able to use them for filtering.
-            current_metadata.update(document_s3_metadata)
-
-            langchain_documents_text.append(
-                Document(
-                    page_content=page['page_text'],
-                    metadata=current_metadata
-                )
-            )
-            # Turn all the tables of the pages into seperate Langchain Documents as well
-            # for table in page['page_tables']:
-            #     langchain_documents_tables.append(
-            #         Document(
-            #             page_content=table,
-            #             metadata=current_metadata
-            #         )
-            #     )
-
-    # return langchain_documents_text, langchain_documents_tables
-    return langchain_documents_text
-
-
-def load_processed_documents(json_file_path):
-    with open(json_file_path, 'rb') as file:
-        processed_documents = json.load(file)
-    return processed_documents
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--embedding-model-id", default="amazon.titan-embed-text-v1"
+    )
+    parser.add_argument(
+        "--embedding-dimensions", type=int, default=None,
+        help="Embedding size, only configurable for models such as Titan Text Embeddings V2."
+    )
+    parser.add_argument(
+        "--storage-precision", choices=list(EMBEDDING_PRECISIONS), default=None,
+        help="When set, build an HNSW index over the embeddings stored at this precision."
+    )
+    parser.add_argument(
+        "--rescore-factor", type=int, default=None,
+        help="Re-rank rescore_factor * k reduced precision candidates with full precision."
+    )
+    parser.add_argument(
+        "--sql-load-workers", type=int, default=4,
+        help="Number of csv partitions of a SQL table loaded in parallel with COPY."
+    )
+    parser.add_argument(
+        "--sql-load-mode", choices=["replace", "upsert"], default="replace",
+        help="Swap in freshly loaded SQL tables, or upsert the csv rows on --sql-key-columns."
+    )
+    parser.add_argument(
+        "--sql-key-columns", nargs="+", default=None,
+        help="Columns identifying a row of the SQL tables, e.g. company year. Required to upsert."
+    )
+    parser.add_argument(
+        "--sql-table-descriptions", default=None,
+        help="JSON file mapping SQL table names to a description of their content, for the table catalog."
+    )
+    add_ingestion_arguments(parser)
+    args = parser.parse_args()
+    check_ingestion_arguments(parser, args)
+    return args
 
 
 if __name__ == "__main__":
+    args = parse_args()
     print("Start")
     print("Test connection to db...", end="")
     test_db_connection()
@@ -197,14 +172,15 @@ if __name__ == "__main__":
     )
 
     input_data_base_path = "/opt/ml/processing/input/"
-    processed_docs_filename = "documents_processed.json"
+    processed_docs_filename = args.processed_documents_filename
     token_split_chunk_size = 512
     token_chunk_overlap = 64
     # Define an embedding model to generate embeddings
-    embedding_model_id = "amazon.titan-embed-text-v1"
+    embedding_model_id = args.embedding_model_id
     COLLECTION_NAME = 'agentic_assistant_vector_store'
-    # make this an argument.
-    pre_delete_collection = True
+    # By default only new and changed chunks are embedded, and the collection
+    # stays searchable during the run.
+    pre_delete_collection = args.full_reindex
 
     db_engine = sqlalchemy.create_engine(url_object)
 
@@ -217,29 +193,34 @@ if __name__ == "__main__":
     print(processed_documents_file_path)
 
     if os.path.isfile(processed_documents_file_path):
-        processed_documents = load_processed_documents(processed_documents_file_path)
-        langchain_documents_text = prepare_documents_with_metadata(
-            processed_documents
-        )
         # The chunk overlap duplicates some text across chunks
         # to prevent context from being lost between chunks.
-        # TODO: the following spliting uses tiktoken,
-        # create a custom one that use the tokenizer from anthropic.
-        text_splitter = TokenTextSplitter(
+        # The tokenizer is configurable with --tokenizer.
+        text_splitter = TokenChunker(
             chunk_size=token_split_chunk_size,
-            chunk_overlap=token_chunk_overlap
-        )
-
-        langchain_documents_text_chunked = text_splitter.split_documents(
-            langchain_documents_text
+            chunk_overlap=token_chunk_overlap,
+            tokenizer=args.tokenizer,
+            respect_markdown=args.chunk_respect_markdown,
+            processes=args.chunking_processes,
         )
 
         embedding_model = BedrockEmbeddings(
             model_id=embedding_model_id,
-            client=bedrock_runtime
+            client=bedrock_runtime,
+            model_kwargs=get_embedding_model_kwargs(
+                embedding_model_id, args.embedding_dimensions
+            )
         )
 
         activate_vector_extension(db_connection)
+        # activate_vector_extension closed the initial connection.
+        index_db_connection = psycopg2.connect(
+            host=host,
+            port=port,
+            database=dbname,
+            user=username,
+            password=password,
+        )
 
         pgvector_store = PGVector(
             collection_name=COLLECTION_NAME,
@@ -248,12 +229,75 @@ if __name__ == "__main__":
             pre_delete_collection=pre_delete_collection
         )
 
-        pgvector_store.add_documents(langchain_documents_text_chunked)
+        if args.embedding_cache_s3_uri:
+            cache_bucket_name, cache_prefix = parse_s3_uri(args.embedding_cache_s3_uri)
+            embedding_cache = EmbeddingCache.from_s3(
+                s3_client,
+                cache_bucket_name,
+                cache_prefix,
+                args.embedding_cache_dir,
+                embedding_model_id,
+                embedding_model.model_kwargs,
+            )
+        else:
+            embedding_cache = EmbeddingCache(
+                args.embedding_cache_dir, embedding_model_id, embedding_model.model_kwargs
+            )
+
+        embedder = ConcurrentEmbedder(
+            embedding_bedrock_runtime,
+            embedding_model_id,
+            model_kwargs=embedding_model.model_kwargs,
+            cache=embedding_cache,
+            max_workers=args.embedding_workers,
+            batch_size=args.embedding_batch_size,
+            rate_limiter=TokenBucketRateLimiter(
+                rate=args.embedding_workers, max_rate=args.embedding_max_rate
+            ),
+        )
+
+        # Pages are read, chunked, embedded and written as a stream.
+        index_processed_documents(
+            processed_documents_file_path,
+            text_splitter,
+            embedder,
+            pgvector_store,
+            index_db_connection,
+            COLLECTION_NAME,
+            incremental=not pre_delete_collection,
+            bulk_load=args.bulk_load,
+            deduplicate=args.deduplicate,
+            near_duplicate_threshold=args.near_duplicate_threshold,
+        )
+
+        if args.embedding_cache_s3_uri:
+            embedding_cache.upload_to_s3(s3_client, cache_bucket_name, cache_prefix)
+        embedding_cache.close()
 
         print("test indexing results")
         test_question = "Who were in the board of directors of Amazon in 2021 and what were their positions?"
         print(pgvector_store.similarity_search_with_score(test_question))
 
+        if args.storage_precision:
+            index_name = create_reduced_precision_index(
+                index_db_connection,
+                COLLECTION_NAME,
+                args.storage_precision,
+                args.embedding_dimensions
+            )
+            print(f"Index size: {get_index_size(index_db_connection, index_name)} bytes")
+            print(
+                similarity_search(
+                    index_db_connection,
+                    COLLECTION_NAME,
+                    embedding_model.embed_query(test_question),
+                    precision=args.storage_precision,
+                    rescore_factor=args.rescore_factor,
+                )
+            )
+
+        index_db_connection.close()
+
     else:
         raise ValueError(f"{processed_documents_file_path} must be a file.")
     
@@ -263,11 +307,30 @@ if __name__ == "__main__":
     columns_to_load = "all"
 
     print(raw_sql_tables_base_path, tables_raw_data_paths)
-    load_sql_tables(
+    loaded_table_names = load_sql_tables(
         raw_sql_tables_base_path,
         tables_raw_data_paths,
         columns_to_load,
-        db_engine
+        db_engine,
+        max_workers=args.sql_load_workers,
+        mode=args.sql_load_mode,
+        key_columns=args.sql_key_columns,
+    )
+
+    # The SQL assistant selects the tables of its prompts from this catalog.
+    table_descriptions = None
+    if args.sql_table_descriptions:
+        with open(args.sql_table_descriptions, "r") as table_descriptions_file:
+            table_descriptions = json.load(table_descriptions_file)
+    catalog_db_connection = db_engine.raw_connection()
+    update_table_catalog(
+        catalog_db_connection,
+        loaded_table_names,
+        embedding_model,
+        embedding_model_id,
+        table_descriptions,
+        args.embedding_dimensions,
     )
+    catalog_db_connection.close()
 
     test_db_connection()
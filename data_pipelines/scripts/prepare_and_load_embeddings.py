@@ -1,15 +1,34 @@
+import argparse
 import json
 import os
+import sys
 from botocore.config import Config
 import boto3
 from langchain.embeddings import BedrockEmbeddings
-from langchain.schema.document import Document
-from langchain.text_splitter import TokenTextSplitter
 from langchain.vectorstores.pgvector import PGVector
 
 import psycopg2
 import sqlalchemy
 
+sys.path.append(os.path.abspath("."))
+from utils.bedrock_calls import TokenBucketRateLimiter
+from utils.chunking import TokenChunker
+from utils.document_ingestion import (
+    add_ingestion_arguments,
+    check_ingestion_arguments,
+    index_processed_documents,
+)
+from utils.embedding import ConcurrentEmbedder
+from utils.embedding_cache import EmbeddingCache
+from utils.helpers import parse_s3_uri, s3_client
+from utils.vector_precision import (
+    EMBEDDING_PRECISIONS,
+    create_reduced_precision_index,
+    get_embedding_model_kwargs,
+    get_index_size,
+    similarity_search,
+)
+
 ssm = boto3.client("ssm")
 
 secretsmanager = boto3.client("secretsmanager")
@@ -54,6 +73,12 @@ retry_config = Config(
 )
 bedrock_runtime = boto3.client("bedrock-runtime", config=retry_config)
 bedrock = boto3.client("bedrock", config=retry_config)
+# Throttling is handled by the adaptive rate limiter of the ConcurrentEmbedder,
+# so the client used for bulk embedding must not retry on its own.
+embedding_bedrock_runtime = boto3.client(
+    "bedrock-runtime",
+    config=Config(region_name=BEDROCK_REGION, retries={"total_max_attempts": 1, "mode": "standard"})
+)
 
 
 def activate_vector_extension(db_connection):
@@ -90,64 +115,31 @@ def test_db_connection():
     conn.close()
 
 
-def prepare_documents_with_metadata(documents_processed):
-
-    langchain_documents_text = []
-    langchain_documents_tables = []
-
-    for document in documents_processed:
-        document_name = document['name']
-        document_source_location = document['source_location']
-        document_s3_metadata = document['metadata']
-
-        mapping_to_original_page_numbers = {
-            idx: pg_num for idx, pg_num
-            in enumerate(document_s3_metadata["pages_kept"])
-        }
-        # remove pages_kept since we already put the original page number.
-        del document_s3_metadata["pages_kept"]
-
-        for page in document['pages']:
-            # Turn each page into a Langchain Document.
-            # Note: you could choose to also prepend part of the previous document
-            # and append part of the next document to include more context for documents
-            # that have many pages which continue their text on the next page.
-            current_metadata = {
-                'document_name': document_name,
-                'document_source_location': document_source_location,
-                'page_number': page['page'],
-                'original_page_number': mapping_to_original_page_numbers[page['page']]
-            }
-            # merge the document_s3_metadata into the langchain Document metadata
-            # to be able to use them for filtering.
-            current_metadata.update(document_s3_metadata)
-
-            langchain_documents_text.append(
-                Document(
-                    page_content=page['page_text'],
-                    metadata=current_metadata
-                )
-            )
-            # Turn all the tables of the pages into seperate Langchain Documents as well
-            # for table in page['page_tables']:
-            #     langchain_documents_tables.append(
-            #         Document(
-            #             page_content=table,
-            #             metadata=current_metadata
-            #         )
-            #     )
-
-    # return langchain_documents_text, langchain_documents_tables
-    return langchain_documents_text
-
-
-def load_processed_documents(json_file_path):
-    with open(json_file_path, 'rb') as file:
-        processed_documents = json.load(file)
-    return processed_documents
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--embedding-model-id", default="amazon.titan-embed-text-v1"
+    )
+    parser.add_argument(
+        "--embedding-dimensions", type=int, default=None,
+        help="Embedding size, only configurable for models such as Titan Text Embeddings V2."
+    )
+    parser.add_argument(
+        "--storage-precision", choices=list(EMBEDDING_PRECISIONS), default=None,
+        help="When set, build an HNSW index over the embeddings stored at this precision."
+    )
+    parser.add_argument(
+        "--rescore-factor", type=int, default=None,
+        help="Re-rank rescore_factor * k reduced precision candidates with full precision."
+    )
+    add_ingestion_arguments(parser)
+    args = parser.parse_args()
+    check_ingestion_arguments(parser, args)
+    return args
 
 
 if __name__ == "__main__":
+    args = parse_args()
     test_db_connection()
 
     url_object = sqlalchemy.URL.create(
@@ -159,14 +151,15 @@ if __name__ == "__main__":
     )
 
     input_data_base_path = "/opt/ml/processing/input/"
-    processed_docs_filename = "documents_processed.json"
+    processed_docs_filename = args.processed_documents_filename
     token_split_chunk_size = 512
     token_chunk_overlap = 64
     # Define an embedding model to generate embeddings
-    embedding_model_id = "amazon.titan-embed-text-v1"
+    embedding_model_id = args.embedding_model_id
     COLLECTION_NAME = 'agentic_assistant_vector_store'
-    # make this an argument.
-    pre_delete_collection = True
+    # By default only new and changed chunks are embedded, and the collection
+    # stays searchable during the run.
+    pre_delete_collection = args.full_reindex
 
     db_engine = sqlalchemy.create_engine(url_object)
 
@@ -179,29 +172,34 @@ if __name__ == "__main__":
     print(processed_documents_file_path)
 
     if os.path.isfile(processed_documents_file_path):
-        processed_documents = load_processed_documents(processed_documents_file_path)
-        langchain_documents_text = prepare_documents_with_metadata(
-            processed_documents
-        )
         # The chunk overlap duplicates some text across chunks
         # to prevent context from being lost between chunks.
-        # TODO: the following spliting uses tiktoken,
-        # create a custom one that use the tokenizer from anthropic.
-        text_splitter = TokenTextSplitter(
+        # The tokenizer is configurable with --tokenizer.
+        text_splitter = TokenChunker(
             chunk_size=token_split_chunk_size,
-            chunk_overlap=token_chunk_overlap
-        )
-
-        langchain_documents_text_chunked = text_splitter.split_documents(
-            langchain_documents_text
+            chunk_overlap=token_chunk_overlap,
+            tokenizer=args.tokenizer,
+            respect_markdown=args.chunk_respect_markdown,
+            processes=args.chunking_processes,
         )
 
         embedding_model = BedrockEmbeddings(
             model_id=embedding_model_id,
-            client=bedrock_runtime
+            client=bedrock_runtime,
+            model_kwargs=get_embedding_model_kwargs(
+                embedding_model_id, args.embedding_dimensions
+            )
         )
 
         activate_vector_extension(db_connection)
+        # activate_vector_extension closed the initial connection.
+        index_db_connection = psycopg2.connect(
+            host=host,
+            port=port,
+            database=dbname,
+            user=username,
+            password=password,
+        )
 
         pgvector_store = PGVector(
             collection_name=COLLECTION_NAME,
@@ -210,12 +208,75 @@ if __name__ == "__main__":
             pre_delete_collection=pre_delete_collection
         )
 
-        pgvector_store.add_documents(langchain_documents_text_chunked)
+        if args.embedding_cache_s3_uri:
+            cache_bucket_name, cache_prefix = parse_s3_uri(args.embedding_cache_s3_uri)
+            embedding_cache = EmbeddingCache.from_s3(
+                s3_client,
+                cache_bucket_name,
+                cache_prefix,
+                args.embedding_cache_dir,
+                embedding_model_id,
+                embedding_model.model_kwargs,
+            )
+        else:
+            embedding_cache = EmbeddingCache(
+                args.embedding_cache_dir, embedding_model_id, embedding_model.model_kwargs
+            )
+
+        embedder = ConcurrentEmbedder(
+            embedding_bedrock_runtime,
+            embedding_model_id,
+            model_kwargs=embedding_model.model_kwargs,
+            cache=embedding_cache,
+            max_workers=args.embedding_workers,
+            batch_size=args.embedding_batch_size,
+            rate_limiter=TokenBucketRateLimiter(
+                rate=args.embedding_workers, max_rate=args.embedding_max_rate
+            ),
+        )
+
+        # Pages are read, chunked, embedded and written as a stream.
+        index_processed_documents(
+            processed_documents_file_path,
+            text_splitter,
+            embedder,
+            pgvector_store,
+            index_db_connection,
+            COLLECTION_NAME,
+            incremental=not pre_delete_collection,
+            bulk_load=args.bulk_load,
+            deduplicate=args.deduplicate,
+            near_duplicate_threshold=args.near_duplicate_threshold,
+        )
+
+        if args.embedding_cache_s3_uri:
+            embedding_cache.upload_to_s3(s3_client, cache_bucket_name, cache_prefix)
+        embedding_cache.close()
 
         print("test indexing results")
         test_question = "Who were in the board of directors of Amazon in 2021 and what were their positions?"
         print(pgvector_store.similarity_search_with_score(test_question))
 
+        if args.storage_precision:
+            index_name = create_reduced_precision_index(
+                index_db_connection,
+                COLLECTION_NAME,
+                args.storage_precision,
+                args.embedding_dimensions
+            )
+            print(f"Index size: {get_index_size(index_db_connection, index_name)} bytes")
+            print(
+                similarity_search(
+                    index_db_connection,
+                    COLLECTION_NAME,
+                    embedding_model.embed_query(test_question),
+                    precision=args.storage_precision,
+                    rescore_factor=args.rescore_factor,
+                )
+            )
+
+        index_db_connection.close()
+
     else:
         raise ValueError(f"{processed_documents_file_path} must be a file.")
 
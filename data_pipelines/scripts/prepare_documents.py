@@ -1,17 +1,23 @@
+import argparse
+import glob
 import json
-from pypdf import PdfReader, PdfWriter
-import shutil
 import os
 from textractor import Textractor
 from textractor.data.constants import TextractFeatures
 import boto3
 import logging
-from botocore.exceptions import ClientError
-import requests
+from botocore.config import Config
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append(os.path.abspath("."))
-from utils.helpers import store_list_to_s3
+from utils.checkpoints import CheckpointStore, checkpoint_key
+from utils.downloader import VALIDATORS_SUFFIX, PDFDownloader, report_downloads
+from utils.helpers import store_jsonl_to_s3
+from utils.markdown_cleanup import CLEANUP_STAGE, MarkdownCleaner
+from utils.pdf_pages import PAGE_SELECTION_FILENAME, file_sha256, select_pages_in_documents
+from utils.textract_jobs import TextractJobOrchestrator
 
 import sagemaker
 
@@ -20,17 +26,18 @@ default_sagemaker_bucket = sagemaker.Session().default_bucket()
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-def download_pdf_files(base_directory, docs_mapping, headers):
-    # Create the base directory if it doesn't exist
-    if not os.path.exists(base_directory):
-        os.makedirs(base_directory)
+STAGES = ("download", "pages", "textract", "cleanup", "upload")
+TEXTRACT_STAGE = "textract"
+UPLOAD_STAGE = "upload"
 
+def download_pdf_files(base_directory, docs_mapping, headers, max_workers=8):
+    """Download the reports concurrently, skipping the ones that did not change."""
+    downloads = []
     for company, docs in docs_mapping.items():
         company_directory = os.path.join(base_directory, company)
 
         # Create a directory for the company if it doesn't exist
-        if not os.path.exists(company_directory):
-            os.makedirs(company_directory)
+        os.makedirs(company_directory, exist_ok=True)
 
         for doc_info in docs:
             doc_url = doc_info["doc_url"]
@@ -42,142 +49,75 @@ def download_pdf_files(base_directory, docs_mapping, headers):
 
             # Construct the filename based on the year and the URL
             filename = f"annual_report_{year}.pdf"
-            file_path = os.path.join(company_directory, filename)
-
-            # Check if the file already exists
-            if os.path.exists(file_path):
-                print(f"{filename} already exists for {company}")
-            else:
-                # Download the document
-                response = requests.get(doc_url, headers=headers)
-
-                if response.status_code == 200:
-                    with open(file_path, "wb") as file:
-                        file.write(response.content)
-                    print(f"Downloaded {filename} for {company}")
-                else:
-                    print(
-                        f"Failed to download {filename} for {company}"
-                        f" (Status Code: {response.status_code})"
-                    )
-
-def keep_relevant_pages_in_pdf(input_pdf_path, output_pdf_path, pages):
-    input_pdf = PdfReader(input_pdf_path)
-    print(f"Number of pages is {len(input_pdf.pages)}")
-    print(f"Relevant pages are {pages}")
-    output_pdf = PdfWriter()
-
-    for page_num in pages:
-        output_pdf.add_page(input_pdf.pages[page_num - 1])
-
-    with open(output_pdf_path, "wb") as f:
-        output_pdf.write(f)
+            downloads.append((doc_url, os.path.join(company_directory, filename)))
 
+    downloader = PDFDownloader(headers=headers, max_workers=max_workers)
+    start = time.perf_counter()
+    results = downloader.download_all(downloads)
+    print(report_downloads(results, time.perf_counter() - start))
+    return results
 
 def save_json(json_data, file_path):
     with open(file_path, "w") as f:
         json.dump(json_data, f)
 
 def keep_relevant_pages_in_pdfs(
-    raw_base_directory, prepared_base_directory, docs_mapping
+    raw_base_directory, prepared_base_directory, docs_mapping, processes=None
 ):
-    metadata = []
+    """Keep the relevant pages of each document in a process pool, skipping unchanged documents."""
     # Create the base directory if it doesn't exist
-    if not os.path.exists(prepared_base_directory):
-        os.makedirs(prepared_base_directory)
+    os.makedirs(prepared_base_directory, exist_ok=True)
 
+    documents = []
     for company, docs in docs_mapping.items():
         raw_company_directory = os.path.join(raw_base_directory, company)
         prepared_company_directory = os.path.join(prepared_base_directory, company)
 
         # Create a directory for the company if it doesn't exist
-        if not os.path.exists(prepared_company_directory):
-            os.makedirs(prepared_company_directory)
+        os.makedirs(prepared_company_directory, exist_ok=True)
 
         for doc_info in docs:
             doc_url = doc_info["doc_url"]
             year = doc_info["year"]
             pages = doc_info.get("pages", [])
+            # Skip empty URLs
             if not doc_url:
                 continue
 
-            current_metadata = {}
-            current_metadata["company"] = company
-            current_metadata["year"] = year
-            current_metadata["doc_url"] = doc_url
-
             # Construct the filename based on the year and the URL
             filename = f"annual_report_{year}.pdf"
             input_pdf_path = os.path.join(raw_company_directory, filename)
             output_pdf_path = os.path.join(prepared_company_directory, filename)
 
-            current_metadata["local_pdf_path"] = output_pdf_path
-
-            if not pages:
-                # When page numbers are not defined, we assume the user wants
-                # to process the full file, therefore, copy it as is
-                # to the prepared folder
-                shutil.copyfile(input_pdf_path, output_pdf_path)
-                metadata.append(current_metadata)
-                continue
-
-            relevant_pages = doc_info["pages"]
-            current_metadata["pages_kept"] = relevant_pages
-
-            # Skip empty URLs
-
-            keep_relevant_pages_in_pdf(input_pdf_path, output_pdf_path, relevant_pages)
-
-            metadata.append(current_metadata)
+            current_metadata = {
+                "company": company,
+                "year": year,
+                "doc_url": doc_url,
+                "local_pdf_path": output_pdf_path,
+            }
+            if pages:
+                current_metadata["pages_kept"] = pages
+            documents.append((input_pdf_path, output_pdf_path, pages, current_metadata))
+
+    num_skipped = 0
+    start = time.perf_counter()
+    for current_metadata, selection in select_pages_in_documents(
+        documents, prepared_base_directory, processes
+    ):
+        num_skipped += selection["skipped"]
+        status = "unchanged" if selection["skipped"] else f"done in {selection['seconds']:.1f}s"
+        print(f"{current_metadata['local_pdf_path']}: {status}")
+    print(
+        f"Selected pages of {len(documents)} documents ({num_skipped} unchanged)"
+        f" in {time.perf_counter() - start:.1f}s"
+    )
 
+    # Keep the documents order in metadata.json.
+    metadata = [current_metadata for _, _, _, current_metadata in documents]
     save_json(metadata, os.path.join(prepared_base_directory, "metadata.json"))
 
     return True
 
-def extract_documents():
-    region = boto3.session.Session().region_name
-    # extractor = Textractor(profile_name="default")
-    extractor = Textractor(region_name=region)
-
-    input_document = "raw_documents/prepared/Amazon/annual_report_2022.pdf"
-
-    document = extractor.start_document_analysis(
-        file_source=input_document,
-        s3_upload_path=f"s3://{default_sagemaker_bucket}/input_documents/",
-        s3_output_path=f"s3://{default_sagemaker_bucket}/output_documents/",
-        features=[TextractFeatures.LAYOUT],
-        save_image=False
-    )
-
-def generate_message(bedrock_runtime, model_id, system_prompt, messages, max_tokens):
-
-    body=json.dumps(
-        {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": max_tokens,
-            "system": system_prompt,
-            "messages": messages
-        }
-    )
-    response = bedrock_runtime.invoke_model(body=body, modelId=model_id)
-    response_body = json.loads(response.get('body').read())
-
-    return response_body
-
-
-def call_llm(user_input, model_id, system_prompt, bedrock_runtime, max_tokens=1000):
-    """Handle calls to Anthropic Claude message api."""
-    try:
-        # Prompt with user turn only.
-        user_message =  {"role": "user", "content": user_input}
-        messages = [user_message]
-        return generate_message(bedrock_runtime, model_id, system_prompt, messages, max_tokens)
-    except ClientError as err:
-        message=err.response["Error"]["Message"]
-        logger.error("A client error occurred: %s", message)
-        print("A client error occured: " +
-            format(message))
-
 user_prompt = """
 Improve the markdown while keeping all original information. Put the improved markdown inside a <results> xml tags with no explanation:
 \n{markdown_doc}
@@ -186,42 +126,129 @@ Improve the markdown while keeping all original information. Put the improved ma
 system_prompt = "Your task is to review and improve the results of Amazon textract in markdown."
 
 
-def improve_textract_markdown_output(document, llm_model_id):
-    improved_markdown = []
-    for i in range(len(document.pages)):
-        user_input = user_prompt.format(markdown_doc=document.pages[i].to_markdown())
-        result = call_llm(user_input, llm_model_id, system_prompt, bedrock_runtime, max_tokens=3000)
-        # Extract the text between the <results> XML tags only.
-        improved_markdown.append(result["content"][0]["text"].split("<results>")[-1].split("</results>")[0].strip())
-    return improved_markdown
-
-def extract_pages_as_markdown(input_document):
-    extractor = Textractor()
-    document = extractor.start_document_analysis(
-        file_source=input_document,
-        s3_upload_path=f"s3://{default_sagemaker_bucket}/input_documents/",
-        s3_output_path=f"s3://{default_sagemaker_bucket}/output_documents/",
-        features=[TextractFeatures.LAYOUT],
-        save_image=False
-    )
+def textract_checkpoint_key(doc_meta, features):
+    """Key of the Textract output of a document, from the bytes of its prepared pdf and the features."""
+    return checkpoint_key(file_sha256(doc_meta["local_pdf_path"]), sorted(feature.name for feature in features))
 
-    res = improve_textract_markdown_output(document, llm_model_id)
-    pages = [{"page": indx, "page_text": text} for indx, text in enumerate(res)]
-    return pages
 
+def clean_pages_markdown(pages_markdown, markdown_cleaner, run_cleanup=True):
+    if run_cleanup:
+        pages_markdown = markdown_cleaner.improve_pages(pages_markdown)
+    return [{"page": indx, "page_text": text} for indx, text in enumerate(pages_markdown)]
+
+
+def extract_docs_into_markdown(
+    docs_metadata,
+    checkpoints,
+    markdown_cleaner,
+    extractor=None,
+    run_textract=True,
+    run_cleanup=True,
+    max_concurrent_jobs=10,
+    cleanup_workers=4,
+):
+    """Extract the documents with Textract and clean up their markdown, reusing checkpointed outputs.
+
+    The Textract markdown of each document is checkpointed under the hash of
+    its prepared pdf, so only new or changed documents start a Textract job.
+    The jobs run concurrently and each document is cleaned up as soon as its
+    job succeeds, while the checkpointed documents are cleaned up in their
+    own thread pool.
+    """
+    features = [TextractFeatures.LAYOUT]
+    docs_pages = [None] * len(docs_metadata)
+    keys = [textract_checkpoint_key(doc_meta, features) for doc_meta in docs_metadata]
+    checkpointed_pages = [checkpoints.get(TEXTRACT_STAGE, key) for key in keys]
+    to_extract = [index for index, pages_markdown in enumerate(checkpointed_pages) if pages_markdown is None]
+    print(f"Textract: {len(docs_metadata) - len(to_extract)} of {len(docs_metadata)} documents from checkpoints")
+    if to_extract and not run_textract:
+        raise ValueError(
+            "The textract stage is needed, no Textract checkpoint for: "
+            + ", ".join(docs_metadata[index]["local_pdf_path"] for index in to_extract)
+        )
+
+    def post_process(document, index):
+        pages_markdown = [page.to_markdown() for page in document.pages]
+        checkpoints.put(TEXTRACT_STAGE, keys[index], pages_markdown)
+        return clean_pages_markdown(pages_markdown, markdown_cleaner, run_cleanup)
+
+    with ThreadPoolExecutor(max_workers=cleanup_workers) as cleanup_executor:
+        # Cleaned up in the background, so that the Textract jobs start right away.
+        checkpointed_cleanups = {
+            index: cleanup_executor.submit(
+                clean_pages_markdown, pages_markdown, markdown_cleaner, run_cleanup
+            )
+            for index, pages_markdown in enumerate(checkpointed_pages)
+            if pages_markdown is not None
+        }
+
+        if to_extract:
+            orchestrator = TextractJobOrchestrator(
+                extractor or Textractor(),
+                start_kwargs=dict(
+                    s3_upload_path=f"s3://{default_sagemaker_bucket}/input_documents/",
+                    s3_output_path=f"s3://{default_sagemaker_bucket}/output_documents/",
+                    features=features,
+                    save_image=False,
+                ),
+                post_process=post_process,
+                max_concurrent_jobs=max_concurrent_jobs,
+                post_process_workers=cleanup_workers,
+            )
+            extracted_pages = orchestrator.run(
+                to_extract, lambda index: docs_metadata[index]["local_pdf_path"]
+            )
+            for index, pages in zip(to_extract, extracted_pages):
+                docs_pages[index] = pages
+
+        for index, future in checkpointed_cleanups.items():
+            docs_pages[index] = future.result()
 
-def extract_docs_into_markdown(docs_metadata):
     results = []
-    for doc_meta in docs_metadata:
+    for doc_meta, pages in zip(docs_metadata, docs_pages):
         doc_result_with_metadata = {}
         doc_result_with_metadata["metadata"] = doc_meta
         doc_result_with_metadata["name"] = doc_meta["doc_url"].split("/")[-1]
         doc_result_with_metadata["source_location"] = doc_meta["doc_url"]
-        doc_result_with_metadata["pages"] = extract_pages_as_markdown(doc_meta["local_pdf_path"])
+        doc_result_with_metadata["pages"] = pages
         results.append(doc_result_with_metadata)
     return results
 
 
+def upload_results(results, checkpoints, s3_bucket_name, processed_documents_s3_key, s3_client=None):
+    """Store the processed documents in S3, unless the same results were already uploaded there.
+
+    The documents are streamed one per line, compressed according to the key
+    suffix, e.g. `.jsonl.gz`, in the JSONL format read by `iter_processed_pages`.
+    """
+    key = checkpoint_key(s3_bucket_name, processed_documents_s3_key, json.dumps(results, sort_keys=True))
+    if checkpoints.get(UPLOAD_STAGE, key) is not None:
+        print(f"s3://{s3_bucket_name}/{processed_documents_s3_key} is up to date, skipping the upload")
+        return False
+    store_jsonl_to_s3(s3_bucket_name, processed_documents_s3_key, results, client=s3_client)
+    checkpoints.put(UPLOAD_STAGE, key, {"bucket": s3_bucket_name, "key": processed_documents_s3_key})
+    return True
+
+
+def invalidate_stages(stages, checkpoints, raw_base_directory, prepared_base_directory):
+    """Drop the saved state of stages, so they rerun from scratch."""
+    if "download" in stages:
+        validators_paths = glob.glob(
+            os.path.join(raw_base_directory, "**", f"*{VALIDATORS_SUFFIX}"), recursive=True
+        )
+        for validators_path in validators_paths:
+            os.remove(validators_path)
+        print(f"Invalidated the validators of {len(validators_paths)} downloads")
+    if "pages" in stages:
+        selection_path = os.path.join(prepared_base_directory, PAGE_SELECTION_FILENAME)
+        if os.path.exists(selection_path):
+            os.remove(selection_path)
+            print(f"Invalidated {selection_path}")
+    for stage in (TEXTRACT_STAGE, CLEANUP_STAGE, UPLOAD_STAGE):
+        if stage in stages:
+            checkpoints.invalidate(stage)
+
+
 docs_mapping = {
     "Amazon": [
         {
@@ -238,31 +265,88 @@ docs_mapping = {
     ]
 }
 
-bedrock_runtime = boto3.client("bedrock-runtime", region_name="us-west-2")
+# Retries are left to the markdown cleaner, which slows down when throttled
+# and retries the transient errors.
+bedrock_runtime = boto3.client(
+    "bedrock-runtime", region_name="us-west-2", config=Config(retries={"total_max_attempts": 1})
+)
 llm_model_id = "anthropic.claude-3-sonnet-20240229-v1:0"
+# Maximum number of concurrent LLM calls cleaning up the Textract markdown.
+llm_max_concurrency = 4
+# Maximum number of Textract jobs in progress, keep it below the Textract quota of the account.
+textract_max_concurrent_jobs = 10
 
 
 if __name__ == "__main__":
-    raw_base_directory = "raw_documents"
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--stages", nargs="+", choices=STAGES, default=list(STAGES),
+        help="Stages to run, the other stages reuse their previous outputs."
+    )
+    parser.add_argument(
+        "--invalidate", nargs="+", choices=STAGES, default=[],
+        help="Stages whose saved outputs are dropped before running."
+    )
+    parser.add_argument("--raw-base-directory", default="raw_documents")
+    parser.add_argument(
+        "--checkpoint-dir", default=None,
+        help="Folder of the Textract, cleanup and upload checkpoints, <raw-base-directory>/checkpoints by default."
+    )
+    parser.add_argument("--llm-max-concurrency", type=int, default=llm_max_concurrency)
+    parser.add_argument("--textract-max-concurrent-jobs", type=int, default=textract_max_concurrent_jobs)
+    args = parser.parse_args()
+
+    raw_base_directory = args.raw_base_directory
     if not os.path.exists(raw_base_directory):
         os.makedirs(raw_base_directory)
-    
+
     prepared_base_directory = os.path.join(raw_base_directory, "prepared/")
+    processed_documents_path = os.path.join(raw_base_directory, "documents_processed.json")
+    checkpoints = CheckpointStore(args.checkpoint_dir or os.path.join(raw_base_directory, "checkpoints"))
+    invalidate_stages(args.invalidate, checkpoints, raw_base_directory, prepared_base_directory)
+
+    markdown_cleaner = MarkdownCleaner(
+        bedrock_runtime,
+        llm_model_id,
+        system_prompt,
+        user_prompt,
+        max_concurrency=args.llm_max_concurrency,
+        max_tokens=3000,
+        checkpoints=checkpoints,
+    )
+
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
     }
-    download_pdf_files(raw_base_directory, docs_mapping, headers)
-
-    keep_relevant_pages_in_pdfs(raw_base_directory, prepared_base_directory, docs_mapping)
-    with open(
-        os.path.join(prepared_base_directory, "metadata.json"), "r"
-    ) as prepared_pdfs_metadata_obj:
-        prepared_pdfs_metadata = json.load(prepared_pdfs_metadata_obj)
-    results = extract_docs_into_markdown(prepared_pdfs_metadata)
-    ssm = boto3.client("ssm")
-    s3_bucket_name_parameter = "/AgenticLLMAssistantWorkshop/AgentDataBucketParameter"
-    s3_bucket_name = ssm.get_parameter(Name=s3_bucket_name_parameter)
-    s3_bucket_name = s3_bucket_name["Parameter"]["Value"]
-    processed_documents_s3_key = "documents_processed.json"
-    store_list_to_s3(s3_bucket_name, processed_documents_s3_key, results)
-    print("Done!")
\ No newline at end of file
+    if "download" in args.stages:
+        download_pdf_files(raw_base_directory, docs_mapping, headers)
+
+    if "pages" in args.stages:
+        keep_relevant_pages_in_pdfs(raw_base_directory, prepared_base_directory, docs_mapping)
+
+    if "textract" in args.stages or "cleanup" in args.stages:
+        with open(
+            os.path.join(prepared_base_directory, "metadata.json"), "r"
+        ) as prepared_pdfs_metadata_obj:
+            prepared_pdfs_metadata = json.load(prepared_pdfs_metadata_obj)
+        results = extract_docs_into_markdown(
+            prepared_pdfs_metadata,
+            checkpoints,
+            markdown_cleaner,
+            run_textract="textract" in args.stages,
+            run_cleanup="cleanup" in args.stages,
+            max_concurrent_jobs=args.textract_max_concurrent_jobs,
+        )
+        print(markdown_cleaner.report())
+        save_json(results, processed_documents_path)
+
+    if "upload" in args.stages:
+        with open(processed_documents_path, "r") as processed_documents_obj:
+            results = json.load(processed_documents_obj)
+        ssm = boto3.client("ssm")
+        s3_bucket_name_parameter = "/AgenticLLMAssistantWorkshop/AgentDataBucketParameter"
+        s3_bucket_name = ssm.get_parameter(Name=s3_bucket_name_parameter)
+        s3_bucket_name = s3_bucket_name["Parameter"]["Value"]
+        processed_documents_s3_key = "documents_processed.jsonl.gz"
+        upload_results(results, checkpoints, s3_bucket_name, processed_documents_s3_key)
+    print("Done!")
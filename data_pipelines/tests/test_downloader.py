@@ -0,0 +1,132 @@
+"""Test the PDFDownloader against a local `http.server`.
+
+Run from the data_pipelines folder: python -m pytest tests
+"""
+import glob
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.downloader import VALIDATORS_SUFFIX, PDFDownloader  # noqa: E402
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    """Serve `server.body` with `server.etag`, honouring If-None-Match."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if server.failures_left:
+            server.failures_left -= 1
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == server.etag:
+            self.send_response(304)
+            self.send_header("ETag", server.etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", server.etag)
+        self.send_header("Content-Type", "application/pdf")
+        if server.truncate:
+            # Announce the full body but close the connection halfway through it.
+            self.send_header("Content-Length", str(len(server.body)))
+            self.end_headers()
+            self.wfile.write(server.body[: len(server.body) // 2])
+            self.close_connection = True
+            return
+        self.send_header("Content-Length", str(len(server.body)))
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PDFDownloaderTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ReportHandler)
+        self.server.body = b"%PDF-1.4 first version" * 1000
+        self.server.etag = '"v1"'
+        self.server.failures_left = 0
+        self.server.truncate = False
+        self.server.requests = []
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/report.pdf"
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, "report.pdf")
+        self.downloader = PDFDownloader(max_workers=2, max_retries=1, backoff_factor=0.01, chunk_size=1024)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def read_file(self):
+        with open(self.file_path, "rb") as file:
+            return file.read()
+
+    def assert_no_partial_files(self):
+        self.assertEqual(glob.glob(os.path.join(self.directory.name, "*.part")), [])
+
+    def test_unchanged_report_is_not_downloaded_again(self):
+        result = self.downloader.download(self.url, self.file_path)
+        self.assertEqual(result["status"], "downloaded")
+        self.assertEqual(self.read_file(), self.server.body)
+        with open(self.file_path + VALIDATORS_SUFFIX) as validators_file:
+            self.assertEqual(json.load(validators_file)["etag"], '"v1"')
+
+        result = self.downloader.download(self.url, self.file_path)
+        self.assertEqual(result["status"], "not_modified")
+        self.assertEqual(result["bytes"], 0)
+        self.assertEqual(self.server.requests[-1].get("If-None-Match"), '"v1"')
+
+    def test_changed_report_replaces_the_file(self):
+        self.downloader.download(self.url, self.file_path)
+        self.server.body = b"%PDF-1.4 second version" * 1000
+        self.server.etag = '"v2"'
+
+        result = self.downloader.download(self.url, self.file_path)
+        self.assertEqual(result["status"], "downloaded")
+        self.assertEqual(self.read_file(), self.server.body)
+        self.assert_no_partial_files()
+
+    def test_interrupted_download_keeps_the_previous_file(self):
+        self.downloader.download(self.url, self.file_path)
+        previous_body = self.server.body
+        self.server.body = b"%PDF-1.4 second version" * 1000
+        self.server.etag = '"v2"'
+        self.server.truncate = True
+
+        result = self.downloader.download(self.url, self.file_path)
+        self.assertEqual(result["status"], "failed")
+        self.assertEqual(self.read_file(), previous_body)
+        self.assert_no_partial_files()
+
+    def test_server_errors_are_retried_once_per_attempt(self):
+        self.server.failures_left = 1
+        result = self.downloader.download(self.url, self.file_path)
+        self.assertEqual(result["status"], "downloaded")
+        # A single retry layer: one failed request and one successful retry.
+        self.assertEqual(len(self.server.requests), 2)
+
+        self.server.failures_left = 2
+        os.remove(self.file_path)
+        result = self.downloader.download(self.url, self.file_path)
+        self.assertEqual(result["status"], "failed")
+        self.assertEqual(len(self.server.requests), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
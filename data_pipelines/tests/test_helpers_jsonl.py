@@ -0,0 +1,129 @@
+"""Test the streaming JSONL helpers against an in-memory S3 client.
+
+Run from the data_pipelines folder: python -m pytest tests
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.helpers import MIN_MULTIPART_PART_SIZE, iter_jsonl_from_s3, store_jsonl_to_s3  # noqa: E402
+
+
+class FakeS3Client:
+    """Keep objects in memory, with the multipart upload and ranged GET calls of the helpers."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted_uploads = []
+        self.range_requests = []
+        self.num_parts = {}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = f"upload-{len(self.uploads)}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": hashlib.md5(Body).hexdigest()}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        for part in MultipartUpload["Parts"][:-1]:
+            assert len(parts[part["PartNumber"]]) >= MIN_MULTIPART_PART_SIZE, "part too small"
+        body = b"".join(parts[part["PartNumber"]] for part in MultipartUpload["Parts"])
+        self.objects[(Bucket, Key)] = body
+        self.num_parts[(Bucket, Key)] = len(parts)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+        self.aborted_uploads.append(UploadId)
+
+    def head_object(self, Bucket, Key):
+        body = self.objects[(Bucket, Key)]
+        return {"ContentLength": len(body), "ETag": hashlib.md5(body).hexdigest()}
+
+    def get_object(self, Bucket, Key, Range, IfMatch):
+        body = self.objects[(Bucket, Key)]
+        assert IfMatch == hashlib.md5(body).hexdigest(), "object changed"
+        self.range_requests.append(Range)
+        start, end = map(int, Range[len("bytes="):].split("-"))
+        return {"Body": io.BytesIO(body[start:end + 1])}
+
+
+def make_documents(num_documents):
+    return [
+        {
+            "name": f"report-{index}.pdf",
+            "source_location": f"https://example.com/report-{index}.pdf",
+            "metadata": {"year": "2023", "company": f"company {index}"},
+            "pages": [{"page": page, "page_text": f"page {page} of report {index} " * 20} for page in range(3)],
+        }
+        for index in range(num_documents)
+    ]
+
+
+class JSONLHelpersTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeS3Client()
+
+    def test_gzip_round_trip_with_small_ranges(self):
+        documents = make_documents(50)
+        num_records = store_jsonl_to_s3(
+            "bucket", "documents_processed.jsonl.gz", iter(documents), client=self.client
+        )
+        self.assertEqual(num_records, len(documents))
+
+        # The object is a plain gzip JSONL file, as read by iter_processed_pages.
+        body = self.client.objects[("bucket", "documents_processed.jsonl.gz")]
+        lines = gzip.decompress(body).decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line) for line in lines], documents)
+
+        records = list(
+            iter_jsonl_from_s3("bucket", "documents_processed.jsonl.gz", range_size=256, client=self.client)
+        )
+        self.assertEqual(records, documents)
+        self.assertGreater(len(self.client.range_requests), 1)
+
+    def test_large_objects_are_uploaded_in_parts(self):
+        documents = make_documents(4000)
+        store_jsonl_to_s3(
+            "bucket", "documents.jsonl", documents, part_size=MIN_MULTIPART_PART_SIZE, client=self.client
+        )
+        self.assertEqual(self.client.num_parts[("bucket", "documents.jsonl")], 2)
+        self.assertEqual(list(iter_jsonl_from_s3("bucket", "documents.jsonl", client=self.client)), documents)
+
+    def test_empty_object(self):
+        self.assertEqual(store_jsonl_to_s3("bucket", "empty.jsonl.gz", [], client=self.client), 0)
+        self.assertEqual(list(iter_jsonl_from_s3("bucket", "empty.jsonl.gz", client=self.client)), [])
+
+    def test_failed_upload_is_aborted(self):
+        def records():
+            yield {"name": "report.pdf"}
+            raise RuntimeError("extraction failed")
+
+        with self.assertRaises(RuntimeError):
+            store_jsonl_to_s3("bucket", "documents.jsonl.gz", records(), client=self.client)
+        self.assertEqual(len(self.client.aborted_uploads), 1)
+        self.assertEqual(self.client.objects, {})
+
+    def test_zstd_round_trip(self):
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            self.skipTest("zstandard is not installed")
+        documents = make_documents(20)
+        store_jsonl_to_s3("bucket", "documents.jsonl.zst", documents, client=self.client)
+        records = iter_jsonl_from_s3("bucket", "documents.jsonl.zst", range_size=128, client=self.client)
+        self.assertEqual(list(records), documents)
+
+
+if __name__ == "__main__":
+    unittest.main()
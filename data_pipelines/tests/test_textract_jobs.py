@@ -0,0 +1,141 @@
+"""Test the TextractJobOrchestrator with a local fake Textractor.
+
+Run from the data_pipelines folder: python -m pytest tests
+"""
+import os
+import sys
+import threading
+import unittest
+from types import SimpleNamespace
+
+from botocore.exceptions import ClientError
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.textract_jobs import TextractJobOrchestrator  # noqa: E402
+
+
+class FakeTextractClient:
+    def __init__(self, textractor):
+        self.textractor = textractor
+
+    def get_document_analysis(self, JobId, MaxResults):
+        return self.textractor.get_status(JobId)
+
+
+class FakeTextractor:
+    """Start jobs that stay IN_PROGRESS for a number of status checks, then end with a final status.
+
+    Args:
+        polls_in_progress (dict): file source to the number of IN_PROGRESS status checks of its job.
+        final_statuses (dict): file source to the final status of its job, SUCCEEDED by default.
+        throttled_starts (int): number of `start_document_analysis` calls throttled first.
+    """
+
+    def __init__(self, polls_in_progress=None, final_statuses=None, throttled_starts=0):
+        self.polls_in_progress = polls_in_progress or {}
+        self.final_statuses = final_statuses or {}
+        self.throttled_starts = throttled_starts
+        self.textract_client = FakeTextractClient(self)
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.status_checks = {}
+        self.num_in_progress = 0
+        self.max_in_progress = 0
+
+    def start_document_analysis(self, file_source, **kwargs):
+        with self.lock:
+            if self.throttled_starts:
+                self.throttled_starts -= 1
+                raise ClientError(
+                    {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}},
+                    "StartDocumentAnalysis",
+                )
+            job_id = f"job-{len(self.jobs)}"
+            self.jobs[job_id] = file_source
+            self.status_checks[job_id] = 0
+            self.num_in_progress += 1
+            self.max_in_progress = max(self.max_in_progress, self.num_in_progress)
+        return SimpleNamespace(job_id=job_id, file_source=file_source, start_kwargs=kwargs)
+
+    def get_status(self, job_id):
+        with self.lock:
+            file_source = self.jobs[job_id]
+            self.status_checks[job_id] += 1
+            if self.status_checks[job_id] <= self.polls_in_progress.get(file_source, 0):
+                return {"JobStatus": "IN_PROGRESS"}
+            self.num_in_progress -= 1
+            status = self.final_statuses.get(file_source, "SUCCEEDED")
+            return {"JobStatus": status, "StatusMessage": "Unsupported document" if status == "FAILED" else None}
+
+
+def make_orchestrator(extractor, post_process=None, max_concurrent_jobs=2):
+    return TextractJobOrchestrator(
+        extractor,
+        start_kwargs={"features": ["TABLES"]},
+        post_process=post_process or (lambda document, item: f"markdown of {item}"),
+        max_concurrent_jobs=max_concurrent_jobs,
+        post_process_workers=2,
+        poll_interval=0.001,
+        max_poll_interval=0.004,
+        poll_backoff=2.0,
+    )
+
+
+class TextractJobOrchestratorTest(unittest.TestCase):
+    def setUp(self):
+        self.items = [f"report-{index}.pdf" for index in range(5)]
+
+    def test_jobs_stay_within_the_concurrency_quota(self):
+        extractor = FakeTextractor(polls_in_progress={item: 3 for item in self.items})
+        results = make_orchestrator(extractor, max_concurrent_jobs=2).run(self.items, lambda item: item)
+
+        self.assertEqual(results, [f"markdown of {item}" for item in self.items])
+        self.assertEqual(len(extractor.jobs), len(self.items))
+        self.assertEqual(extractor.max_in_progress, 2)
+
+    def test_in_progress_jobs_are_polled_until_they_complete(self):
+        polls_in_progress = {"report-0.pdf": 6, "report-1.pdf": 0, "report-2.pdf": 2}
+        extractor = FakeTextractor(polls_in_progress=polls_in_progress)
+        post_processed = []
+
+        def post_process(document, item):
+            self.assertEqual(document.start_kwargs, {"features": ["TABLES"]})
+            post_processed.append(item)
+            return item.upper()
+
+        items = list(polls_in_progress)
+        results = make_orchestrator(extractor, post_process, max_concurrent_jobs=3).run(items, lambda item: item)
+
+        # Results keep the order of the items, whatever the order the jobs complete in.
+        self.assertEqual(results, [item.upper() for item in items])
+        self.assertEqual(post_processed, ["report-1.pdf", "report-2.pdf", "report-0.pdf"])
+        for job_id, file_source in extractor.jobs.items():
+            self.assertEqual(extractor.status_checks[job_id], polls_in_progress[file_source] + 1)
+
+    def test_failed_job_raises_after_the_other_documents(self):
+        extractor = FakeTextractor(
+            polls_in_progress={"report-3.pdf": 4}, final_statuses={"report-1.pdf": "FAILED"}
+        )
+        post_processed = []
+
+        def post_process(document, item):
+            post_processed.append(item)
+            return item
+
+        with self.assertRaisesRegex(RuntimeError, "report-1.pdf ended with status FAILED: Unsupported document"):
+            make_orchestrator(extractor, post_process).run(self.items, lambda item: item)
+        self.assertEqual(
+            sorted(post_processed), [item for item in self.items if item != "report-1.pdf"]
+        )
+
+    def test_throttled_starts_are_retried(self):
+        extractor = FakeTextractor(throttled_starts=2)
+        results = make_orchestrator(extractor).run(self.items, lambda item: item)
+
+        self.assertEqual(results, [f"markdown of {item}" for item in self.items])
+        self.assertEqual(len(extractor.jobs), len(self.items))
+
+
+if __name__ == "__main__":
+    unittest.main()
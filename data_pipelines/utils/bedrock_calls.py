@@ -0,0 +1,132 @@
+"""Helpers shared by the concurrent Amazon Bedrock callers of the pipelines.
+
+`TokenBucketRateLimiter` paces the calls with an adaptive rate that halves on
+every ThrottlingException and slowly increases again on success.
+`invoke_with_retries` calls Bedrock through the rate limiter and retries the
+throttling and transient errors, e.g. ServiceUnavailableException, model
+timeouts, 5xx responses and connection errors, with backoff.
+`ProgressReporter` prints the throughput of a stage at a fixed interval.
+"""
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+
+THROTTLING_ERROR_CODES = ("ThrottlingException", "TooManyRequestsException")
+TRANSIENT_ERROR_CODES = (
+    "ServiceUnavailableException",
+    "ModelTimeoutException",
+    "ModelNotReadyException",
+    "InternalServerException",
+)
+
+
+class TokenBucketRateLimiter:
+    """Thread safe token bucket with an additive increase, multiplicative decrease rate."""
+
+    def __init__(self, rate=10.0, min_rate=0.5, max_rate=100.0, rate_increase=0.5, burst=None):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate_increase = rate_increase
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self):
+        """Block until a request is allowed."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.rate_increase / max(self.rate, 1.0))
+
+    def on_throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            # Drop the accumulated burst so the lower rate applies immediately.
+            self._tokens = min(self._tokens, 0)
+
+
+class ProgressReporter:
+    """Print the number of processed items and the throughput at a fixed interval."""
+
+    def __init__(self, stage, interval_seconds=10.0, rate_limiter=None, unit="chunks"):
+        self.stage = stage
+        self.unit = unit
+        self.interval_seconds = interval_seconds
+        self.rate_limiter = rate_limiter
+        self.count = 0
+        self._start = time.monotonic()
+        self._last_report = self._start
+
+    def update(self, num_items):
+        self.count += num_items
+        now = time.monotonic()
+        if now - self._last_report >= self.interval_seconds:
+            self._last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = time.monotonic() - self._start
+        message = (
+            f"{self.stage}: {self.count} {self.unit} in {elapsed:.1f}s"
+            f" ({self.count / max(elapsed, 1e-9):.1f} {self.unit}/sec)"
+        )
+        if self.rate_limiter is not None:
+            message += f", rate limit {self.rate_limiter.rate:.1f} requests/sec"
+        print(message)
+
+
+def is_throttling_error(error):
+    return error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+def is_transient_error(error):
+    """Whether a ClientError is worth retrying without slowing down, e.g. a 5xx response."""
+    return (
+        error.response.get("Error", {}).get("Code") in TRANSIENT_ERROR_CODES
+        or error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0) >= 500
+    )
+
+
+def invoke_with_retries(call, rate_limiter, max_retries=8):
+    """Return `call()`, paced by the rate limiter and retried with full jitter exponential backoff.
+
+    Throttling errors also halve the rate of the rate limiter. Transient
+    errors, i.e. 5xx responses, read timeouts and connection errors, are
+    retried at the same rate. Other errors, or the last retry failing, raise.
+    """
+    if max_retries < 0:
+        raise ValueError(f"max_retries must be positive or zero, got {max_retries}.")
+    for attempt in range(max_retries + 1):
+        rate_limiter.acquire()
+        try:
+            result = call()
+        except ClientError as error:
+            if attempt == max_retries or not (is_throttling_error(error) or is_transient_error(error)):
+                raise
+            if is_throttling_error(error):
+                rate_limiter.on_throttle()
+        except (HTTPClientError, BotocoreConnectionError):
+            if attempt == max_retries:
+                raise
+        else:
+            rate_limiter.on_success()
+            return result
+        time.sleep(random.uniform(0, min(20.0, 0.5 * 2**attempt)))
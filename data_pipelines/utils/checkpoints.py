@@ -0,0 +1,53 @@
+"""Content addressed checkpoints of the document processing stages.
+
+The output of a stage is stored under a key that is the sha256 of all its
+inputs and parameters, e.g. the pdf bytes and Textract features, or the page
+markdown, model id and prompts of the LLM cleanup. A rerun with the same
+inputs reads the stored output instead of paying for the Textract job or LLM
+call again, and any change to an input or parameter misses the checkpoint.
+
+Checkpoints are JSON files under `<directory>/<stage>/`, written atomically.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+
+def checkpoint_key(*parts):
+    """sha256 of the JSON encoding of the inputs and parameters of a stage."""
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class CheckpointStore:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, stage, key):
+        return os.path.join(self.directory, stage, key[:2], f"{key}.json")
+
+    def get(self, stage, key):
+        """Return the stored output, or None when the stage did not run with these inputs."""
+        path = self._path(stage, key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as checkpoint_file:
+            return json.load(checkpoint_file)
+
+    def put(self, stage, key, value):
+        path = self._path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(file_descriptor, "w") as checkpoint_file:
+            json.dump(value, checkpoint_file)
+        os.replace(temporary_path, path)
+
+    def invalidate(self, stage):
+        """Delete all the checkpoints of a stage, so it reruns from scratch."""
+        stage_directory = os.path.join(self.directory, stage)
+        if os.path.isdir(stage_directory):
+            shutil.rmtree(stage_directory)
+            print(f"Invalidated the {stage} checkpoints")
@@ -0,0 +1,185 @@
+"""Token aware chunking of document pages.
+
+`TokenChunker` encodes each page once, keeps the character offset of every
+token, and slices the chunks directly out of the page text using these
+offsets, so the text is never re-tokenised or decoded chunk by chunk.
+Optionally, chunks do not cross the markdown headings and tables found in the
+Textract markdown output, and pages can be chunked across a process pool.
+
+The tokenizer is pluggable: any object with an
+`encode_with_offsets(text) -> List[int]` method returning the start character
+offset of each token can be used.
+"""
+import bisect
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain.schema.document import Document
+
+MARKDOWN_HEADING_PATTERN = re.compile(r"^#{1,6}\s", re.MULTILINE)
+MARKDOWN_TABLE_PATTERN = re.compile(r"(?:^\|.*(?:\n|$))+", re.MULTILINE)
+
+
+class TiktokenTokenizer:
+    def __init__(self, encoding_name="gpt2"):
+        import tiktoken
+
+        self.encoding = tiktoken.get_encoding(encoding_name)
+
+    def encode_with_offsets(self, text):
+        tokens = self.encoding.encode_ordinary(text)
+        _, offsets = self.encoding.decode_with_offsets(tokens)
+        return offsets
+
+
+class HuggingFaceTokenizer:
+    """Use a tokenizer from the Hugging Face hub, requires the `tokenizers` package."""
+
+    def __init__(self, tokenizer_name):
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_pretrained(tokenizer_name)
+
+    def encode_with_offsets(self, text):
+        encoding = self.tokenizer.encode(text, add_special_tokens=False)
+        return [start for start, _ in encoding.offsets]
+
+
+def get_tokenizer(tokenizer_spec):
+    """Build a tokenizer from a spec, either a tiktoken encoding name or `hf:<tokenizer name>`."""
+    if tokenizer_spec.startswith("hf:"):
+        return HuggingFaceTokenizer(tokenizer_spec[len("hf:"):])
+    return TiktokenTokenizer(tokenizer_spec)
+
+
+def _markdown_boundaries(text):
+    """Character offsets where a heading or a table starts, or a table ends."""
+    boundaries = {match.start() for match in MARKDOWN_HEADING_PATTERN.finditer(text)}
+    for match in MARKDOWN_TABLE_PATTERN.finditer(text):
+        boundaries.update((match.start(), match.end()))
+    boundaries.discard(0)
+    boundaries.discard(len(text))
+    return sorted(boundaries)
+
+
+class TokenChunker:
+    """Split text into chunks of at most `chunk_size` tokens overlapping by `chunk_overlap` tokens.
+
+    Args:
+        tokenizer (str): a tokenizer spec, see `get_tokenizer`. The tokenizer
+            is created lazily so the chunker can be sent to worker processes.
+        respect_markdown (bool): do not let chunks cross markdown headings and
+            table boundaries. Consecutive small sections are merged up to
+            `chunk_size` tokens, and sections longer than `chunk_size`
+            are split with the usual overlap.
+        processes (int): number of worker processes used by `iter_split_documents`.
+    """
+
+    def __init__(
+        self,
+        chunk_size=512,
+        chunk_overlap=64,
+        tokenizer="gpt2",
+        respect_markdown=False,
+        processes=1,
+    ):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(
+                f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})."
+            )
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.tokenizer_spec = tokenizer
+        self.respect_markdown = respect_markdown
+        self.processes = processes
+        self._tokenizer = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_tokenizer"] = None
+        return state
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = get_tokenizer(self.tokenizer_spec)
+        return self._tokenizer
+
+    def _sections(self, text, offsets):
+        """Return the (start, end) token ranges that chunks must not cross."""
+        if not self.respect_markdown:
+            return [(0, len(offsets))]
+
+        boundaries = [bisect.bisect_left(offsets, boundary) for boundary in _markdown_boundaries(text)]
+        edges = [0] + boundaries + [len(offsets)]
+        sections = []
+        for start, end in zip(edges, edges[1:]):
+            if start == end:
+                continue
+            if sections and end - sections[-1][0] <= self.chunk_size:
+                # Merge small consecutive sections into a single chunk.
+                sections[-1] = (sections[-1][0], end)
+            else:
+                sections.append((start, end))
+        return sections
+
+    def split_text(self, text):
+        offsets = self.tokenizer.encode_with_offsets(text)
+        if not offsets:
+            return []
+
+        step = self.chunk_size - self.chunk_overlap
+        chunks = []
+        for section_start, section_end in self._sections(text, offsets):
+            start = section_start
+            while True:
+                end = min(start + self.chunk_size, section_end)
+                char_end = offsets[end] if end < len(offsets) else len(text)
+                chunk = text[offsets[start]:char_end].strip()
+                if chunk:
+                    chunks.append(chunk)
+                if end == section_end:
+                    break
+                start += step
+        return chunks
+
+    def split_documents(self, documents):
+        return [
+            Document(page_content=chunk, metadata=dict(document.metadata))
+            for document in documents
+            for chunk in self.split_text(document.page_content)
+        ]
+
+    def _split_page(self, page):
+        page_content, metadata = page
+        return [(chunk, metadata) for chunk in self.split_text(page_content)]
+
+    def iter_split_documents(self, documents, max_in_flight=None):
+        """Split documents one by one, in order, using the process pool.
+
+        Yields:
+            The list of chunks of each document.
+        """
+        if self.processes <= 1:
+            for document in documents:
+                yield self.split_documents([document])
+            return
+
+        max_in_flight = max_in_flight or 4 * self.processes
+        with ProcessPoolExecutor(max_workers=self.processes) as executor:
+            in_flight = deque()
+            for document in documents:
+                if len(in_flight) >= max_in_flight:
+                    yield self._to_documents(in_flight.popleft().result())
+                in_flight.append(
+                    executor.submit(self._split_page, (document.page_content, document.metadata))
+                )
+            while in_flight:
+                yield self._to_documents(in_flight.popleft().result())
+
+    @staticmethod
+    def _to_documents(chunks):
+        return [
+            Document(page_content=chunk, metadata=dict(metadata)) for chunk, metadata in chunks
+        ]
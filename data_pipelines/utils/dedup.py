@@ -0,0 +1,163 @@
+"""Exact and near-duplicate chunk elimination before embedding.
+
+Annual reports repeat a lot of boilerplate from one year to the next. Chunks
+whose normalised text is identical are exact duplicates. Near duplicates are
+found with MinHash signatures of the word shingles of each chunk, indexed
+with locality sensitive hashing (LSH) bands, and confirmed when the estimated
+Jaccard similarity is above a threshold.
+
+Deduplication takes two passes over the chunks so it can stay streaming:
+`find_duplicate_groups` only keeps hashes and signatures in memory, then
+`collapse_duplicates` drops the duplicates and adds the list of all the
+sources of the kept chunks to their metadata.
+"""
+import hashlib
+import json
+import re
+from collections import defaultdict
+
+import numpy as np
+
+from .incremental_index import CHUNK_ID_METADATA_KEY
+
+SOURCES_METADATA_KEY = "sources"
+SOURCE_METADATA_KEYS = ("company", "year", "document_name", "page_number", "original_page_number")
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def _shingle_hashes(text, shingle_size):
+    words = normalize_text(text).split(" ")
+    shingles = {
+        " ".join(words[index:index + shingle_size])
+        for index in range(max(1, len(words) - shingle_size + 1))
+    }
+    return np.array(
+        [
+            int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+            for shingle in shingles
+        ],
+        dtype=np.uint64,
+    )
+
+
+class MinHashLSH:
+    """MinHash signatures of word shingles indexed with LSH bands."""
+
+    def __init__(self, num_permutations=128, num_bands=32, shingle_size=5, seed=42):
+        if num_permutations % num_bands:
+            raise ValueError("num_permutations must be a multiple of num_bands.")
+        random_state = np.random.RandomState(seed)
+        # a * h + b stays below 2**64 since h < 2**32 and a, b < 2**31.
+        self.permutations_a = random_state.randint(1, (1 << 31) - 1, num_permutations).astype(np.uint64)
+        self.permutations_b = random_state.randint(0, (1 << 31) - 1, num_permutations).astype(np.uint64)
+        self.num_bands = num_bands
+        self.rows_per_band = num_permutations // num_bands
+        self.shingle_size = shingle_size
+        self._bands = [dict() for _ in range(num_bands)]
+        self._signatures = {}
+
+    def signature(self, text):
+        hashes = _shingle_hashes(text, self.shingle_size)
+        permuted = (np.outer(self.permutations_a, hashes) + self.permutations_b[:, None]) % _MERSENNE_PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        for band in range(self.num_bands):
+            yield band, signature[band * self.rows_per_band:(band + 1) * self.rows_per_band].tobytes()
+
+    def query(self, signature, threshold):
+        """Return the key of an indexed item with an estimated Jaccard similarity >= threshold."""
+        checked = set()
+        for band, band_key in self._band_keys(signature):
+            candidate = self._bands[band].get(band_key)
+            if candidate is None or candidate in checked:
+                continue
+            checked.add(candidate)
+            if np.mean(self._signatures[candidate] == signature) >= threshold:
+                return candidate
+        return None
+
+    def insert(self, key, signature):
+        self._signatures[key] = signature
+        for band, band_key in self._band_keys(signature):
+            self._bands[band].setdefault(band_key, key)
+
+
+def _source(chunk):
+    return {key: chunk.metadata[key] for key in SOURCE_METADATA_KEYS if key in chunk.metadata}
+
+
+class DuplicateGroups:
+    """Map each duplicate chunk to the chunk kept in its place."""
+
+    def __init__(self):
+        self.representatives = {}
+        self.sources = defaultdict(list)
+        self.num_chunks = 0
+        self.num_exact_duplicates = 0
+        self.num_near_duplicates = 0
+
+    def report(self):
+        num_duplicates = self.num_exact_duplicates + self.num_near_duplicates
+        shrink = num_duplicates / max(self.num_chunks, 1)
+        return (
+            f"Deduplication: {self.num_chunks} chunks, {self.num_exact_duplicates} exact"
+            f" and {self.num_near_duplicates} near duplicates removed,"
+            f" {self.num_chunks - num_duplicates} kept ({shrink:.1%} smaller)."
+        )
+
+
+def find_duplicate_groups(chunks, threshold=0.85, lsh=None):
+    """First pass: group exact and near-duplicate chunks."""
+    lsh = lsh or MinHashLSH()
+    groups = DuplicateGroups()
+    exact_hashes = {}
+
+    for chunk in chunks:
+        chunk_id = chunk.metadata[CHUNK_ID_METADATA_KEY]
+        if chunk_id in groups.representatives or chunk_id in groups.sources:
+            continue
+        groups.num_chunks += 1
+        text_hash = hashlib.sha256(normalize_text(chunk.page_content).encode("utf-8")).digest()
+
+        representative = exact_hashes.get(text_hash)
+        if representative is not None:
+            groups.num_exact_duplicates += 1
+        else:
+            signature = lsh.signature(chunk.page_content)
+            representative = lsh.query(signature, threshold)
+            if representative is not None:
+                groups.num_near_duplicates += 1
+            else:
+                exact_hashes[text_hash] = chunk_id
+                lsh.insert(chunk_id, signature)
+                representative = chunk_id
+
+        if representative != chunk_id:
+            groups.representatives[chunk_id] = representative
+        groups.sources[representative].append(_source(chunk))
+
+    print(groups.report())
+    return groups
+
+
+def collapse_duplicates(chunks, groups):
+    """Second pass: drop the duplicates and list all the sources on the kept chunks."""
+    for chunk in chunks:
+        chunk_id = chunk.metadata[CHUNK_ID_METADATA_KEY]
+        if chunk_id in groups.representatives:
+            continue
+        sources = groups.sources.get(chunk_id, [])
+        if len(sources) > 1:
+            chunk.metadata[SOURCES_METADATA_KEY] = sources
+            # Include the sources in the ID so the chunk is rewritten when they change.
+            position, content_hash = chunk_id.split("-")
+            sources_hash = hashlib.sha256(
+                (content_hash + json.dumps(sources, sort_keys=True)).encode("utf-8")
+            ).hexdigest()[:16]
+            chunk.metadata[CHUNK_ID_METADATA_KEY] = f"{position}-{sources_hash}"
+        yield chunk
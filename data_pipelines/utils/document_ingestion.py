@@ -0,0 +1,277 @@
+"""Streaming ingestion of processed documents into the vector store.
+
+The ingestion is a chain of generators: read pages, turn them into langchain
+Documents, chunk them, drop the chunks that are already indexed, embed and
+write. Only the pages being chunked and the batches being embedded are held
+in memory, so memory use does not grow with the size of the corpus.
+
+The input is either the legacy `documents_processed.json` file, a JSON list
+of documents which has to be loaded in memory, or a JSONL file, optionally
+gzip compressed, with one document or one page per line, which is streamed.
+A JSONL page record has the keys `name`, `source_location`, `metadata`,
+`page` and `page_text`.
+
+Documents can be sharded across the instances of a SageMaker processing job,
+each instance only ingests the documents whose source location hashes to it.
+"""
+import gzip
+import hashlib
+import json
+import os
+
+from langchain.schema.document import Document
+
+from .dedup import collapse_duplicates, find_duplicate_groups
+from .embedding import embed_and_add_documents, iter_embedded_documents
+from .incremental_index import (
+    CHUNK_ID_METADATA_KEY,
+    IncrementalIndexer,
+    assign_chunk_ids,
+    get_embedding_config_key,
+    get_existing_chunk_ids,
+)
+from .pgvector_bulk_load import bulk_load_embeddings
+
+SAGEMAKER_RESOURCE_CONFIG_PATH = "/opt/ml/config/resourceconfig.json"
+
+
+def get_processing_job_shard(resource_config_path=SAGEMAKER_RESOURCE_CONFIG_PATH):
+    """Return (shard_index, num_shards) of the current processing job instance."""
+    if not os.path.isfile(resource_config_path):
+        return 0, 1
+
+    with open(resource_config_path, "r") as resource_config_file:
+        resource_config = json.load(resource_config_file)
+
+    hosts = sorted(resource_config["hosts"])
+    return hosts.index(resource_config["current_host"]), len(hosts)
+
+
+def is_in_shard(document_location, shard_index, num_shards):
+    document_hash = hashlib.sha256(document_location.encode("utf-8")).hexdigest()
+    return int(document_hash, 16) % num_shards == shard_index
+
+
+def _document_pages(document):
+    for page in document["pages"]:
+        yield {
+            "name": document["name"],
+            "source_location": document["source_location"],
+            "metadata": document["metadata"],
+            "page": page["page"],
+            "page_text": page["page_text"],
+        }
+
+
+def iter_processed_pages(file_path, shard_index=0, num_shards=1):
+    """Yield page records from a processed documents JSON or JSONL file."""
+    if file_path.endswith((".jsonl", ".jsonl.gz")):
+        open_file = gzip.open if file_path.endswith(".gz") else open
+        with open_file(file_path, "rt") as jsonl_file:
+            records = (json.loads(line) for line in jsonl_file if line.strip())
+            for record in records:
+                if not is_in_shard(record["source_location"], shard_index, num_shards):
+                    continue
+                if "pages" in record:
+                    yield from _document_pages(record)
+                else:
+                    yield record
+    else:
+        # The legacy JSON format can't be streamed, prefer JSONL for large corpora.
+        with open(file_path, "rb") as json_file:
+            documents = json.load(json_file)
+        for document in documents:
+            if is_in_shard(document["source_location"], shard_index, num_shards):
+                yield from _document_pages(document)
+
+
+def _get_pages_kept(document_metadata):
+    pages_kept = document_metadata.get("pages_kept") or []
+    if isinstance(pages_kept, str):
+        pages_kept = json.loads(pages_kept)
+    return pages_kept
+
+
+def page_record_to_document(page_record):
+    """Turn a page record into a langchain Document with the metadata used for filtering."""
+    # Note: you could choose to also prepend part of the previous page
+    # and append part of the next page to include more context for documents
+    # that have many pages which continue their text on the next page.
+    document_metadata = dict(page_record["metadata"])
+    pages_kept = _get_pages_kept(document_metadata)
+    # remove pages_kept since we already put the original page number.
+    document_metadata.pop("pages_kept", None)
+
+    page_number = page_record["page"]
+    metadata = {
+        "document_name": page_record["name"],
+        "document_source_location": page_record["source_location"],
+        "page_number": page_number,
+        # When all pages were kept, the page index maps to the 1-based page number.
+        "original_page_number": pages_kept[page_number] if pages_kept else page_number + 1,
+    }
+    # merge the document metadata into the langchain Document metadata
+    # to be able to use them for filtering.
+    metadata.update(document_metadata)
+
+    return Document(page_content=page_record["page_text"], metadata=metadata)
+
+
+def iter_chunks(page_documents, text_splitter, embedding_config_key=""):
+    """Split pages one at a time, and assign the stable chunk IDs."""
+    if hasattr(text_splitter, "iter_split_documents"):
+        # TokenChunker can split pages in parallel while preserving their order.
+        chunked_pages = text_splitter.iter_split_documents(page_documents)
+    else:
+        chunked_pages = (
+            text_splitter.split_documents([page_document]) for page_document in page_documents
+        )
+    for page_chunks in chunked_pages:
+        yield from assign_chunk_ids(page_chunks, embedding_config_key)
+
+
+def add_ingestion_arguments(parser):
+    """Add the arguments of `index_processed_documents` to an argparse parser."""
+    parser.add_argument(
+        "--processed-documents-filename", default="documents_processed.json",
+        help="Processed documents as a JSON list, or JSONL with one document or page per line."
+    )
+    parser.add_argument(
+        "--tokenizer", default="gpt2",
+        help="Chunking tokenizer, a tiktoken encoding name or hf:<Hugging Face tokenizer name>."
+    )
+    parser.add_argument(
+        "--chunk-respect-markdown", action="store_true",
+        help="Do not let chunks cross the markdown headings and tables of the Textract output."
+    )
+    parser.add_argument(
+        "--chunking-processes", type=int, default=1,
+        help="Number of processes used to chunk pages."
+    )
+    parser.add_argument(
+        "--deduplicate", action="store_true",
+        help="Collapse exact and near-duplicate chunks into one vector listing all their sources."
+    )
+    parser.add_argument(
+        "--near-duplicate-threshold", type=float, default=0.85,
+        help="Minimum estimated Jaccard similarity of the word shingles of near-duplicate chunks."
+    )
+    parser.add_argument(
+        "--embedding-workers", type=int, default=8,
+        help="Number of concurrent Bedrock embedding requests."
+    )
+    parser.add_argument("--embedding-batch-size", type=int, default=16)
+    parser.add_argument(
+        "--embedding-max-rate", type=float, default=50.0,
+        help="Upper bound of the adaptive embedding request rate, in requests per second."
+    )
+    parser.add_argument(
+        "--embedding-cache-dir", default="/opt/ml/processing/embedding_cache",
+        help="Local directory of the content addressed embedding cache."
+    )
+    parser.add_argument(
+        "--embedding-cache-s3-uri", default=None,
+        help="When set, the embedding cache is downloaded from and uploaded back to this S3 prefix."
+    )
+    parser.add_argument(
+        "--bulk-load", action="store_true",
+        help=(
+            "Rewrite the whole langchain_pg_embedding table, shared by all the collections, with COPY"
+            " into a staging table that is swapped in atomically. Writes made by other processes"
+            " during the load are lost. Requires --embedding-cache-s3-uri, so that unchanged chunks"
+            " are served from the embedding cache instead of being embedded again."
+        )
+    )
+    parser.add_argument(
+        "--full-reindex", action="store_true",
+        help="Drop the collection and re-embed every chunk instead of indexing incrementally."
+    )
+    return parser
+
+
+def check_ingestion_arguments(parser, args):
+    """Reject the ingestion arguments that can't work together."""
+    # The local cache directory starts empty in every processing job, without
+    # the S3 cache a bulk load re-embeds the whole corpus.
+    if args.bulk_load and not args.embedding_cache_s3_uri:
+        parser.error("--bulk-load requires --embedding-cache-s3-uri.")
+
+
+def index_processed_documents(
+    processed_documents_file_path,
+    text_splitter,
+    embedder,
+    pgvector_store,
+    db_connection,
+    collection_name,
+    incremental=True,
+    bulk_load=False,
+    shard=None,
+    deduplicate=False,
+    near_duplicate_threshold=0.85,
+):
+    """Stream processed documents into the vector store.
+
+    Args:
+        incremental (bool): only embed the chunks that are not indexed yet,
+            and delete the indexed chunks that no longer exist.
+        bulk_load (bool): replace the collection using COPY and a staging table swap.
+        shard (tuple, optional): (shard_index, num_shards) of this instance,
+            read from the SageMaker resource config by default.
+        deduplicate (bool): collapse exact and near-duplicate chunks, this reads
+            and chunks the input twice.
+
+    Returns:
+        IncrementalIndexer: the tracker of the indexed chunks.
+    """
+    shard_index, num_shards = shard or get_processing_job_shard()
+    if num_shards > 1 and (bulk_load or not incremental):
+        raise ValueError(
+            "Bulk loading and full re-indexing rewrite the whole collection,"
+            " they can't run on multiple instances."
+        )
+    print(f"Indexing shard {shard_index + 1} of {num_shards}")
+
+    if incremental and not bulk_load:
+        existing_chunk_ids = get_existing_chunk_ids(
+            db_connection,
+            collection_name,
+            document_filter=lambda location: is_in_shard(location, shard_index, num_shards),
+        )
+    else:
+        existing_chunk_ids = set()
+    indexer = IncrementalIndexer(existing_chunk_ids)
+    # Chunks indexed with another embedding model or size are re-embedded.
+    embedding_config_key = get_embedding_config_key(embedder.model_id, embedder.model_kwargs)
+
+    def iter_document_chunks():
+        page_records = iter_processed_pages(processed_documents_file_path, shard_index, num_shards)
+        page_documents = (page_record_to_document(page_record) for page_record in page_records)
+        return iter_chunks(page_documents, text_splitter, embedding_config_key)
+
+    chunks = iter_document_chunks()
+    if deduplicate:
+        duplicate_groups = find_duplicate_groups(chunks, threshold=near_duplicate_threshold)
+        chunks = collapse_duplicates(iter_document_chunks(), duplicate_groups)
+    chunks = indexer.filter_chunks(chunks)
+
+    if bulk_load:
+        bulk_load_embeddings(
+            db_connection,
+            collection_name,
+            (
+                (document.metadata[CHUNK_ID_METADATA_KEY], embedding, document.page_content, document.metadata)
+                for document, embedding in iter_embedded_documents(chunks, embedder)
+            ),
+        )
+    else:
+        embed_and_add_documents(pgvector_store, chunks, embedder)
+        # Delete the outdated chunks only once their replacements are indexed.
+        ids_to_delete = indexer.ids_to_delete
+        if ids_to_delete:
+            # Chunk IDs are content hashes, the same chunk can be indexed in
+            # other collections, e.g. with another embedding model.
+            pgvector_store.delete(ids=ids_to_delete, collection_only=True)
+
+    print(f"Indexing done: {indexer.report()}")
+    return indexer
@@ -0,0 +1,202 @@
+"""Concurrent download of the annual reports.
+
+Reports are downloaded by a bounded pool of threads sharing a pooled
+`requests.Session`. Each response is streamed to a temporary file in chunks
+and atomically renamed to its final path, so an interrupted download never
+leaves a truncated pdf behind.
+
+The ETag and Last-Modified headers of each download are kept in a sidecar
+`<file>.http.json` file and sent back as conditional request headers on the
+next run, so unchanged reports are not downloaded again while changed reports
+are. Connection errors, throttling and server errors are retried with
+exponential backoff, or after the Retry-After delay of the server, by a single
+retry loop around the request and the streaming of its body.
+
+The downloader only speaks HTTP, so it can be tested against a local HTTP
+server, e.g. `python -m http.server`, by pointing the document urls to it.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+VALIDATORS_SUFFIX = ".http.json"
+
+
+def _file_sha256(file_path):
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+class PDFDownloader:
+    """Download files concurrently with conditional requests and retries.
+
+    Args:
+        headers (dict): headers sent with every request, e.g. a User-Agent.
+        max_workers (int): maximum number of concurrent downloads, also the
+            size of the connection pool.
+        max_retries (int): number of retries of a failed request.
+        backoff_factor (float): the n-th retry waits backoff_factor * 2 ** (n - 1) seconds.
+        chunk_size (int): size in bytes of the chunks streamed to disk.
+        timeout (float or tuple): connect and read timeouts in seconds.
+        session (requests.Session, optional): a preconfigured session.
+    """
+
+    def __init__(
+        self,
+        headers=None,
+        max_workers=8,
+        max_retries=5,
+        backoff_factor=0.5,
+        chunk_size=1 << 20,
+        timeout=(10, 60),
+        session=None,
+    ):
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+        if session is None:
+            session = requests.Session()
+            # No adapter retries, `download` retries both the requests and the streaming.
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        session.headers.update(headers or {})
+        self.session = session
+
+    @staticmethod
+    def _load_validators(file_path, url):
+        validators_path = file_path + VALIDATORS_SUFFIX
+        if not (os.path.exists(file_path) and os.path.exists(validators_path)):
+            return {}
+        with open(validators_path, "r") as validators_file:
+            validators = json.load(validators_file)
+        # The validators of another url say nothing about this one.
+        return validators if validators.get("url") == url else {}
+
+    @staticmethod
+    def _save_validators(file_path, url, response):
+        validators = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        with open(file_path + VALIDATORS_SUFFIX, "w") as validators_file:
+            json.dump(validators, validators_file)
+
+    def _stream_to_file(self, response, file_path):
+        """Write the response body to a temporary file, then rename it to file_path."""
+        file_directory = os.path.dirname(os.path.abspath(file_path))
+        file_descriptor, temporary_path = tempfile.mkstemp(
+            dir=file_directory, prefix=os.path.basename(file_path), suffix=".part"
+        )
+        num_bytes = 0
+        try:
+            with os.fdopen(file_descriptor, "wb") as temporary_file:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    temporary_file.write(chunk)
+                    num_bytes += len(chunk)
+            if os.path.exists(file_path) and _file_sha256(temporary_path) == _file_sha256(file_path):
+                os.remove(temporary_path)
+                return num_bytes, False
+            os.replace(temporary_path, file_path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        return num_bytes, True
+
+    def _retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+        if retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff_factor * 2 ** attempt
+
+    def download(self, url, file_path):
+        """Download url to file_path unless it did not change since the last download.
+
+        Returns:
+            dict: the url, file path, status ("downloaded", "not_modified" or
+            "failed"), number of bytes, duration in seconds and error if any.
+        """
+        start = time.perf_counter()
+        result = {"url": url, "file_path": file_path, "bytes": 0}
+
+        validators = self._load_validators(file_path, url)
+        conditional_headers = {}
+        if validators.get("etag"):
+            conditional_headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            conditional_headers["If-Modified-Since"] = validators["last_modified"]
+
+        for attempt in range(self.max_retries + 1):
+            retry_delay = None
+            try:
+                with self.session.get(
+                    url, headers=conditional_headers, stream=True, timeout=self.timeout
+                ) as response:
+                    if response.status_code == 304:
+                        result["status"] = "not_modified"
+                    elif response.status_code == 200:
+                        num_bytes, changed = self._stream_to_file(response, file_path)
+                        self._save_validators(file_path, url, response)
+                        result["bytes"] = num_bytes
+                        result["status"] = "downloaded" if changed else "not_modified"
+                    elif response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                        retry_delay = self._retry_delay(attempt, response)
+                    else:
+                        result["status"] = "failed"
+                        result["error"] = f"Status Code: {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == self.max_retries:
+                    result["status"] = "failed"
+                    result["error"] = str(e)
+                    break
+                retry_delay = self._retry_delay(attempt)
+            if retry_delay is None:
+                break
+            time.sleep(retry_delay)
+
+        result["seconds"] = time.perf_counter() - start
+        return result
+
+    def download_all(self, downloads):
+        """Download (url, file_path) pairs concurrently.
+
+        Returns:
+            List[dict]: the result of each download, in completion order.
+        """
+        results = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.download, url, file_path) for url, file_path in downloads]
+            for future in as_completed(futures):
+                result = future.result()
+                print(
+                    f"{result['status']}: {result['file_path']}"
+                    + (f" ({result['error']})" if "error" in result else "")
+                )
+                results.append(result)
+        return results
+
+
+def report_downloads(results, elapsed_seconds):
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    num_bytes = sum(result["bytes"] for result in results)
+    return (
+        f"Downloads: {counts} in {elapsed_seconds:.1f}s,"
+        f" {num_bytes / (1 << 20):.1f} MiB ({num_bytes / (1 << 20) / max(elapsed_seconds, 1e-9):.1f} MiB/s)"
+    )
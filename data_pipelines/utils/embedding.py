@@ -0,0 +1,155 @@
+"""Concurrent, rate limited embedding of document chunks with Amazon Bedrock.
+
+Embedding one chunk at a time spends almost all of its time waiting on the
+network. `ConcurrentEmbedder` sends batches of chunks to a bounded pool of
+worker threads, and paces the Bedrock calls with the adaptive token bucket of
+`utils.bedrock_calls`, which halves its rate on every ThrottlingException and
+slowly increases it again on success. Transient errors, e.g.
+ServiceUnavailableException, model timeouts, 5xx responses and connection
+errors, are retried with backoff without slowing down. Embedded batches are
+yielded as soon as they are ready so they can be written to the database
+while the next ones are computed.
+"""
+import json
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .bedrock_calls import ProgressReporter, TokenBucketRateLimiter, invoke_with_retries
+
+
+class ConcurrentEmbedder:
+    """Embed texts with a Bedrock embedding model using a bounded pool of threads.
+
+    Note:
+        The Bedrock client should be created with botocore retries disabled,
+        i.e. `retries={"total_max_attempts": 1}`, so throttling reaches the
+        rate limiter instead of being retried blindly by botocore. Note that
+        `max_attempts` counts the retries, `max_attempts: 1` still sends each
+        call twice. `invoke_with_retries` retries the throttling and transient
+        errors instead.
+    """
+
+    def __init__(
+        self,
+        bedrock_runtime,
+        model_id,
+        model_kwargs=None,
+        max_workers=8,
+        batch_size=16,
+        rate_limiter=None,
+        max_retries=8,
+        cache=None,
+    ):
+        self.bedrock_runtime = bedrock_runtime
+        self.model_id = model_id
+        self.model_kwargs = model_kwargs or {}
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.rate_limiter = rate_limiter or TokenBucketRateLimiter(rate=max_workers)
+        self.max_retries = max_retries
+        # Optional EmbeddingCache consulted before calling Bedrock.
+        self.cache = cache
+
+    def embed_query(self, text):
+        """Embed a single text, backing off and slowing down when throttled."""
+        if self.cache is not None:
+            embedding = self.cache.get(text)
+            if embedding is not None:
+                return embedding
+
+        embedding = self._invoke_model(text)
+        if self.cache is not None:
+            self.cache.put(text, embedding)
+        return embedding
+
+    def _invoke_model(self, text):
+        body = json.dumps({"inputText": text, **self.model_kwargs})
+        response = invoke_with_retries(
+            lambda: self.bedrock_runtime.invoke_model(
+                body=body,
+                modelId=self.model_id,
+                accept="application/json",
+                contentType="application/json",
+            ),
+            self.rate_limiter,
+            self.max_retries,
+        )
+        return json.loads(response["body"].read())["embedding"]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def _batches(self, documents):
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def embed_langchain_documents(self, documents):
+        """Embed an iterable of langchain Documents.
+
+        Yields:
+            (documents, embeddings) tuples, one per batch, in completion order.
+            At most `2 * max_workers` batches are in flight at any time.
+        """
+        max_in_flight = 2 * self.max_workers
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight = {}
+            for batch in self._batches(documents):
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield in_flight.pop(future), future.result()
+
+                future = executor.submit(
+                    self.embed_documents, [document.page_content for document in batch]
+                )
+                in_flight[future] = batch
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield in_flight.pop(future), future.result()
+
+
+def iter_embedded_documents(documents, embedder, progress_interval_seconds=10.0):
+    """Embed documents concurrently and yield (document, embedding) pairs as they complete."""
+    progress = ProgressReporter(
+        "Embedding", progress_interval_seconds, rate_limiter=embedder.rate_limiter
+    )
+    for batch, embeddings in embedder.embed_langchain_documents(documents):
+        yield from zip(batch, embeddings)
+        progress.update(len(batch))
+
+    progress.report()
+    if embedder.cache is not None:
+        print(embedder.cache.report())
+
+
+def embed_and_add_documents(vector_store, documents, embedder, progress_interval_seconds=10.0):
+    """Embed documents concurrently and write each batch to the vector store as it completes.
+
+    Returns:
+        int: the number of documents added.
+    """
+    progress = ProgressReporter(
+        "Embedding", progress_interval_seconds, rate_limiter=embedder.rate_limiter
+    )
+    for batch, embeddings in embedder.embed_langchain_documents(documents):
+        ids = [document.metadata.get("chunk_id") for document in batch]
+        vector_store.add_embeddings(
+            texts=[document.page_content for document in batch],
+            embeddings=embeddings,
+            metadatas=[document.metadata for document in batch],
+            # Use the stable chunk IDs when available, otherwise PGVector generates random ones.
+            ids=ids if all(ids) else None,
+        )
+        progress.update(len(batch))
+
+    progress.report()
+    if embedder.cache is not None:
+        print(embedder.cache.report())
+    return progress.count
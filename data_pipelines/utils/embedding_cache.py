@@ -0,0 +1,174 @@
+"""Persistent, content addressed cache of embedding vectors.
+
+Embeddings are keyed by the embedding model configuration and the sha256 of
+the chunk text, so reruns of the pipeline only pay for text that was never
+embedded before. Each model configuration gets its own pair of append-only
+files:
+
+- `embeddings.f32`: the embedding vectors packed as little endian float32.
+- `index.bin`: fixed size records of (sha256 digest, offset, dimensions)
+  pointing into `embeddings.f32`.
+
+The index is loaded in memory when the cache is opened, and vectors are read
+from a memory map of `embeddings.f32`. The cache can be synchronised with S3
+so it survives across SageMaker processing jobs.
+"""
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from array import array
+
+INDEX_RECORD = struct.Struct("<32sQI")
+EMBEDDINGS_FILENAME = "embeddings.f32"
+INDEX_FILENAME = "index.bin"
+
+
+def get_cache_namespace(model_id, model_kwargs=None):
+    """Return a file system safe name for an embedding model configuration."""
+    namespace = model_id
+    if model_kwargs:
+        namespace += "-" + json.dumps(model_kwargs, sort_keys=True)
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", namespace)
+
+
+class EmbeddingCache:
+    def __init__(self, cache_directory, model_id, model_kwargs=None):
+        self.directory = os.path.join(
+            cache_directory, get_cache_namespace(model_id, model_kwargs)
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        self.embeddings_path = os.path.join(self.directory, EMBEDDINGS_FILENAME)
+        self.index_path = os.path.join(self.directory, INDEX_FILENAME)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = {}
+        self._mmap = None
+        self._load()
+        self._embeddings_file = open(self.embeddings_path, "ab")
+        self._index_file = open(self.index_path, "ab")
+
+    def _load(self):
+        for path in (self.embeddings_path, self.index_path):
+            if not os.path.exists(path):
+                open(path, "wb").close()
+
+        embeddings_size = os.path.getsize(self.embeddings_path)
+        with open(self.index_path, "rb") as index_file:
+            index_bytes = index_file.read()
+
+        valid_index_size = 0
+        for position in range(0, len(index_bytes) - INDEX_RECORD.size + 1, INDEX_RECORD.size):
+            digest, offset, dimensions = INDEX_RECORD.unpack_from(index_bytes, position)
+            if offset + 4 * dimensions > embeddings_size:
+                # A record written after an interrupted vector write.
+                break
+            self._index[digest] = (offset, dimensions)
+            valid_index_size = position + INDEX_RECORD.size
+
+        if valid_index_size != len(index_bytes):
+            # Drop a partially written or dangling trailing record.
+            with open(self.index_path, "r+b") as index_file:
+                index_file.truncate(valid_index_size)
+
+        self._remap()
+
+    def _remap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if os.path.getsize(self.embeddings_path) > 0:
+            with open(self.embeddings_path, "rb") as embeddings_file:
+                self._mmap = mmap.mmap(embeddings_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def _key(text):
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, text):
+        """Return the cached embedding of a text, or None."""
+        key = self._key(text)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            offset, dimensions = entry
+            if self._mmap is None or offset + 4 * dimensions > len(self._mmap):
+                self._embeddings_file.flush()
+                self._remap()
+            vector = array("f")
+            vector.frombytes(self._mmap[offset:offset + 4 * dimensions])
+            self.hits += 1
+
+        if sys.byteorder != "little":
+            vector.byteswap()
+        return vector.tolist()
+
+    def put(self, text, embedding):
+        key = self._key(text)
+        vector = array("f", embedding)
+        if sys.byteorder != "little":
+            vector.byteswap()
+
+        with self._lock:
+            if key in self._index:
+                return
+            offset = self._embeddings_file.tell()
+            self._embeddings_file.write(vector.tobytes())
+            # The vector must be written before the index record pointing to it.
+            self._embeddings_file.flush()
+            self._index_file.write(INDEX_RECORD.pack(key, offset, len(vector)))
+            self._index_file.flush()
+            self._index[key] = (offset, len(vector))
+
+    def close(self):
+        with self._lock:
+            self._embeddings_file.close()
+            self._index_file.close()
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+
+    def report(self):
+        return f"Embedding cache: {len(self)} entries, {self.hits} hits, {self.misses} misses."
+
+    def _s3_keys(self, s3_prefix):
+        namespace = os.path.basename(self.directory)
+        return {
+            path: f"{s3_prefix.rstrip('/')}/{namespace}/{os.path.basename(path)}"
+            for path in (self.embeddings_path, self.index_path)
+        }
+
+    @classmethod
+    def from_s3(cls, s3_client, bucket_name, s3_prefix, cache_directory, model_id, model_kwargs=None):
+        """Download the cache files from S3, when they exist, and open the cache."""
+        namespace_directory = os.path.join(
+            cache_directory, get_cache_namespace(model_id, model_kwargs)
+        )
+        os.makedirs(namespace_directory, exist_ok=True)
+        for filename in (EMBEDDINGS_FILENAME, INDEX_FILENAME):
+            key = f"{s3_prefix.rstrip('/')}/{os.path.basename(namespace_directory)}/{filename}"
+            try:
+                s3_client.download_file(bucket_name, key, os.path.join(namespace_directory, filename))
+            except s3_client.exceptions.ClientError as error:
+                if error.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                    raise
+                print(f"No embedding cache found at s3://{bucket_name}/{key}")
+        return cls(cache_directory, model_id, model_kwargs)
+
+    def upload_to_s3(self, s3_client, bucket_name, s3_prefix):
+        with self._lock:
+            self._embeddings_file.flush()
+            self._index_file.flush()
+            # Upload the vectors first so the uploaded index never points past them.
+            for path, key in self._s3_keys(s3_prefix).items():
+                s3_client.upload_file(path, bucket_name, key)
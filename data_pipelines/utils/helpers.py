@@ -1,9 +1,17 @@
 import json
+import zlib
+
 import boto3
 
 # Initialize the S3 client
 s3_client = boto3.client("s3")
 
+# S3 multipart parts must be at least 5 MiB, except the last one.
+MIN_MULTIPART_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+DEFAULT_RANGE_SIZE = 8 * 1024 * 1024
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+
 
 def store_list_to_s3(bucket_name, object_key, data):
     # Serialize the list using json
@@ -18,4 +26,140 @@ def load_list_from_s3(bucket_name, object_key):
     json_data = response["Body"].read()
 
     data = json.loads(json_data)
-    return data
\ No newline at end of file
+    return data
+
+
+def parse_s3_uri(s3_uri):
+    """Split an s3://bucket/prefix URI into its bucket name and prefix."""
+    if not s3_uri.startswith("s3://"):
+        raise ValueError(f"{s3_uri} is not a valid S3 URI.")
+    bucket_name, _, prefix = s3_uri[len("s3://"):].partition("/")
+    return bucket_name, prefix
+
+
+def infer_compression(object_key, compression="infer"):
+    """Return "gzip", "zstd" or None, from the key suffix when compression is "infer"."""
+    if compression != "infer":
+        return compression
+    for suffix, suffix_compression in COMPRESSION_SUFFIXES.items():
+        if object_key.endswith(suffix):
+            return suffix_compression
+    return None
+
+
+def _compressor(compression):
+    if compression is None:
+        return None
+    if compression == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if compression == "zstd":
+        # zstandard is only needed for zstd compressed objects.
+        import zstandard
+
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError(f"Unsupported compression {compression}, use gzip, zstd or None.")
+
+
+def _decompressor(compression):
+    if compression is None:
+        return None
+    if compression == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"Unsupported compression {compression}, use gzip, zstd or None.")
+
+
+def store_jsonl_to_s3(
+    bucket_name, object_key, records, compression="infer", part_size=DEFAULT_PART_SIZE, client=None
+):
+    """Stream records to S3 as JSONL with a multipart upload.
+
+    Records are serialized one per line and compressed as they come, only one
+    part is held in memory, so `records` can be a generator over a corpus that
+    does not fit in memory. The upload is aborted if serialization or a part
+    upload fails, so no partial object is left behind.
+
+    Args:
+        compression: "gzip", "zstd", None, or "infer" from a `.gz` or `.zst` key suffix.
+        client: the S3 client, e.g. one with an `endpoint_url` of a local S3
+            stand-in, defaults to the module client.
+
+    Returns:
+        int: the number of records written.
+    """
+    client = client or s3_client
+    if part_size < MIN_MULTIPART_PART_SIZE:
+        raise ValueError(f"part_size must be at least {MIN_MULTIPART_PART_SIZE} bytes.")
+    compressor = _compressor(infer_compression(object_key, compression))
+
+    upload_id = client.create_multipart_upload(
+        Bucket=bucket_name, Key=object_key, ContentType="application/x-ndjson"
+    )["UploadId"]
+    parts = []
+    buffer = bytearray()
+
+    def upload_part(body):
+        part_number = len(parts) + 1
+        response = client.upload_part(
+            Bucket=bucket_name, Key=object_key, UploadId=upload_id, PartNumber=part_number, Body=bytes(body)
+        )
+        parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    num_records = 0
+    try:
+        for record in records:
+            line = json.dumps(record).encode("utf-8") + b"\n"
+            buffer += compressor.compress(line) if compressor else line
+            num_records += 1
+            if len(buffer) >= part_size:
+                upload_part(buffer[:part_size])
+                del buffer[:part_size]
+        if compressor:
+            buffer += compressor.flush()
+        # The last part can be smaller than 5 MiB, and an empty object still needs one part.
+        if buffer or not parts:
+            upload_part(buffer)
+        client.complete_multipart_upload(
+            Bucket=bucket_name, Key=object_key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+    except BaseException:
+        client.abort_multipart_upload(Bucket=bucket_name, Key=object_key, UploadId=upload_id)
+        raise
+    return num_records
+
+
+def iter_jsonl_from_s3(
+    bucket_name, object_key, compression="infer", range_size=DEFAULT_RANGE_SIZE, client=None
+):
+    """Lazily yield the records of a JSONL object, reading it with ranged GETs.
+
+    Only one range and the current line are held in memory. Each range is
+    requested with the ETag of the object, so the read fails instead of
+    mixing two versions if the object is overwritten in the meantime.
+    """
+    client = client or s3_client
+    decompressor = _decompressor(infer_compression(object_key, compression))
+    head = client.head_object(Bucket=bucket_name, Key=object_key)
+    content_length = head["ContentLength"]
+
+    pending = b""
+    for start in range(0, content_length, range_size):
+        end = min(start + range_size, content_length) - 1
+        response = client.get_object(
+            Bucket=bucket_name, Key=object_key, Range=f"bytes={start}-{end}", IfMatch=head["ETag"]
+        )
+        data = response["Body"].read()
+        pending += decompressor.decompress(data) if decompressor else data
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+    if decompressor and hasattr(decompressor, "flush"):
+        pending += decompressor.flush()
+    if pending.strip():
+        yield json.loads(pending)
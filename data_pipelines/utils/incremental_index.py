@@ -0,0 +1,124 @@
+"""Incremental re-indexing of document chunks based on content hashes.
+
+Every chunk gets a stable ID made of a hash of its position, i.e. the source
+document, page and chunk offset within the page, and a hash of its content
+and of the embedding model configuration. Comparing the IDs of the current
+chunks to the IDs already stored in the collection tells which chunks are
+new, changed, unchanged or deleted, so only the new and changed chunks need
+to be embedded. A chunk embedded with another model or embedding size is a
+changed chunk, so the collection never mixes embeddings of different models.
+"""
+import hashlib
+import json
+from collections import defaultdict
+
+from .vector_precision import get_collection_id
+
+CHUNK_ID_METADATA_KEY = "chunk_id"
+
+
+def _short_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def get_embedding_config_key(model_id, model_kwargs=None):
+    """Identify the embedding model configuration, e.g. the model and the embedding size."""
+    return json.dumps([model_id, model_kwargs or {}], sort_keys=True)
+
+
+def compute_chunk_id(document_location, page_number, chunk_offset, chunk_text, embedding_config_key=""):
+    position = f"{document_location}|{page_number}|{chunk_offset}"
+    return f"{_short_hash(position)}-{_short_hash(embedding_config_key + '|' + chunk_text)}"
+
+
+def _chunk_position(chunk_id):
+    return chunk_id.split("-")[0]
+
+
+def assign_chunk_ids(chunks, embedding_config_key=""):
+    """Add a stable `chunk_id` to the metadata of each chunk.
+
+    The chunk offset is the index of the chunk within its page,
+    following the order in which the splitter produced them.
+
+    Args:
+        embedding_config_key (str): see `get_embedding_config_key`.
+    """
+    chunk_offsets = defaultdict(int)
+    for chunk in chunks:
+        page_key = (
+            chunk.metadata["document_source_location"],
+            chunk.metadata["page_number"],
+        )
+        chunk.metadata[CHUNK_ID_METADATA_KEY] = compute_chunk_id(
+            page_key[0], page_key[1], chunk_offsets[page_key], chunk.page_content, embedding_config_key
+        )
+        chunk_offsets[page_key] += 1
+    return chunks
+
+
+def get_existing_chunk_ids(db_connection, collection_name, document_filter=None):
+    """Return the set of chunk IDs stored in the collection, empty if it does not exist.
+
+    Args:
+        document_filter (callable, optional): only return the IDs of chunks whose
+            `document_source_location` metadata satisfies this predicate.
+    """
+    try:
+        collection_id = get_collection_id(db_connection, collection_name)
+    except ValueError:
+        return set()
+
+    with db_connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT custom_id, cmetadata->>'document_source_location' FROM langchain_pg_embedding"
+            " WHERE collection_id = %s AND custom_id IS NOT NULL;",
+            (collection_id,),
+        )
+        return {
+            chunk_id for chunk_id, document_location in cursor.fetchall()
+            if document_filter is None or document_filter(document_location)
+        }
+
+
+class IncrementalIndexer:
+    """Track the chunks of a run against the chunk IDs already stored.
+
+    Chunks are streamed through `filter_chunks`, which only yields the new and
+    changed chunks, and `ids_to_delete` is known once all chunks were seen.
+    """
+
+    def __init__(self, existing_chunk_ids):
+        self.existing_chunk_ids = set(existing_chunk_ids)
+        self.current_chunk_ids = set()
+        self.added_chunk_ids = []
+        self.num_unchanged = 0
+
+    def filter_chunks(self, chunks):
+        for chunk in chunks:
+            chunk_id = chunk.metadata[CHUNK_ID_METADATA_KEY]
+            if chunk_id in self.current_chunk_ids:
+                # Same text at the same position, keep a single copy.
+                continue
+            self.current_chunk_ids.add(chunk_id)
+            if chunk_id in self.existing_chunk_ids:
+                self.num_unchanged += 1
+                continue
+            self.added_chunk_ids.append(chunk_id)
+            yield chunk
+
+    @property
+    def ids_to_delete(self):
+        return sorted(self.existing_chunk_ids - self.current_chunk_ids)
+
+    def report(self):
+        ids_to_delete = self.ids_to_delete
+        # A position present in both the added and deleted chunks had its content changed.
+        added_positions = {_chunk_position(chunk_id) for chunk_id in self.added_chunk_ids}
+        deleted_positions = {_chunk_position(chunk_id) for chunk_id in ids_to_delete}
+        num_changed = len(added_positions & deleted_positions)
+
+        return (
+            f"{len(self.added_chunk_ids) - num_changed} new, {num_changed} changed,"
+            f" {self.num_unchanged} unchanged and {len(ids_to_delete) - num_changed} deleted chunks."
+        )
@@ -0,0 +1,173 @@
+"""Concurrent LLM cleanup of the Textract markdown, page by page.
+
+Each page of the Textract markdown output is sent to an Anthropic Claude
+model on Amazon Bedrock to fix tables and layout artifacts. The calls are
+dispatched by a pool of threads, bounded by a semaphore shared by all the
+documents being processed, and paced by the adaptive token bucket of
+`utils.bedrock_calls`, which halves its rate on throttling. Throttling and
+transient errors are retried with backoff. Pages are returned in their
+original order.
+
+Pages that already look clean, with no tables and no layout artifacts such
+as hyphenated line breaks or runs of short fragments, are kept as is without
+calling the LLM. With a `CheckpointStore`, the improved markdown of each page
+is kept under the hash of the page, model id, prompts and max_tokens, and is
+reused on reruns.
+"""
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from .bedrock_calls import ProgressReporter, TokenBucketRateLimiter, invoke_with_retries
+from .checkpoints import checkpoint_key
+
+CLEANUP_STAGE = "cleanup"
+
+MARKDOWN_TABLE_LINE_PATTERN = re.compile(r"^\s*\|", re.MULTILINE)
+HYPHENATED_LINE_BREAK_PATTERN = re.compile(r"\w-\n\w")
+LAYOUT_ARTIFACT_PATTERN = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\ufffd]|\.{5,}|_{5,}")
+
+
+def is_clean_markdown(markdown, max_short_line_ratio=0.3, short_line_words=3):
+    """Cheap heuristic telling whether a page does not need an LLM cleanup."""
+    if MARKDOWN_TABLE_LINE_PATTERN.search(markdown):
+        return False
+    if HYPHENATED_LINE_BREAK_PATTERN.search(markdown) or LAYOUT_ARTIFACT_PATTERN.search(markdown):
+        return False
+
+    lines = [line.strip() for line in markdown.splitlines() if line.strip()]
+    text_lines = [line for line in lines if not line.startswith("#")]
+    if not text_lines:
+        return True
+    # Text broken into many fragments usually comes from multi-column layouts.
+    short_lines = [line for line in text_lines if len(line.split()) < short_line_words]
+    return len(short_lines) / len(text_lines) <= max_short_line_ratio
+
+
+def _percentile(values, percentile):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))]
+
+
+class MarkdownCleaner:
+    """Improve the markdown of pages with an LLM, a bounded number of calls at a time.
+
+    Note:
+        The Bedrock client should be created with botocore retries disabled,
+        i.e. `retries={"total_max_attempts": 1}`, so throttling reaches the rate limiter.
+        `invoke_with_retries` retries the throttling and transient errors instead.
+    """
+
+    def __init__(
+        self,
+        bedrock_runtime,
+        model_id,
+        system_prompt,
+        user_prompt,
+        max_concurrency=4,
+        max_tokens=3000,
+        rate_limiter=None,
+        max_retries=8,
+        skip_clean_pages=True,
+        checkpoints=None,
+    ):
+        self.bedrock_runtime = bedrock_runtime
+        self.model_id = model_id
+        self.system_prompt = system_prompt
+        self.user_prompt = user_prompt
+        self.max_concurrency = max_concurrency
+        self.max_tokens = max_tokens
+        self.rate_limiter = rate_limiter or TokenBucketRateLimiter(
+            rate=max_concurrency, max_rate=4 * max_concurrency
+        )
+        self.max_retries = max_retries
+        self.skip_clean_pages = skip_clean_pages
+        self.checkpoints = checkpoints
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.num_skipped_pages = 0
+        self.num_failed_pages = 0
+        self.num_checkpointed_pages = 0
+
+    def _generate_message(self, user_input):
+        body = json.dumps(
+            {
+                "anthropic_version": "bedrock-2023-05-31",
+                "max_tokens": self.max_tokens,
+                "system": self.system_prompt,
+                "messages": [{"role": "user", "content": user_input}],
+            }
+        )
+        response = invoke_with_retries(
+            lambda: self.bedrock_runtime.invoke_model(body=body, modelId=self.model_id),
+            self.rate_limiter,
+            self.max_retries,
+        )
+        return json.loads(response.get("body").read())
+
+    def improve_page(self, markdown):
+        """Return the improved markdown of a page, or the page as is when it is clean or the call fails."""
+        if self.skip_clean_pages and is_clean_markdown(markdown):
+            with self._lock:
+                self.num_skipped_pages += 1
+            return markdown
+
+        if self.checkpoints is not None:
+            key = checkpoint_key(
+                self.model_id, self.system_prompt, self.user_prompt, self.max_tokens, markdown
+            )
+            improved_markdown = self.checkpoints.get(CLEANUP_STAGE, key)
+            if improved_markdown is not None:
+                with self._lock:
+                    self.num_checkpointed_pages += 1
+                return improved_markdown
+
+        user_input = self.user_prompt.format(markdown_doc=markdown)
+        with self._semaphore:
+            start = time.perf_counter()
+            try:
+                result = self._generate_message(user_input)
+            except (ClientError, BotoCoreError) as err:
+                # Raised once the retries of the throttling and transient errors are exhausted.
+                print(f"A Bedrock error occured, keeping the Textract markdown: {err}")
+                with self._lock:
+                    self.num_failed_pages += 1
+                return markdown
+            latency = time.perf_counter() - start
+
+        with self._lock:
+            self.latencies.append(latency)
+        # Extract the text between the <results> XML tags only.
+        improved_markdown = result["content"][0]["text"].split("<results>")[-1].split("</results>")[0].strip()
+        if self.checkpoints is not None:
+            self.checkpoints.put(CLEANUP_STAGE, key, improved_markdown)
+        return improved_markdown
+
+    def improve_pages(self, pages_markdown, progress_interval_seconds=10.0):
+        """Improve pages concurrently and return them in their original order."""
+        progress = ProgressReporter(
+            "Markdown cleanup", progress_interval_seconds, rate_limiter=self.rate_limiter, unit="pages"
+        )
+        improved_pages = []
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for improved_page in executor.map(self.improve_page, pages_markdown):
+                improved_pages.append(improved_page)
+                progress.update(1)
+        progress.report()
+        return improved_pages
+
+    def report(self):
+        with self._lock:
+            latencies = list(self.latencies)
+        return (
+            f"Markdown cleanup: {len(latencies)} LLM calls, {self.num_skipped_pages} clean pages skipped,"
+            f" {self.num_checkpointed_pages} from checkpoints, {self.num_failed_pages} failed, latency p50 {_percentile(latencies, 50):.1f}s"
+            f" p95 {_percentile(latencies, 95):.1f}s max {_percentile(latencies, 100):.1f}s"
+        )
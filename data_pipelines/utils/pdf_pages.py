@@ -0,0 +1,129 @@
+"""Keep the relevant pages of the reports, one process per document.
+
+Parsing and rewriting multi-hundred-page pdfs with pypdf is CPU bound, so
+documents are processed in parallel by a process pool. The result of each
+document is appended to a `page_selection.jsonl` file as soon as it
+completes, together with the sha256 of the source pdf and the kept pages.
+On the next run, documents whose source pdf and pages did not change are
+skipped.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pypdf import PdfReader, PdfWriter
+
+PAGE_SELECTION_FILENAME = "page_selection.jsonl"
+
+
+def file_sha256(file_path):
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def keep_relevant_pages_in_pdf(input_pdf_path, output_pdf_path, pages):
+    input_pdf = PdfReader(input_pdf_path)
+    print(f"Number of pages is {len(input_pdf.pages)}")
+    print(f"Relevant pages are {pages}")
+    output_pdf = PdfWriter()
+
+    for page_num in pages:
+        output_pdf.add_page(input_pdf.pages[page_num - 1])
+
+    with open(output_pdf_path, "wb") as f:
+        output_pdf.write(f)
+
+
+def select_document_pages(input_pdf_path, output_pdf_path, pages, previous_selection=None):
+    """Write the relevant pages of a pdf, or copy it when no pages are given.
+
+    Skipped when the previous selection has the same source hash and pages
+    and its output still exists.
+
+    Returns:
+        dict: the selection, with the source sha256, pages, whether it was
+        skipped and the processing time.
+    """
+    start = time.perf_counter()
+    source_sha256 = file_sha256(input_pdf_path)
+    selection = {
+        "local_pdf_path": output_pdf_path,
+        "source_sha256": source_sha256,
+        "pages": pages,
+    }
+
+    previous_selection = previous_selection or {}
+    selection["skipped"] = (
+        previous_selection.get("source_sha256") == source_sha256
+        and previous_selection.get("pages") == pages
+        and os.path.exists(output_pdf_path)
+    )
+    if not selection["skipped"]:
+        if pages:
+            keep_relevant_pages_in_pdf(input_pdf_path, output_pdf_path, pages)
+        else:
+            # When page numbers are not defined, we assume the user wants
+            # to process the full file, therefore, copy it as is
+            # to the prepared folder
+            shutil.copyfile(input_pdf_path, output_pdf_path)
+
+    selection["seconds"] = time.perf_counter() - start
+    return selection
+
+
+def load_page_selections(prepared_base_directory):
+    """Return the last recorded selection of each output pdf."""
+    selection_path = os.path.join(prepared_base_directory, PAGE_SELECTION_FILENAME)
+    selections = {}
+    if os.path.exists(selection_path):
+        with open(selection_path, "r") as selection_file:
+            for line in selection_file:
+                if line.strip():
+                    selection = json.loads(line)
+                    selections[selection["local_pdf_path"]] = selection
+    return selections
+
+
+def select_pages_in_documents(documents, prepared_base_directory, processes=None):
+    """Select the pages of documents in a process pool.
+
+    Args:
+        documents: a list of (input_pdf_path, output_pdf_path, pages, metadata) tuples.
+        processes (int, optional): number of worker processes, defaults to the number of cores.
+
+    Yields:
+        (metadata, selection) of each document, as they complete.
+    """
+    previous_selections = load_page_selections(prepared_base_directory)
+    selection_path = os.path.join(prepared_base_directory, PAGE_SELECTION_FILENAME)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor, open(selection_path, "a") as selection_file:
+        futures = {
+            executor.submit(
+                select_document_pages,
+                input_pdf_path,
+                output_pdf_path,
+                pages,
+                previous_selections.get(output_pdf_path),
+            ): metadata
+            for input_pdf_path, output_pdf_path, pages, metadata in documents
+        }
+        for future in as_completed(futures):
+            metadata = futures[future]
+            selection = future.result()
+            selection_file.write(json.dumps({**selection, "metadata": metadata}) + "\n")
+            selection_file.flush()
+            yield metadata, selection
+
+    # Compact the file to the last selection of each document.
+    selections = load_page_selections(prepared_base_directory)
+    with open(selection_path + ".tmp", "w") as selection_file:
+        for selection in selections.values():
+            selection_file.write(json.dumps(selection) + "\n")
+    os.replace(selection_path + ".tmp", selection_path)
@@ -0,0 +1,130 @@
+"""Bulk load embeddings into the PGVector embeddings table with COPY.
+
+Instead of inserting rows one by one through the ORM, rows are streamed with
+`COPY ... FROM STDIN` into an index-free staging table. The rows of the other
+collections are copied over, and the staging table is swapped in place of the
+live table with the helpers of `staging_tables`. Searches keep using the
+previous version of the table until the swap commits.
+
+Note: writes to `langchain_pg_embedding` made by other processes while the
+bulk load runs are lost when the staging table is swapped in.
+"""
+import io
+import json
+import time
+import uuid
+
+from .staging_tables import STAGING_SUFFIX, build_staging_indexes, quote_identifier, swap_staging_table
+from .vector_precision import get_collection_id, to_vector_literal
+
+EMBEDDINGS_TABLE = "langchain_pg_embedding"
+COPY_COLUMNS = ("uuid", "collection_id", "custom_id", "embedding", "document", "cmetadata")
+
+
+def _escape_copy_text(value):
+    """Escape a value for the COPY text format."""
+    if value is None:
+        return "\\N"
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class CopyRowsReader(io.RawIOBase):
+    """File like object that lazily encodes rows in the COPY text format."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = b""
+        self.num_rows = 0
+
+    def readable(self):
+        return True
+
+    def _next_line(self):
+        row = next(self._rows, None)
+        if row is None:
+            return None
+        self.num_rows += 1
+        return ("\t".join(_escape_copy_text(value) for value in row) + "\n").encode("utf-8")
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            line = self._next_line()
+            if line is None:
+                break
+            self._buffer += line
+
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def bulk_load_embeddings(db_connection, collection_name, rows, table_name=EMBEDDINGS_TABLE):
+    """Replace the embeddings of a collection using COPY and a staging table swap.
+
+    Args:
+        collection_name (str): the collection must already exist,
+            e.g. created by instantiating PGVector.
+        rows: an iterable of (custom_id, embedding, document, metadata) tuples.
+
+    Returns:
+        int: the number of rows loaded for the collection.
+    """
+    collection_id = get_collection_id(db_connection, collection_name)
+    staging_table_name = table_name + STAGING_SUFFIX
+    table = quote_identifier(table_name)
+    staging_table = quote_identifier(staging_table_name)
+
+    copy_rows = (
+        (
+            str(uuid.uuid4()),
+            collection_id,
+            custom_id,
+            to_vector_literal(embedding),
+            document,
+            json.dumps(metadata),
+        )
+        for custom_id, embedding, document, metadata in rows
+    )
+    reader = CopyRowsReader(copy_rows)
+
+    with db_connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {staging_table};")
+        cursor.execute(
+            f"CREATE TABLE {staging_table} (LIKE {table} INCLUDING DEFAULTS);"
+        )
+
+        start = time.perf_counter()
+        cursor.copy_expert(
+            f"COPY {staging_table} ({', '.join(COPY_COLUMNS)}) FROM STDIN",
+            reader,
+        )
+        copy_seconds = time.perf_counter() - start
+        print(
+            f"Copied {reader.num_rows} rows in {copy_seconds:.1f}s"
+            f" ({reader.num_rows / max(copy_seconds, 1e-9):.1f} rows/sec)"
+        )
+
+        # Keep the rows of the other collections.
+        cursor.execute(
+            f"INSERT INTO {staging_table} SELECT * FROM {table}"
+            " WHERE collection_id IS DISTINCT FROM %s;",
+            (collection_id,),
+        )
+
+        start = time.perf_counter()
+        renames = build_staging_indexes(cursor, table_name, staging_table_name)
+        cursor.execute(f"ANALYZE {staging_table};")
+        print(f"Built indexes in {time.perf_counter() - start:.1f}s")
+    db_connection.commit()
+
+    with db_connection.cursor() as cursor:
+        swap_staging_table(cursor, table_name, staging_table_name, renames)
+    db_connection.commit()
+
+    return reader.num_rows
@@ -0,0 +1,126 @@
+"""Materialised aggregate views of the SQL tables, refreshed on each load.
+
+The analytics questions asked to the SQL assistant, such as the max or
+average revenue of a company, year-over-year growth or employee counts, are
+precomputed per company and per (company, year), so answering them does not
+scan the entities table however many rows it has.
+
+The views are dropped before a table is swapped in, since they depend on it,
+and are recreated in the same transaction. After an upsert, they are
+refreshed concurrently so readers are never blocked.
+
+Each aggregate is stored in a materialised view suffixed with `_mv` and
+exposed through a plain view, since SQLAlchemy 2.0, and therefore the SQL
+assistant's `SQLDatabase`, does not list materialised views.
+"""
+import psycopg2
+
+MATERIALIZED_VIEW_SUFFIX = "_mv"
+
+# Per source table, (view name, unique key columns, description, query) of each aggregate view.
+# The table catalog carries the descriptions to the SQL assistant, see utils.sql_table_catalog.
+AGGREGATE_VIEWS = {
+    "extracted_entities": [
+        (
+            "extracted_entities_by_company_year",
+            ("company", "year"),
+            (
+                "Precomputed aggregates of extracted_entities with one row per company and year:"
+                " revenue, number of employees, number of reports, and the revenue and"
+                " number of employees growth in percent since the previous reported year."
+            ),
+            """
+            SELECT
+                company,
+                year,
+                MAX(revenue) AS revenue,
+                MAX(revenue_unit) AS revenue_unit,
+                MAX(human_capital) AS num_employees,
+                100 * (
+                    MAX(revenue)::DOUBLE PRECISION
+                    / NULLIF(LAG(MAX(revenue)) OVER (PARTITION BY company ORDER BY year), 0) - 1
+                ) AS revenue_growth_pct,
+                100 * (
+                    MAX(human_capital)::DOUBLE PRECISION
+                    / NULLIF(LAG(MAX(human_capital)) OVER (PARTITION BY company ORDER BY year), 0) - 1
+                ) AS num_employees_growth_pct,
+                COUNT(*) AS num_reports
+            FROM extracted_entities
+            GROUP BY company, year
+            """,
+        ),
+        (
+            "extracted_entities_by_company",
+            ("company",),
+            (
+                "Precomputed aggregates of extracted_entities with one row per company:"
+                " first and last year, number of years, max, min and average revenue,"
+                " and max, min and average number of employees."
+            ),
+            """
+            SELECT
+                company,
+                MIN(year) AS first_year,
+                MAX(year) AS last_year,
+                COUNT(DISTINCT year) AS num_years,
+                MAX(revenue) AS max_revenue,
+                MIN(revenue) AS min_revenue,
+                AVG(revenue) AS avg_revenue,
+                MAX(revenue_unit) AS revenue_unit,
+                MAX(human_capital) AS max_num_employees,
+                MIN(human_capital) AS min_num_employees,
+                AVG(human_capital) AS avg_num_employees
+            FROM extracted_entities
+            GROUP BY company
+            """,
+        ),
+    ],
+}
+
+
+def _materialized_view_exists(cursor, view_name):
+    cursor.execute("SELECT 1 FROM pg_matviews WHERE matviewname = %s;", (view_name,))
+    return cursor.fetchone() is not None
+
+
+def drop_aggregate_views(cursor, table_name):
+    """Drop the aggregate views of a table, before it is dropped or swapped."""
+    for view_name, _, _, _ in AGGREGATE_VIEWS.get(table_name, []):
+        cursor.execute(f"DROP VIEW IF EXISTS {view_name};")
+        cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {view_name}{MATERIALIZED_VIEW_SUFFIX};")
+
+
+def refresh_aggregate_views(cursor, table_name):
+    """Create the missing aggregate views of a table and refresh the existing ones.
+
+    A view is skipped, with a warning, when the table does not have the columns
+    it aggregates, e.g. when the csv files changed shape. The caller commits.
+    """
+    for view_name, key_columns, _, query in AGGREGATE_VIEWS.get(table_name, []):
+        materialized_view_name = view_name + MATERIALIZED_VIEW_SUFFIX
+        cursor.execute("SAVEPOINT aggregate_view;")
+        try:
+            if _materialized_view_exists(cursor, materialized_view_name):
+                cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {materialized_view_name};")
+                print(f"Refreshed {view_name}")
+            else:
+                cursor.execute(f"CREATE MATERIALIZED VIEW {materialized_view_name} AS {query};")
+                # Refreshing concurrently requires a unique index.
+                cursor.execute(
+                    f"CREATE UNIQUE INDEX {materialized_view_name}_key_idx"
+                    f" ON {materialized_view_name} ({', '.join(key_columns)});"
+                )
+                cursor.execute(
+                    f"CREATE OR REPLACE VIEW {view_name} AS SELECT * FROM {materialized_view_name};"
+                )
+                print(f"Created {view_name}")
+        except psycopg2.Error as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT aggregate_view;")
+            print(f"Warning: could not build {view_name} from {table_name}: {e}")
+        cursor.execute("RELEASE SAVEPOINT aggregate_view;")
+
+
+def get_aggregate_view_descriptions(table_name):
+    return {
+        view_name: description for view_name, _, description, _ in AGGREGATE_VIEWS.get(table_name, [])
+    }
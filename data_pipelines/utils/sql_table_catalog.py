@@ -0,0 +1,144 @@
+"""Catalog of the SQL tables, embedded for relevance based table selection.
+
+The SQL assistant can't put the schema and sample rows of every table in the
+text-to-SQL prompt once dozens of tables are loaded. Each time tables are
+loaded, a description of each table and of its columns is embedded and
+stored in the `sql_table_catalog` table. At query time, the assistant embeds
+the question with the same model and only puts the top-k closest tables in
+the prompt.
+
+Descriptions are only re-embedded when they change, or when the embedding
+model or its dimensions change, and the entries of tables that no longer
+exist are removed.
+"""
+from .sql_aggregates import get_aggregate_view_descriptions
+from .vector_precision import to_vector_literal
+
+CATALOG_TABLE = "sql_table_catalog"
+
+
+def create_catalog_table(cursor):
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} ("
+        " table_name TEXT PRIMARY KEY,"
+        " description TEXT,"
+        " document TEXT NOT NULL,"
+        " embedding_model_id TEXT NOT NULL,"
+        " embedding_dimensions INTEGER NOT NULL,"
+        " embedding vector NOT NULL,"
+        " updated_at TIMESTAMPTZ NOT NULL);"
+    )
+    # Catalogs created before the dimensions were stored.
+    cursor.execute(
+        f"ALTER TABLE {CATALOG_TABLE} ADD COLUMN IF NOT EXISTS embedding_dimensions INTEGER;"
+    )
+    cursor.execute(
+        f"UPDATE {CATALOG_TABLE} SET embedding_dimensions = vector_dims(embedding)"
+        " WHERE embedding_dimensions IS NULL;"
+    )
+
+
+def describe_table(cursor, table_name, description=None):
+    """Return the text embedded for a table: its name, description and columns."""
+    cursor.execute(
+        "SELECT column_name, data_type,"
+        " col_description(to_regclass(quote_ident(table_name))::oid, ordinal_position::int)"
+        " FROM information_schema.columns"
+        " WHERE table_schema = current_schema() AND table_name = %s ORDER BY ordinal_position;",
+        (table_name,),
+    )
+    columns = [
+        f"- {column_name} ({data_type})" + (f": {column_description}" if column_description else "")
+        for column_name, data_type, column_description in cursor.fetchall()
+    ]
+    lines = [f"Table {table_name}"]
+    if description:
+        lines.append(description)
+    lines.append("Columns:")
+    lines.extend(columns)
+    return "\n".join(lines)
+
+
+def update_table_catalog(
+    db_connection,
+    table_names,
+    embedding_model,
+    embedding_model_id,
+    table_descriptions=None,
+    embedding_dimensions=None,
+):
+    """Embed the descriptions of the tables, and of their aggregate views, into the catalog.
+
+    Args:
+        table_names (List, str): the loaded tables.
+        embedding_model: an object with `embed_documents` and `embed_query`
+            methods, the SQL assistant must embed questions with the same
+            model and dimensions.
+        table_descriptions (dict, optional): table name to a description of its content.
+        embedding_dimensions (int, optional): size of the embeddings of the
+            model, found by embedding a probe text when not given.
+    """
+    if embedding_dimensions is None:
+        embedding_dimensions = len(embedding_model.embed_query(CATALOG_TABLE))
+
+    descriptions = dict(table_descriptions or {})
+    catalog_table_names = list(table_names)
+    for table_name in table_names:
+        for view_name, view_description in get_aggregate_view_descriptions(table_name).items():
+            catalog_table_names.append(view_name)
+            descriptions.setdefault(view_name, view_description)
+
+    with db_connection.cursor() as cursor:
+        create_catalog_table(cursor)
+        cursor.execute(
+            f"DELETE FROM {CATALOG_TABLE} WHERE to_regclass(quote_ident(table_name)) IS NULL;"
+        )
+
+        documents = {}
+        for table_name in catalog_table_names:
+            cursor.execute("SELECT to_regclass(quote_ident(%s)) IS NOT NULL;", (table_name,))
+            if cursor.fetchone()[0]:
+                documents[table_name] = describe_table(cursor, table_name, descriptions.get(table_name))
+
+        cursor.execute(
+            f"SELECT table_name, document FROM {CATALOG_TABLE}"
+            " WHERE embedding_model_id = %s AND embedding_dimensions = %s;",
+            (embedding_model_id, embedding_dimensions),
+        )
+        indexed_documents = dict(cursor.fetchall())
+        changed_table_names = [
+            table_name for table_name, document in documents.items()
+            if indexed_documents.get(table_name) != document
+        ]
+
+        if changed_table_names:
+            embeddings = embedding_model.embed_documents(
+                [documents[table_name] for table_name in changed_table_names]
+            )
+            for table_name, embedding in zip(changed_table_names, embeddings):
+                cursor.execute(
+                    f"INSERT INTO {CATALOG_TABLE}"
+                    " (table_name, description, document, embedding_model_id,"
+                    " embedding_dimensions, embedding, updated_at)"
+                    " VALUES (%s, %s, %s, %s, %s, %s::vector, now())"
+                    " ON CONFLICT (table_name) DO UPDATE SET"
+                    " description = EXCLUDED.description, document = EXCLUDED.document,"
+                    " embedding_model_id = EXCLUDED.embedding_model_id,"
+                    " embedding_dimensions = EXCLUDED.embedding_dimensions,"
+                    " embedding = EXCLUDED.embedding, updated_at = EXCLUDED.updated_at;",
+                    (
+                        table_name,
+                        descriptions.get(table_name),
+                        documents[table_name],
+                        embedding_model_id,
+                        len(embedding),
+                        to_vector_literal(embedding),
+                    ),
+                )
+    db_connection.commit()
+
+    print(
+        f"Table catalog: {len(changed_table_names)} of {len(documents)} table descriptions embedded"
+    )
+    return changed_table_names
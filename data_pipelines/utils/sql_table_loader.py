@@ -0,0 +1,351 @@
+"""Stream csv files into Amazon Aurora PostgreSQL tables with COPY.
+
+Each csv file, or each partition of a partitioned csv folder, is streamed
+straight into Postgres with `COPY ... FROM STDIN`, and partitions are loaded
+in parallel over separate connections. Column types are inferred once from a
+sample of the first partition, or given explicitly, so the tables are never
+materialised in memory.
+
+The partitions are loaded into a staging table, so readers never see a missing
+or partially loaded table:
+
+- in "replace" mode, the indexes of the live table are rebuilt on the staging
+  table, which is then swapped in with a transactional rename.
+- in "upsert" mode, the staging table is merged into the live table on key
+  columns, e.g. (company, year), and only new or changed rows are written.
+  Rows missing from the csv files are kept.
+
+Each load refreshes the aggregate views of the table, see `sql_aggregates`,
+and bumps the version of the table in the `sql_table_versions` table, in the
+same transaction, so downstream caches can tell when a table changed.
+"""
+import csv
+import glob
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from .sql_aggregates import drop_aggregate_views, refresh_aggregate_views
+from .staging_tables import STAGING_SUFFIX, build_staging_indexes, quote_identifier, swap_staging_table
+
+LOAD_MODES = ("replace", "upsert")
+TABLE_VERSIONS_TABLE = "sql_table_versions"
+PANDAS_TO_POSTGRES_TYPES = {
+    "i": "BIGINT",
+    "u": "BIGINT",
+    "f": "DOUBLE PRECISION",
+    "b": "BOOLEAN",
+    "M": "TIMESTAMP",
+}
+
+
+def list_table_partitions(raw_tables_base_path, raw_table_path):
+    """Return the table name and the csv files of a csv file or partitioned csv folder."""
+    data_loading_path = os.path.join(raw_tables_base_path, raw_table_path)
+
+    if os.path.isdir(data_loading_path):
+        partitions = sorted(
+            path for path in glob.glob(os.path.join(data_loading_path, "*"))
+            if os.path.isfile(path)
+        )
+        table_name = raw_table_path
+    else:
+        partitions = [data_loading_path]
+        table_name = raw_table_path.split(".")[0]
+
+    return table_name, partitions
+
+
+def _read_header(partition_path):
+    with open(partition_path, "r", newline="") as csv_file:
+        header = next(csv.reader(csv_file))
+    # Name unnamed columns, such as a saved index, the same way pandas does.
+    return [name or f"Unnamed: {index}" for index, name in enumerate(header)]
+
+
+def infer_column_types(partition_path, column_types=None, sample_rows=1000):
+    """Infer the Postgres type of each column from a sample of a csv file.
+
+    Args:
+        column_types (dict, optional): explicit types that override the inferred ones.
+
+    Returns:
+        dict: column name to Postgres type, in the csv column order.
+    """
+    header = _read_header(partition_path)
+    sample_df = pd.read_csv(partition_path, nrows=sample_rows)
+    sample_df.columns = header
+
+    inferred_types = {
+        column: PANDAS_TO_POSTGRES_TYPES.get(sample_df[column].dtype.kind, "TEXT")
+        for column in header
+    }
+    inferred_types.update(column_types or {})
+    return inferred_types
+
+
+class _SelectedColumnsReader(io.RawIOBase):
+    """Re-encode a csv file keeping only some of its columns, for COPY."""
+
+    def __init__(self, csv_file, column_indices):
+        self._rows = csv.reader(csv_file)
+        self._column_indices = column_indices
+        self._buffer = b""
+        self._output = io.StringIO()
+        self._writer = csv.writer(self._output)
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._writer.writerow([row[index] for index in self._column_indices])
+            self._buffer += self._output.getvalue().encode("utf-8")
+            self._output.seek(0)
+            self._output.truncate()
+
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def copy_csv_partition(db_connection, table_name, partition_path, columns):
+    """Stream a csv file into a table with COPY.
+
+    Returns:
+        int: the number of loaded rows.
+    """
+    header = _read_header(partition_path)
+    column_list = ", ".join(quote_identifier(column) for column in columns)
+    copy_statement = f"COPY {quote_identifier(table_name)} ({column_list}) FROM STDIN WITH (FORMAT csv, HEADER true)"
+
+    with open(partition_path, "r", newline="") as csv_file, db_connection.cursor() as cursor:
+        if columns == header:
+            cursor.copy_expert(copy_statement, csv_file)
+        else:
+            column_indices = [header.index(column) for column in columns]
+            cursor.copy_expert(copy_statement, _SelectedColumnsReader(csv_file, column_indices))
+        num_rows = cursor.rowcount
+    db_connection.commit()
+    return num_rows
+
+
+def copy_csv_partitions(engine, table_name, partitions, columns, max_workers=4):
+    """Load the csv partitions of a table in parallel, one connection per partition.
+
+    Returns:
+        int: the total number of loaded rows.
+    """
+    def load_partition(partition_path):
+        db_connection = engine.raw_connection()
+        try:
+            return copy_csv_partition(db_connection, table_name, partition_path, columns)
+        finally:
+            db_connection.close()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(load_partition, partitions))
+
+
+def create_table(cursor, table_name, column_types, unlogged=False):
+    columns_definition = ", ".join(
+        f"{quote_identifier(column)} {column_type}" for column, column_type in column_types.items()
+    )
+    cursor.execute(f"DROP TABLE IF EXISTS {quote_identifier(table_name)};")
+    cursor.execute(
+        f"CREATE {'UNLOGGED ' if unlogged else ''}TABLE {quote_identifier(table_name)} ({columns_definition});"
+    )
+
+
+def table_exists(cursor, table_name):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (quote_identifier(table_name),))
+    return cursor.fetchone()[0]
+
+
+def get_key_index_name(table_name):
+    return f"{table_name}_key_idx"
+
+
+def _create_key_index(cursor, table_name, key_columns, index_name):
+    key_list = ", ".join(quote_identifier(column) for column in key_columns)
+    cursor.execute(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {quote_identifier(index_name)}"
+        f" ON {quote_identifier(table_name)} ({key_list});"
+    )
+
+
+def bump_table_version(cursor, table_name):
+    """Increment the version of a table, in the transaction of the cursor."""
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {TABLE_VERSIONS_TABLE} ("
+        " table_name TEXT PRIMARY KEY, version BIGINT NOT NULL, loaded_at TIMESTAMPTZ NOT NULL);"
+    )
+    cursor.execute(
+        f"INSERT INTO {TABLE_VERSIONS_TABLE} (table_name, version, loaded_at) VALUES (%s, 1, now())"
+        f" ON CONFLICT (table_name) DO UPDATE SET"
+        f" version = {TABLE_VERSIONS_TABLE}.version + 1, loaded_at = now()"
+        " RETURNING version;",
+        (table_name,),
+    )
+    return cursor.fetchone()[0]
+
+
+def get_table_version(db_connection, table_name):
+    """Return the version of a table, or 0 if it was never loaded."""
+    with db_connection.cursor() as cursor:
+        if not table_exists(cursor, TABLE_VERSIONS_TABLE):
+            return 0
+        cursor.execute(
+            f"SELECT version FROM {TABLE_VERSIONS_TABLE} WHERE table_name = %s;", (table_name,)
+        )
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def replace_table(db_connection, table_name, staging_table_name, key_columns=None):
+    """Index the staging table like the live table and swap it in."""
+    with db_connection.cursor() as cursor:
+        renames = []
+        if table_exists(cursor, table_name):
+            renames = build_staging_indexes(cursor, table_name, staging_table_name)
+        key_index_name = get_key_index_name(table_name)
+        if key_columns and key_index_name not in {live_name for _, live_name, _ in renames}:
+            _create_key_index(cursor, staging_table_name, key_columns, key_index_name + STAGING_SUFFIX)
+            renames.append((key_index_name + STAGING_SUFFIX, key_index_name, "index"))
+        cursor.execute(f"ANALYZE {quote_identifier(staging_table_name)};")
+    db_connection.commit()
+
+    with db_connection.cursor() as cursor:
+        if table_exists(cursor, table_name):
+            # The aggregate views depend on the live table, they are rebuilt below.
+            drop_aggregate_views(cursor, table_name)
+        swap_staging_table(cursor, table_name, staging_table_name, renames)
+        refresh_aggregate_views(cursor, table_name)
+        version = bump_table_version(cursor, table_name)
+    db_connection.commit()
+    return version
+
+
+def upsert_table(db_connection, table_name, staging_table_name, columns, key_columns):
+    """Merge the staging table into the live table, only writing new or changed rows.
+
+    Returns:
+        (int, int): the number of written rows and the new table version.
+    """
+    table = quote_identifier(table_name)
+    staging_table = quote_identifier(staging_table_name)
+    column_list = ", ".join(quote_identifier(column) for column in columns)
+    key_list = ", ".join(quote_identifier(column) for column in key_columns)
+    value_columns = [column for column in columns if column not in key_columns]
+    update_list = ", ".join(
+        f"{quote_identifier(column)} = EXCLUDED.{quote_identifier(column)}" for column in value_columns
+    )
+    live_values = ", ".join(f"{table}.{quote_identifier(column)}" for column in value_columns)
+    new_values = ", ".join(f"EXCLUDED.{quote_identifier(column)}" for column in value_columns)
+
+    with db_connection.cursor() as cursor:
+        _create_key_index(cursor, table_name, key_columns, get_key_index_name(table_name))
+        # DISTINCT ON keeps a single row per key, ON CONFLICT can't update a row twice.
+        on_conflict = (
+            f"DO UPDATE SET {update_list} WHERE ({live_values}) IS DISTINCT FROM ({new_values})"
+            if value_columns else "DO NOTHING"
+        )
+        cursor.execute(
+            f"INSERT INTO {table} ({column_list})"
+            f" SELECT DISTINCT ON ({key_list}) {column_list} FROM {staging_table} ORDER BY {key_list}"
+            f" ON CONFLICT ({key_list}) {on_conflict};"
+        )
+        num_written_rows = cursor.rowcount
+        cursor.execute(f"DROP TABLE {staging_table};")
+        refresh_aggregate_views(cursor, table_name)
+        version = bump_table_version(cursor, table_name)
+    db_connection.commit()
+    return num_written_rows, version
+
+
+def load_sql_tables(
+    raw_tables_base_path,
+    raw_tables_data_paths,
+    columns_to_load,
+    engine,
+    column_types=None,
+    max_workers=4,
+    mode="replace",
+    key_columns=None,
+):
+    """Load csv files as SQL tables into an Amazon Aurora PostgreSQL DB.
+
+    Note:
+        raw_tables_data_paths (List, str): a list of strings, each string
+        can be a csv file, or a folder that contains a partitioned csv file.
+        columns_to_load (List, str): the columns to load, or "all".
+        column_types (dict, optional): per table name, a dict of explicit
+            Postgres column types overriding the inferred ones.
+        mode (str): "replace" swaps in a freshly loaded table, "upsert" merges
+            the csv rows into the existing table on `key_columns`.
+        key_columns (List, str, optional): the columns identifying a row,
+            required by the "upsert" mode. In "replace" mode, a unique index
+            is built on them so that later loads can upsert.
+
+    Returns:
+        List, str: the names of the loaded tables.
+    """
+    if mode not in LOAD_MODES:
+        raise ValueError(f"mode must be one of {LOAD_MODES}, got {mode}.")
+    if mode == "upsert" and not key_columns:
+        raise ValueError("key_columns are required to upsert rows.")
+    column_types = column_types or {}
+    loaded_table_names = []
+
+    for raw_table_path in raw_tables_data_paths:
+        table_name, partitions = list_table_partitions(raw_tables_base_path, raw_table_path)
+        if not partitions:
+            print(f"No csv files found for {table_name}, skipping it")
+            continue
+
+        table_column_types = infer_column_types(partitions[0], column_types.get(table_name))
+        if columns_to_load != "all":
+            table_column_types = {column: table_column_types[column] for column in columns_to_load}
+        columns = list(table_column_types)
+        staging_table_name = table_name + STAGING_SUFFIX
+
+        db_connection = engine.raw_connection()
+        try:
+            with db_connection.cursor() as cursor:
+                table_mode = mode if table_exists(cursor, table_name) else "replace"
+                # The upsert staging table is dropped after the merge, it does not need WAL.
+                create_table(
+                    cursor, staging_table_name, table_column_types, unlogged=table_mode == "upsert"
+                )
+            db_connection.commit()
+
+            print(f"Loading {table_name} from {len(partitions)} csv file(s) with COPY")
+            start = time.perf_counter()
+            num_rows = copy_csv_partitions(engine, staging_table_name, partitions, columns, max_workers)
+            elapsed = time.perf_counter() - start
+            print(
+                f"Loaded {num_rows} rows into {staging_table_name} in {elapsed:.1f}s"
+                f" ({num_rows / max(elapsed, 1e-9):.1f} rows/sec)"
+            )
+
+            if table_mode == "upsert":
+                num_written_rows, version = upsert_table(
+                    db_connection, table_name, staging_table_name, columns, key_columns
+                )
+                print(f"Upserted {num_written_rows} new or changed rows into {table_name}")
+            else:
+                version = replace_table(db_connection, table_name, staging_table_name, key_columns)
+                print(f"Swapped in {table_name}")
+            print(f"{table_name} is now at version {version}")
+        finally:
+            db_connection.close()
+        loaded_table_names.append(table_name)
+
+    return loaded_table_names
@@ -0,0 +1,100 @@
+"""Swap freshly loaded staging tables in place of live Postgres tables.
+
+A table is reloaded into an index-free staging table, the indexes and
+constraints of the live table are rebuilt on the staging table once the data
+is loaded, and the staging table is then swapped in with a transactional
+rename. Readers keep using the previous version of the table until the swap
+commits. Used by the bulk load of the embeddings and by the SQL table loader.
+"""
+STAGING_SUFFIX = "_staging"
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _get_index_definitions(cursor, table_name):
+    # quote_ident gives the names as they are written in the index definitions.
+    cursor.execute(
+        "SELECT indexname, quote_ident(indexname), quote_ident(tablename), indexdef FROM pg_indexes"
+        " WHERE schemaname = current_schema() AND tablename = %s;",
+        (table_name,),
+    )
+    return cursor.fetchall()
+
+
+def _get_constraint_definitions(cursor, table_name):
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint"
+        " WHERE conrelid = %s::regclass AND contype IN ('p', 'f', 'u');",
+        (quote_identifier(table_name),),
+    )
+    return cursor.fetchall()
+
+
+def build_staging_indexes(cursor, table_name, staging_table_name):
+    """Recreate the indexes and constraints of the live table on the staging table.
+
+    Returns:
+        A list of (staging_name, live_name, kind) to rename after the swap.
+    """
+    constraints = _get_constraint_definitions(cursor, table_name)
+    constraint_index_names = {name for name, kind, _ in constraints if kind in ("p", "u")}
+    staging_table = quote_identifier(staging_table_name)
+    renames = []
+
+    for index_name, quoted_index_name, quoted_table_name, index_definition in _get_index_definitions(
+        cursor, table_name
+    ):
+        staging_index_name = index_name + STAGING_SUFFIX
+        definition = index_definition.replace(
+            f"INDEX {quoted_index_name} ON", f"INDEX {quote_identifier(staging_index_name)} ON", 1
+        ).replace(f".{quoted_table_name} ", f".{staging_table} ", 1)
+        print(f"Building index {staging_index_name}")
+        cursor.execute(definition)
+        if index_name not in constraint_index_names:
+            renames.append((staging_index_name, index_name, "index"))
+
+    for constraint_name, kind, definition in constraints:
+        staging_constraint = quote_identifier(constraint_name + STAGING_SUFFIX)
+        if kind in ("p", "u"):
+            constraint_type = "PRIMARY KEY" if kind == "p" else "UNIQUE"
+            cursor.execute(
+                f"ALTER TABLE {staging_table} ADD CONSTRAINT {staging_constraint}"
+                f" {constraint_type} USING INDEX {staging_constraint};"
+            )
+        else:
+            cursor.execute(
+                f"ALTER TABLE {staging_table} ADD CONSTRAINT {staging_constraint} {definition};"
+            )
+        renames.append((constraint_name + STAGING_SUFFIX, constraint_name, "constraint"))
+
+    return renames
+
+
+def _rename_staging_objects(cursor, table_name, renames):
+    """Give the indexes and constraints built on the staging table the names of the live ones."""
+    for staging_name, live_name, kind in renames:
+        if kind == "index":
+            cursor.execute(
+                f"ALTER INDEX {quote_identifier(staging_name)} RENAME TO {quote_identifier(live_name)};"
+            )
+        else:
+            cursor.execute(
+                f"ALTER TABLE {quote_identifier(table_name)} RENAME CONSTRAINT"
+                f" {quote_identifier(staging_name)} TO {quote_identifier(live_name)};"
+            )
+
+
+def swap_staging_table(cursor, table_name, staging_table_name, renames=()):
+    """Replace the live table with the staging table, or rename it if there is no live table.
+
+    Run it in a single transaction so readers see either table, the caller commits.
+    """
+    table = quote_identifier(table_name)
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+    if cursor.fetchone()[0]:
+        cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE;")
+        cursor.execute(f"DROP TABLE {table};")
+    cursor.execute(f"ALTER TABLE {quote_identifier(staging_table_name)} RENAME TO {table};")
+    _rename_staging_objects(cursor, table_name, renames)
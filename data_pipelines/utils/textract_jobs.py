@@ -0,0 +1,167 @@
+"""Fan-out of the Textract document analysis jobs of many documents.
+
+`Textractor.start_document_analysis` only starts an asynchronous Textract
+job, the returned document blocks on the job when it is first read. Instead
+of processing the documents one after the other, `TextractJobOrchestrator`
+starts the jobs of all the documents up front, up to a number of concurrent
+jobs matching the Textract quota, polls their status with an exponential
+backoff, and post-processes each document in a thread pool as soon as its
+job succeeds. The extraction time approaches that of the slowest document
+instead of the sum over all documents.
+
+The orchestrator only uses `start_document_analysis` and the
+`textract_client.get_document_analysis` status call of the extractor, so it
+can be tested with a local fake Textractor exposing both.
+"""
+import heapq
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+TEXTRACT_THROTTLING_ERROR_CODES = (
+    "ThrottlingException",
+    "LimitExceededException",
+    "ProvisionedThroughputExceededException",
+)
+
+
+def _is_textract_throttling_error(error):
+    return error.response.get("Error", {}).get("Code") in TEXTRACT_THROTTLING_ERROR_CODES
+
+
+class TextractJobOrchestrator:
+    """Run the Textract jobs of many documents concurrently and post-process them as they complete.
+
+    Args:
+        extractor: a `textractor.Textractor`, or a fake with the same
+            `start_document_analysis` method and `textract_client` attribute.
+        start_kwargs (dict): the arguments of `start_document_analysis`
+            other than `file_source`, e.g. the features and S3 paths.
+        post_process: called with (document, item) when the job of an item
+            succeeds, its return value is the result of the item.
+        max_concurrent_jobs (int): maximum number of Textract jobs in progress.
+        post_process_workers (int): number of documents post-processed at a time.
+        poll_interval (float): initial seconds between two status checks of a job.
+        max_poll_interval (float): the poll interval grows by `poll_backoff`
+            up to this number of seconds.
+    """
+
+    def __init__(
+        self,
+        extractor,
+        start_kwargs,
+        post_process,
+        max_concurrent_jobs=10,
+        post_process_workers=4,
+        poll_interval=2.0,
+        max_poll_interval=30.0,
+        poll_backoff=1.5,
+        max_retries=8,
+    ):
+        self.extractor = extractor
+        self.start_kwargs = start_kwargs
+        self.post_process = post_process
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.post_process_workers = post_process_workers
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_backoff = poll_backoff
+        self.max_retries = max_retries
+
+    def _call_with_backoff(self, function, **kwargs):
+        for attempt in range(self.max_retries):
+            try:
+                return function(**kwargs)
+            except ClientError as error:
+                if not _is_textract_throttling_error(error) or attempt == self.max_retries - 1:
+                    raise
+                # Full jitter exponential backoff.
+                time.sleep(random.uniform(0, min(30.0, self.poll_interval * 2**attempt)))
+
+    def _start_job(self, file_source):
+        return self._call_with_backoff(
+            self.extractor.start_document_analysis, file_source=file_source, **self.start_kwargs
+        )
+
+    def _get_job_status(self, job_id):
+        response = self._call_with_backoff(
+            self.extractor.textract_client.get_document_analysis, JobId=job_id, MaxResults=1
+        )
+        return response["JobStatus"], response.get("StatusMessage")
+
+    def run(self, items, get_file_source):
+        """Extract and post-process every item.
+
+        Args:
+            items (list): e.g. the metadata of each document.
+            get_file_source: returns the local path or S3 uri of the pdf of an item.
+
+        Returns:
+            list: the post-processing result of each item, in the order of items.
+                Raises the first error once every other item is processed.
+        """
+        start = time.perf_counter()
+        pending = list(enumerate(items))
+        pending.reverse()
+        # Heap of (next poll time, index, document, poll interval) of the jobs in progress.
+        in_progress = []
+        results = [None] * len(items)
+        errors = {}
+
+        with ThreadPoolExecutor(max_workers=self.post_process_workers) as executor:
+            post_processing = {}
+            while pending or in_progress:
+                while pending and len(in_progress) < self.max_concurrent_jobs:
+                    index, item = pending.pop()
+                    try:
+                        document = self._start_job(get_file_source(item))
+                    except Exception as error:
+                        errors[index] = error
+                        continue
+                    print(f"Started Textract job {document.job_id} for {get_file_source(item)}")
+                    heapq.heappush(
+                        in_progress, (time.monotonic() + self.poll_interval, index, document, self.poll_interval)
+                    )
+
+                if not in_progress:
+                    continue
+                next_poll, index, document, interval = heapq.heappop(in_progress)
+                time.sleep(max(0.0, next_poll - time.monotonic()))
+
+                try:
+                    status, status_message = self._get_job_status(document.job_id)
+                except Exception as error:
+                    errors[index] = error
+                    continue
+                if status == "IN_PROGRESS":
+                    interval = min(self.max_poll_interval, interval * self.poll_backoff)
+                    heapq.heappush(in_progress, (time.monotonic() + interval, index, document, interval))
+                elif status in ("SUCCEEDED", "PARTIAL_SUCCESS"):
+                    print(
+                        f"Textract job {document.job_id} {status.lower()} after"
+                        f" {time.perf_counter() - start:.1f}s, post-processing"
+                    )
+                    post_processing[index] = executor.submit(self.post_process, document, items[index])
+                else:
+                    errors[index] = RuntimeError(
+                        f"Textract job {document.job_id} of {get_file_source(items[index])}"
+                        f" ended with status {status}: {status_message}"
+                    )
+
+            for index, future in post_processing.items():
+                try:
+                    results[index] = future.result()
+                except Exception as error:
+                    errors[index] = error
+
+        print(
+            f"Extracted {len(items) - len(errors)} of {len(items)} documents"
+            f" in {time.perf_counter() - start:.1f}s"
+        )
+        if errors:
+            for index, error in sorted(errors.items()):
+                print(f"Failed to extract {get_file_source(items[index])}: {error}")
+            raise errors[min(errors)]
+        return results
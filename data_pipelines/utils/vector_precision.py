@@ -0,0 +1,197 @@
+"""Reduced-precision indexing and search for the pgvector embeddings table.
+
+PGVector stores every chunk embedding as a full precision `vector` in the
+`langchain_pg_embedding` table. The approximate nearest neighbour index is
+what has to stay in the Aurora buffer cache to keep search fast, so instead of
+indexing the full precision vectors we build a partial HNSW expression index
+per collection over a reduced precision cast of the embedding:
+
+- "half": `halfvec`, 2 bytes per dimension instead of 4.
+- "binary": `binary_quantize(...)::bit`, 1 bit per dimension, compared with
+  the hamming distance. This is pgvector's native quantised type and should
+  be used together with the full precision rescoring step.
+
+The full precision vectors stay in the table, which makes it possible to
+rescore the reduced precision candidates with the exact cosine distance.
+
+Note: `halfvec` and `binary_quantize` require pgvector >= 0.7.0.
+"""
+
+EMBEDDING_PRECISIONS = {
+    # precision: (SQL expression over the embedding column, operator class, distance operator)
+    "full": ("{column}::vector({dimensions})", "vector_cosine_ops", "<=>"),
+    "half": ("{column}::halfvec({dimensions})", "halfvec_cosine_ops", "<=>"),
+    "binary": ("binary_quantize({column})::bit({dimensions})", "bit_hamming_ops", "<~>"),
+}
+
+# Amazon Titan Text Embeddings V2 can return smaller embeddings,
+# V1 always returns 1536 dimensions.
+EMBEDDING_MODEL_DIMENSIONS = {
+    "amazon.titan-embed-text-v1": (1536,),
+    "amazon.titan-embed-text-v2:0": (1024, 512, 256),
+}
+
+
+def get_embedding_model_kwargs(embedding_model_id, dimensions=None):
+    """Return the Bedrock model kwargs to request embeddings of the given size."""
+    supported_dimensions = EMBEDDING_MODEL_DIMENSIONS.get(embedding_model_id)
+
+    if dimensions is None:
+        return {}
+
+    if supported_dimensions is None or dimensions not in supported_dimensions:
+        raise ValueError(
+            f"The embedding model {embedding_model_id} does not support"
+            f" {dimensions} dimensions. Supported dimensions: {supported_dimensions}"
+        )
+
+    if len(supported_dimensions) == 1:
+        # The model has a fixed dimensionality, nothing to configure.
+        return {}
+
+    return {"dimensions": dimensions, "normalize": True}
+
+
+def _check_precision(precision):
+    if precision not in EMBEDDING_PRECISIONS:
+        raise ValueError(
+            f"Unsupported precision {precision}."
+            f" Please use one of {list(EMBEDDING_PRECISIONS)}"
+        )
+
+
+def _precision_expression(precision, dimensions, column="embedding"):
+    expression, _, distance_operator = EMBEDDING_PRECISIONS[precision]
+    return expression.format(column=column, dimensions=dimensions), distance_operator
+
+
+def to_vector_literal(embedding):
+    """Format an embedding as a pgvector text literal."""
+    return "[" + ",".join(str(float(value)) for value in embedding) + "]"
+
+
+def get_collection_id(db_connection, collection_name):
+    with db_connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT uuid FROM langchain_pg_collection WHERE name = %s;",
+            (collection_name,),
+        )
+        row = cursor.fetchone()
+
+    if row is None:
+        raise ValueError(f"The collection {collection_name} does not exist.")
+
+    return str(row[0])
+
+
+def get_collection_dimensions(db_connection, collection_id):
+    with db_connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT vector_dims(embedding) FROM langchain_pg_embedding"
+            " WHERE collection_id = %s LIMIT 1;",
+            (collection_id,),
+        )
+        row = cursor.fetchone()
+
+    if row is None:
+        raise ValueError(f"The collection {collection_id} has no embeddings.")
+
+    return row[0]
+
+
+def get_index_name(collection_id, precision):
+    return f"langchain_pg_embedding_{precision}_{collection_id.replace('-', '')[:12]}_idx"
+
+
+def create_reduced_precision_index(db_connection, collection_name, precision, dimensions=None):
+    """Build a partial HNSW index over the collection embeddings at the given precision.
+
+    Returns:
+        str: the name of the created index.
+    """
+    _check_precision(precision)
+    collection_id = get_collection_id(db_connection, collection_name)
+    if dimensions is None:
+        dimensions = get_collection_dimensions(db_connection, collection_id)
+
+    expression, _ = _precision_expression(precision, dimensions)
+    operator_class = EMBEDDING_PRECISIONS[precision][1]
+    index_name = get_index_name(collection_id, precision)
+
+    with db_connection.cursor() as cursor:
+        cursor.execute(f"DROP INDEX IF EXISTS {index_name};")
+        cursor.execute(
+            f"CREATE INDEX {index_name} ON langchain_pg_embedding"
+            f" USING hnsw (({expression}) {operator_class})"
+            f" WHERE collection_id = '{collection_id}';"
+        )
+    db_connection.commit()
+
+    print(f"Created {precision} precision index {index_name} with {dimensions} dimensions")
+    return index_name
+
+
+def get_index_size(db_connection, index_name):
+    """Return the size of an index in bytes."""
+    with db_connection.cursor() as cursor:
+        cursor.execute("SELECT pg_relation_size(%s::regclass);", (index_name,))
+        return cursor.fetchone()[0]
+
+
+def similarity_search(
+    db_connection,
+    collection_name,
+    query_embedding,
+    k=5,
+    precision="half",
+    rescore_factor=None,
+):
+    """Search the collection using the reduced precision index.
+
+    Args:
+        rescore_factor (int, optional): when set, fetch `k * rescore_factor`
+            candidates with the reduced precision index and re-rank them
+            with the full precision cosine distance.
+
+    Returns:
+        List of (document, metadata, distance) tuples ordered by distance.
+    """
+    _check_precision(precision)
+    collection_id = get_collection_id(db_connection, collection_name)
+    dimensions = len(query_embedding)
+    expression, distance_operator = _precision_expression(precision, dimensions)
+    query_expression, _ = _precision_expression(precision, dimensions, column="%(query)s::vector")
+
+    parameters = {
+        "collection_id": collection_id,
+        "query": to_vector_literal(query_embedding),
+        "k": k,
+    }
+
+    if rescore_factor:
+        parameters["num_candidates"] = k * rescore_factor
+        sql_query = f"""
+            WITH candidates AS (
+                SELECT document, cmetadata, embedding
+                FROM langchain_pg_embedding
+                WHERE collection_id = %(collection_id)s
+                ORDER BY {expression} {distance_operator} {query_expression}
+                LIMIT %(num_candidates)s
+            )
+            SELECT document, cmetadata, embedding <=> %(query)s::vector AS distance
+            FROM candidates
+            ORDER BY distance
+            LIMIT %(k)s;
+        """
+    else:
+        sql_query = f"""
+            SELECT document, cmetadata, {expression} {distance_operator} {query_expression} AS distance
+            FROM langchain_pg_embedding
+            WHERE collection_id = %(collection_id)s
+            ORDER BY distance
+            LIMIT %(k)s;
+        """
+
+    with db_connection.cursor() as cursor:
+        cursor.execute(sql_query, parameters)
+        return cursor.fetchall()
@@ -1,46 +1,363 @@
-import json
-import boto3
+"""Call the assistant Lambda function, once or as a load test.
+
+Without arguments, the script asks one question and prints the answer:
+
+    python3 invoke_assistant_lambda.py
+
+With a question corpus, the questions are replayed across many sessions,
+either by a fixed number of concurrent callers (`--concurrency`) or at a
+Poisson arrival rate (`--arrival-rate`, requests per second), against the
+deployed function or a local Lambda Runtime Interface Emulator
+(`--endpoint-url http://localhost:9000`). The latency percentiles, error rate
+and throughput of each `chatbot_type` are printed and can be saved as JSON
+with `--output`, to compare runs:
 
-# Initialize Boto3 clients for Lambda and SSM
-lambda_client = boto3.client("lambda")
-ssm_client = boto3.client("ssm")
+    python3 invoke_assistant_lambda.py --questions questions.jsonl \
+        --chatbot-types basic agentic --num-requests 200 --concurrency 8 \
+        --output results.json
 
+The questions file is a JSON list, or JSONL, of questions or of
+`{"user_input": ..., "chatbot_type": ...}` objects, or a text file with one
+question per line.
+
+With `--agent-modes react tool_calling`, each agentic question is asked to
+both agents of lab 3, and the mean iterations, tool calls and parsing errors
+per answer are summarized next to the latencies of each agent mode.
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
 
 lambda_function_name_ssm_parameter = (
     "/AgenticLLMAssistantWorkshop/AgentExecutorLambdaNameParameter"
 )
+# The function name of the Lambda Runtime Interface Emulator.
+LOCAL_FUNCTION_NAME = "function"
+# The handler answers with this message when the chain raised an exception.
+INTERNAL_ERROR_RESPONSE = "Unable to respond due to an internal issue."
+DEFAULT_QUESTION = "Could you explain the transformer model?"
+PERCENTILES = (50, 90, 95, 99)
+# Counts the agentic mode returns with each answer.
+AGENT_COUNT_KEYS = ("agent_iterations", "agent_tool_calls", "agent_parsing_errors")
 
-lambda_function_name = ssm_client.get_parameter(Name=lambda_function_name_ssm_parameter)
-lambda_function_name = lambda_function_name["Parameter"]["Value"]
 
+def get_lambda_function_name():
+    ssm_client = boto3.client("ssm")
+    lambda_function_name = ssm_client.get_parameter(Name=lambda_function_name_ssm_parameter)
+    return lambda_function_name["Parameter"]["Value"]
 
-def call_agent_lambda(user_input, session_id):
+
+def create_lambda_client(endpoint_url=None, max_pool_connections=10, read_timeout=900):
+    # No retries, so that the measured latencies and errors are those of single invocations.
+    config = Config(
+        read_timeout=read_timeout,
+        max_pool_connections=max_pool_connections,
+        retries={"total_max_attempts": 1},
+    )
+    return boto3.client("lambda", endpoint_url=endpoint_url, config=config)
+
+
+def call_agent_lambda(
+    lambda_client,
+    lambda_function_name,
+    user_input,
+    session_id,
+    chatbot_type="basic",
+    clean_history=True,
+    model_tier=None,
+    agent_mode=None,
+):
     payload = {
         "user_input": user_input,
         "session_id": session_id,
-        "clean_history": True
+        "chatbot_type": chatbot_type,
+        "clean_history": clean_history,
     }
+    if model_tier:
+        # Bypass the model router of the assistant.
+        payload["model_tier"] = model_tier
+    if agent_mode:
+        payload["agent_mode"] = agent_mode
+
+    # Call the Lambda function
+    lambda_response = lambda_client.invoke(
+        FunctionName=lambda_function_name,
+        InvocationType="RequestResponse",  # Use 'Event' for asynchronous invocation
+        Payload=json.dumps(payload),
+    )
+
+    # Parse the Lambda function response
+    lambda_result = lambda_response["Payload"].read().decode("utf-8")
+    lambda_result = json.loads(lambda_result)
+    if "FunctionError" in lambda_response:
+        raise RuntimeError(f"The function failed: {lambda_result}")
+
+    return lambda_result
+
+
+def load_questions(file_path):
+    """Return the questions of a file as a list of (user_input, chatbot_type or None)."""
+    with open(file_path, "r") as questions_file:
+        content = questions_file.read()
+
+    if file_path.endswith(".json"):
+        entries = json.loads(content)
+    elif file_path.endswith(".jsonl"):
+        entries = [json.loads(line) for line in content.splitlines() if line.strip()]
+    else:
+        entries = [line.strip() for line in content.splitlines() if line.strip()]
 
-    try:
-        # Call the Lambda function
-        lambda_response = lambda_client.invoke(
-            FunctionName=lambda_function_name,
-            InvocationType="RequestResponse",  # Use 'Event' for asynchronous invocation
-            Payload=json.dumps(payload),
+    questions = []
+    for entry in entries:
+        if isinstance(entry, str):
+            questions.append((entry, None))
+        else:
+            questions.append((entry["user_input"], entry.get("chatbot_type")))
+    return questions
+
+
+def build_requests(
+    questions, chatbot_types, num_requests, num_sessions, session_prefix, agent_modes=(None,)
+):
+    """Cycle over the questions, chatbot types and agent modes, spreading the requests over the sessions."""
+    combinations = [
+        (user_input, chatbot_type, agent_mode if chatbot_type == "agentic" else None)
+        for user_input, question_chatbot_type in questions
+        for chatbot_type in (chatbot_types if question_chatbot_type is None else [question_chatbot_type])
+        for agent_mode in (agent_modes if chatbot_type == "agentic" else [None])
+    ]
+    if num_requests is None:
+        num_requests = len(combinations)
+    # By default each request has its own session, so concurrent requests don't share a chat history.
+    num_sessions = num_sessions or num_requests
+    return [
+        {
+            "index": index,
+            "user_input": user_input,
+            "chatbot_type": chatbot_type,
+            "agent_mode": agent_mode,
+            "session_id": f"{session_prefix}-{index % num_sessions}",
+        }
+        for index, (user_input, chatbot_type, agent_mode) in zip(
+            range(num_requests), itertools.cycle(combinations)
         )
+    ]
+
+
+def _percentile(values, percentile):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))]
+
+
+class LoadTest:
+    """Send requests to the assistant and record the latency and outcome of each one."""
+
+    def __init__(self, lambda_client, lambda_function_name, clean_history=True, model_tier=None):
+        self.lambda_client = lambda_client
+        self.lambda_function_name = lambda_function_name
+        self.clean_history = clean_history
+        self.model_tier = model_tier
+        self.results = []
+        self._lock = threading.Lock()
+
+    def send(self, request, scheduled_time=None):
+        # In open loop, the latency counts from the scheduled send time, so
+        # that requests delayed by a saturated client are not under-reported.
+        start = scheduled_time or time.perf_counter()
+        error = None
+        try:
+            lambda_result = call_agent_lambda(
+                self.lambda_client,
+                self.lambda_function_name,
+                request["user_input"],
+                request["session_id"],
+                request["chatbot_type"],
+                self.clean_history,
+                self.model_tier,
+                request["agent_mode"],
+            )
+            response = lambda_result.get("response", "")
+            if response.startswith(INTERNAL_ERROR_RESPONSE):
+                error = "internal error response"
+        except Exception as e:
+            lambda_result = {}
+            response = None
+            error = str(e)
+        result = {
+            **request,
+            "latency_seconds": round(time.perf_counter() - start, 3),
+            "error": error,
+            "response_chars": len(response) if response else 0,
+            # Returned by the agentic mode, missing for coalesced answers.
+            **{key: lambda_result[key] for key in AGENT_COUNT_KEYS if key in lambda_result},
+        }
+        with self._lock:
+            self.results.append(result)
+        return result
+
+    def run_closed_loop(self, requests, concurrency):
+        """Keep `concurrency` requests in flight until all requests are sent."""
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for _ in executor.map(self.send, requests):
+                pass
 
-        # Parse the Lambda function response
-        lambda_result = lambda_response["Payload"].read().decode("utf-8")
-        lambda_result = json.loads(lambda_result)
+    def run_open_loop(self, requests, arrival_rate, max_in_flight=256):
+        """Send requests at Poisson arrivals of `arrival_rate` requests per second."""
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            next_send_time = time.perf_counter()
+            for request in requests:
+                time.sleep(max(0.0, next_send_time - time.perf_counter()))
+                executor.submit(self.send, request, next_send_time)
+                next_send_time += random.expovariate(arrival_rate)
 
-        return lambda_result
-    except Exception as e:
-        print(e)
 
+def _group_name(result):
+    if result.get("agent_mode"):
+        return f"{result['chatbot_type']}/{result['agent_mode']}"
+    return result["chatbot_type"]
 
-session_id = "10"
-user_input = "Could you explain the transformer model?"
 
-results = call_agent_lambda(user_input, session_id)
+def summarize(results, elapsed_seconds):
+    """Latency percentiles, error rate and throughput, overall and per chatbot_type and agent mode."""
+    groups = {"all": results}
+    for result in results:
+        groups.setdefault(_group_name(result), []).append(result)
+
+    summary = {}
+    for name, group in groups.items():
+        latencies = [result["latency_seconds"] for result in group if result["error"] is None]
+        num_errors = sum(result["error"] is not None for result in group)
+        summary[name] = {
+            "requests": len(group),
+            "errors": num_errors,
+            "error_rate": round(num_errors / len(group), 4),
+            "throughput_rps": round(len(latencies) / elapsed_seconds, 3),
+            **{f"latency_p{p}_seconds": _percentile(latencies, p) for p in PERCENTILES},
+            "latency_max_seconds": max(latencies, default=None),
+        }
+        for key in AGENT_COUNT_KEYS:
+            counts = [result[key] for result in group if key in result]
+            if counts:
+                summary[name][f"{key}_mean"] = round(sum(counts) / len(counts), 3)
+    return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--questions", default=None,
+        help="JSON, JSONL or text file of questions, the default question is asked when not set."
+    )
+    parser.add_argument("--chatbot-types", nargs="+", default=["basic"])
+    parser.add_argument(
+        "--num-requests", type=int, default=None,
+        help="Number of requests, one per question and chatbot type by default."
+    )
+    parser.add_argument(
+        "--num-sessions", type=int, default=None,
+        help="Number of sessions the requests are spread over, one per request by default."
+    )
+    parser.add_argument("--session-prefix", default="load-test")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--concurrency", type=int, default=1, help="Number of requests in flight.")
+    load.add_argument(
+        "--arrival-rate", type=float, default=None,
+        help="Send requests at this Poisson rate, in requests per second, whatever the latency."
+    )
+    parser.add_argument(
+        "--endpoint-url", default=None,
+        help="e.g. http://localhost:9000 to call a local Lambda Runtime Interface Emulator."
+    )
+    parser.add_argument(
+        "--function-name", default=None,
+        help="Read from SSM by default, or the emulator function name with --endpoint-url."
+    )
+    parser.add_argument(
+        "--keep-history", action="store_true",
+        help="Do not clear the chat history of the session before each question."
+    )
+    parser.add_argument(
+        "--model-tier", choices=["fast", "strong"], default=None,
+        help="Send every request to this model tier instead of letting the assistant route it."
+    )
+    parser.add_argument(
+        "--agent-modes", nargs="+", choices=["react", "tool_calling"], default=[None],
+        help="Ask each agentic question to each of these agents, the configured agent by default."
+    )
+    parser.add_argument("--output", default=None, help="Save the summary and every request to this JSON file.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.function_name:
+        lambda_function_name = args.function_name
+    elif args.endpoint_url:
+        lambda_function_name = LOCAL_FUNCTION_NAME
+    else:
+        lambda_function_name = get_lambda_function_name()
+
+    questions = load_questions(args.questions) if args.questions else [(DEFAULT_QUESTION, None)]
+    requests = build_requests(
+        questions,
+        args.chatbot_types,
+        args.num_requests,
+        args.num_sessions,
+        args.session_prefix,
+        args.agent_modes,
+    )
+    max_in_flight = args.concurrency if args.arrival_rate is None else 256
+    load_test = LoadTest(
+        create_lambda_client(args.endpoint_url, max_pool_connections=max(10, max_in_flight)),
+        lambda_function_name,
+        clean_history=not args.keep_history,
+        model_tier=args.model_tier,
+    )
+
+    # Without a questions file, a single request just prints the answer of the default question.
+    if not args.questions and not args.output and len(requests) == 1:
+        request = requests[0]
+        results = call_agent_lambda(
+            load_test.lambda_client,
+            lambda_function_name,
+            request["user_input"],
+            request["session_id"],
+            request["chatbot_type"],
+            load_test.clean_history,
+            load_test.model_tier,
+            request["agent_mode"],
+        )
+        print(results["response"].strip())
+        raise SystemExit
+
+    start = time.perf_counter()
+    if args.arrival_rate is None:
+        load_test.run_closed_loop(requests, args.concurrency)
+    else:
+        load_test.run_open_loop(requests, args.arrival_rate, max_in_flight)
+    elapsed_seconds = time.perf_counter() - start
 
-print(results["response"].strip())
+    results = sorted(load_test.results, key=lambda result: result["index"])
+    summary = summarize(results, elapsed_seconds)
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(
+                {
+                    "arguments": vars(args),
+                    "elapsed_seconds": round(elapsed_seconds, 3),
+                    "summary": summary,
+                    "requests": results,
+                },
+                output_file,
+                indent=2,
+            )
@@ -12,7 +12,9 @@ export class SageMakerProcessor extends Construct {
 
    const processor_image = new DockerImageAsset(this, "processor_image", {
     assetName: "processor",
-    directory: "../data_pipelines/docker",
+    // Build from the data_pipelines folder so the image ships the shared utils package.
+    directory: "../data_pipelines",
+    file: "docker/Dockerfile",
     networkMode: NetworkMode.custom("sagemaker")
    })
 
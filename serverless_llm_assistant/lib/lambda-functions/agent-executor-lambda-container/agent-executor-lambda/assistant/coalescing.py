@@ -0,0 +1,295 @@
+"""Single-flight coalescing of identical in-flight requests.
+
+When many users ask the same question at the same time, e.g. right after an
+earnings release, only one computation of each stage (LLM answer, SQL QA...)
+runs and every concurrent caller receives its result.
+
+Requests are keyed by their stage and normalised content, so that the same
+question with a different case, spacing or trailing punctuation is coalesced.
+
+Within a container, `SingleFlight` coalesces callers across threads and
+asyncio tasks. Across containers, `DynamoDBSingleFlight` additionally takes
+a short-lived lock item in a DynamoDB table: the container holding the lock
+computes the result and writes it to the item, the other containers poll the
+item and reuse the result. Items expire after a few seconds, the table should
+have its time to live enabled on the `ExpiresAt` attribute. Results shared
+across containers must be JSON serializable.
+
+Cross-container coalescing costs at least two DynamoDB writes, the lock and
+the result, per computed request, plus the polling reads of the waiting
+containers. It is only used when the `COALESCING_TABLE` environment variable
+is set, the stack only sets it when deployed with
+`-c enable_cross_container_coalescing=true`.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+import boto3
+from botocore.exceptions import ClientError
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# DynamoDB items are limited to 400 KB, larger results are not shared across containers.
+MAX_SHARED_RESULT_BYTES = 350 * 1024
+
+
+def normalize_text(text):
+    """Lowercase, collapse whitespace and strip the trailing punctuation of a request."""
+    return WHITESPACE_PATTERN.sub(" ", str(text)).strip().lower().rstrip("?!. ")
+
+
+def coalescing_key(stage, *parts):
+    """Key of a request for a stage, from its normalised parts."""
+    normalized_parts = [normalize_text(part) if isinstance(part, str) else part for part in parts]
+    return hashlib.sha256(
+        json.dumps([stage, normalized_parts], sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class SingleFlight:
+    """Run a function once per key at a time, concurrent callers of the same key share its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.num_computed = 0
+        self.num_coalesced = 0
+
+    def _join_or_lead(self, key):
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.num_coalesced += 1
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            self.num_computed += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            del self._in_flight[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, function):
+        """Return function(), or the result of the call of another thread with the same key."""
+        future, leader = self._join_or_lead(key)
+        if not leader:
+            return future.result()
+        result, error = None, None
+        try:
+            result = self._compute(key, function)
+            return result
+        except BaseException as caught:
+            error = caught
+            raise
+        finally:
+            # Also on a BaseException, e.g. a cancellation, so the key never stays in flight.
+            self._finish(key, future, result, error)
+
+    async def do_async(self, key, coroutine_function):
+        """Async counterpart of `do`, shared with the threads calling `do` with the same key.
+
+        The coroutine runs in the calling event loop, it is only coalesced within the container.
+        """
+        future, leader = self._join_or_lead(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        result, error = None, None
+        try:
+            result = await coroutine_function()
+            return result
+        except BaseException as caught:
+            error = caught
+            raise
+        finally:
+            self._finish(key, future, result, error)
+
+    def _compute(self, key, function):
+        return function()
+
+    def report(self):
+        return f"Request coalescing: {self.num_computed} computed, {self.num_coalesced} coalesced"
+
+
+class DynamoDBSingleFlight(SingleFlight):
+    """Coalesce requests within the container, and across containers with a DynamoDB lock item.
+
+    Args:
+        table_name (str): table with a string partition key `partition_key`.
+        lock_ttl_seconds (float): a lock not released after this time, e.g.
+            by a container that timed out, is taken over by the next caller.
+        result_ttl_seconds (float): how long a result is served to callers
+            arriving after the computation ended.
+        max_wait_seconds (float): waiters compute the result themselves after this time.
+    """
+
+    def __init__(
+        self,
+        table_name,
+        partition_key="Key",
+        lock_ttl_seconds=60.0,
+        result_ttl_seconds=10.0,
+        poll_interval_seconds=0.25,
+        max_wait_seconds=120.0,
+        dynamodb_client=None,
+    ):
+        super().__init__()
+        self.table_name = table_name
+        self.partition_key = partition_key
+        self.lock_ttl_seconds = lock_ttl_seconds
+        self.result_ttl_seconds = result_ttl_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.dynamodb_client = dynamodb_client or boto3.client("dynamodb")
+        self.owner = str(uuid.uuid4())
+        self.num_shared = 0
+
+    def _item_key(self, key):
+        return {self.partition_key: {"S": f"coalescing#{key}"}}
+
+    def _try_lock(self, key):
+        now = time.time()
+        try:
+            self.dynamodb_client.put_item(
+                TableName=self.table_name,
+                Item={
+                    **self._item_key(key),
+                    "Status": {"S": "PENDING"},
+                    "Owner": {"S": self.owner},
+                    "ExpiresAt": {"N": str(int(now + self.lock_ttl_seconds))},
+                },
+                ConditionExpression="attribute_not_exists(#key) OR ExpiresAt < :now",
+                ExpressionAttributeNames={"#key": self.partition_key},
+                ExpressionAttributeValues={":now": {"N": str(int(now))}},
+            )
+            return True
+        except ClientError as error:
+            if error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+
+    def _get_item(self, key):
+        item = self.dynamodb_client.get_item(
+            TableName=self.table_name, Key=self._item_key(key), ConsistentRead=True
+        ).get("Item")
+        # Expired items are only deleted eventually by the DynamoDB time to live.
+        if item is None or int(item["ExpiresAt"]["N"]) < time.time():
+            return None
+        return item
+
+    def _release(self, key, result):
+        try:
+            serialized_result = json.dumps(result)
+        except TypeError:
+            serialized_result = None
+        if serialized_result is None or len(serialized_result.encode("utf-8")) > MAX_SHARED_RESULT_BYTES:
+            self._delete_lock(key)
+            return
+        self.dynamodb_client.put_item(
+            TableName=self.table_name,
+            Item={
+                **self._item_key(key),
+                "Status": {"S": "DONE"},
+                "Owner": {"S": self.owner},
+                "Result": {"S": serialized_result},
+                "ExpiresAt": {"N": str(int(time.time() + self.result_ttl_seconds))},
+            },
+        )
+
+    def _delete_lock(self, key):
+        # Only delete our own lock, another container may have taken over an expired one.
+        try:
+            self.dynamodb_client.delete_item(
+                TableName=self.table_name,
+                Key=self._item_key(key),
+                ConditionExpression="#owner = :owner",
+                ExpressionAttributeNames={"#owner": "Owner"},
+                ExpressionAttributeValues={":owner": {"S": self.owner}},
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+    def _call_dynamodb(self, method, *args):
+        """Call a DynamoDB helper, DynamoDB is an optimisation and never fails the request."""
+        try:
+            return method(*args), None
+        except ClientError as error:
+            print(f"Warning: cross-container coalescing failed: {error}")
+            return None, error
+
+    def _compute(self, key, function):
+        deadline = time.monotonic() + self.max_wait_seconds
+        while time.monotonic() < deadline:
+            locked, error = self._call_dynamodb(self._try_lock, key)
+            if error is not None:
+                break
+            if locked:
+                try:
+                    result = function()
+                except BaseException:
+                    self._call_dynamodb(self._delete_lock, key)
+                    raise
+                self._call_dynamodb(self._release, key, result)
+                return result
+
+            item, error = self._call_dynamodb(self._get_item, key)
+            if error is not None:
+                break
+            if item is not None and item["Status"]["S"] == "DONE":
+                with self._lock:
+                    self.num_shared += 1
+                return json.loads(item["Result"]["S"])
+            # Pending in another container, or the lock was just released after a failure.
+            time.sleep(self.poll_interval_seconds)
+        return function()
+
+    def report(self):
+        return f"{super().report()}, {self.num_shared} shared by other containers"
+
+
+def create_request_coalescer(table_name=None):
+    """Coalesce across containers when a coalescing table is configured, else within the container."""
+    if table_name:
+        return DynamoDBSingleFlight(table_name)
+    return SingleFlight()
+
+
+def invoke_conversation_chain(chain, user_input, stage, *key_parts, coalescer=None):
+    """Invoke a conversation chain or agent executor, sharing the answer of identical concurrent requests.
+
+    Requests are only coalesced when their chat history is identical too,
+    e.g. new sessions. A caller served the answer of another request still
+    records the exchange in the history of its own session.
+
+    Returns:
+        dict: the input and the output of the chain, like `chain.invoke`.
+    """
+    coalescer = coalescer or request_coalescer
+    memory = chain.memory
+    output_key = chain.output_keys[0]
+    history = memory.load_memory_variables({})[memory.memory_key]
+    computed = []
+
+    def invoke():
+        computed.append(True)
+        return chain.invoke({"input": user_input})[output_key]
+
+    output = coalescer.do(coalescing_key(stage, user_input, history, *key_parts), invoke)
+    if not computed:
+        memory.save_context({"input": user_input}, {output_key: output})
+    return {"input": user_input, output_key: output}
+
+
+# Shared by all the stages of the container, across containers when COALESCING_TABLE is set.
+request_coalescer = create_request_coalescer(os.environ.get("COALESCING_TABLE"))
@@ -1,6 +1,7 @@
 import json
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional
 
 import boto3
 from langchain_community.vectorstores import PGVector
@@ -12,6 +13,24 @@ secretsmanager_client = boto3.client("secretsmanager")
 
 # TODO: put in parameter store and read with a default factory in the dataclass
 SQL_TABLE_NAMES = ["extracted_entities"]
+# Materialised views aggregating the entities per company and year,
+# refreshed by the data pipeline each time the entities are loaded.
+SQL_AGGREGATE_VIEW_NAMES = ["extracted_entities_by_company_year", "extracted_entities_by_company"]
+# Table catalog maintained by the data pipeline, see assistant/sql_table_catalog.py
+SQL_TABLE_CATALOG_NAME = "sql_table_catalog"
+
+
+def get_catalog_table_names(engine):
+    """Return the names of the tables in the SQL table catalog, if it exists."""
+    try:
+        with engine.connect() as connection:
+            rows = connection.execute(
+                sqlalchemy.text(f"SELECT table_name FROM {SQL_TABLE_CATALOG_NAME};")
+            )
+            return [row[0] for row in rows]
+    except sqlalchemy.exc.SQLAlchemyError:
+        return []
+
 
 @dataclass
 class AgenticAssistantConfig:
@@ -24,6 +43,24 @@ class AgenticAssistantConfig:
     ]["Value"]
 
     chat_message_history_table_name: str = os.environ["CHAT_MESSAGE_HISTORY_TABLE"]
+    # Model of the requests the model router classifies as simple.
+    fast_llm_model_id: str = os.environ.get(
+        "FAST_LLM_MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0"
+    )
+    # Messages API model of the requests classified as complex, also used by
+    # the tool calling agent. llm_model_id is a text completion model, it is
+    # only used by the ReAct agent.
+    strong_llm_model_id: str = os.environ.get(
+        "STRONG_LLM_MODEL_ID", "anthropic.claude-3-sonnet-20240229-v1:0"
+    )
+    # Complexity score from which requests are escalated to strong_llm_model_id.
+    model_routing_threshold: int = int(os.environ.get("MODEL_ROUTING_THRESHOLD", "3"))
+    # Agent of the agentic mode, "tool_calling" (Messages API tool use) or "react".
+    agent_mode: str = os.environ.get("AGENT_MODE", "tool_calling")
+    # Token budget of the retrieved passages in the RAG prompt, see assistant/context_compression.py
+    rag_context_max_tokens: int = int(os.environ.get("RAG_CONTEXT_MAX_TOKENS", "1500"))
+    # Keep only the sentences of the retrieved passages sharing words with the question.
+    rag_extractive_compression: bool = os.environ.get("RAG_EXTRACTIVE_COMPRESSION", "false").lower() == "true"
     agent_db_secret_id: str = os.environ.get("AGENT_DB_SECRET_ID", "NOSECRET")
 
     if agent_db_secret_id != "NOSECRET":
@@ -42,7 +79,27 @@ class AgenticAssistantConfig:
         )
 
         collection_name: str = "agentic_assistant_vector_store"
-        embedding_model_id: str = "amazon.titan-embed-text-v1"
+        # Must be the --embedding-model-id and --embedding-dimensions of the data pipeline.
+        embedding_model_id: str = os.environ.get("EMBEDDING_MODEL_ID", "amazon.titan-embed-text-v1")
+        embedding_dimensions: Optional[int] = (
+            int(os.environ["EMBEDDING_DIMENSIONS"]) if os.environ.get("EMBEDDING_DIMENSIONS") else None
+        )
+        # Only the models with a configurable size, e.g. Titan Text Embeddings V2, take the dimensions.
+        embedding_model_kwargs: dict = field(
+            default_factory=lambda: (
+                {"dimensions": int(os.environ["EMBEDDING_DIMENSIONS"]), "normalize": True}
+                if os.environ.get("EMBEDDING_DIMENSIONS")
+                else {}
+            )
+        )
+        # The --storage-precision of the data pipeline, "full", "half" or "binary",
+        # to search through its precision index. Unset, PGVector searches the full
+        # precision embeddings.
+        embedding_precision: Optional[str] = os.environ.get("EMBEDDING_PRECISION") or None
+        # Re-rank rescore_factor * k candidates of the precision index at full precision.
+        embedding_rescore_factor: Optional[int] = (
+            int(os.environ["EMBEDDING_RESCORE_FACTOR"]) if os.environ.get("EMBEDDING_RESCORE_FACTOR") else None
+        )
 
         sqlalchemy_connection_url: str = sqlalchemy.URL.create(
             "postgresql+psycopg2",
@@ -54,22 +111,39 @@ class AgenticAssistantConfig:
 
         # number of sample rows to include in the prompt from the SQL table.
         num_sql_table_sample_rows: int = 2
+        # number of tables selected from the table catalog for each SQL prompt.
+        num_sql_tables_in_prompt: int = 3
 
         sql_engine = sqlalchemy.create_engine(sqlalchemy_connection_url)
 
+        sql_table_names = list(
+            dict.fromkeys(
+                SQL_TABLE_NAMES + SQL_AGGREGATE_VIEW_NAMES + get_catalog_table_names(sql_engine)
+            )
+        )
+
         try:
             entities_db = SQLDatabase(
                 engine=sql_engine,
-                include_tables=SQL_TABLE_NAMES,
+                include_tables=sql_table_names,
                 sample_rows_in_table_info=num_sql_table_sample_rows,
+                view_support=True,
             )
         except ValueError as e:
             if "include_tables" in str(e):
-                print(f"Warning: Table {SQL_TABLE_NAMES[0]} not found in the database. Proceeding without including this table.")
-                entities_db = SQLDatabase(
-                    engine=sql_engine,
-                    include_tables=[],  # Include all tables
-                    sample_rows_in_table_info=num_sql_table_sample_rows,
-                )
+                print(f"Warning: {e}. Retrying with the tables {SQL_TABLE_NAMES} only.")
+                try:
+                    entities_db = SQLDatabase(
+                        engine=sql_engine,
+                        include_tables=SQL_TABLE_NAMES,
+                        sample_rows_in_table_info=num_sql_table_sample_rows,
+                    )
+                except ValueError:
+                    print(f"Warning: Table {SQL_TABLE_NAMES[0]} not found in the database. Proceeding without including this table.")
+                    entities_db = SQLDatabase(
+                        engine=sql_engine,
+                        include_tables=[],  # Include all tables
+                        sample_rows_in_table_info=num_sql_table_sample_rows,
+                    )
             else:
                 raise e
\ No newline at end of file
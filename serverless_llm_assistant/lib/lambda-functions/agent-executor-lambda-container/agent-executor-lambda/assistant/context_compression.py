@@ -0,0 +1,217 @@
+"""Token-budgeted compression of the retrieved chunks of the RAG tool.
+
+With the "stuff" chain, every retrieved chunk is pasted into the prompt, with
+the overlap between consecutive chunks of a page and the near-duplicate
+paragraphs repeated across reports. `ContextCompressor` post-processes the
+retrieved chunks before the prompt is built:
+
+1. near-duplicates of a better ranked chunk are dropped,
+2. chunks of the same page overlapping each other, i.e. adjacent chunks, are
+   merged into one passage without the overlapping span,
+3. optionally, only the sentences sharing words with the question are kept,
+4. passages are added by rank until the token budget is reached, the last one
+   is cut at a sentence boundary.
+
+Chunks are ranked by their `relevance_score` metadata, e.g. set by a
+re-ranker, or else by their retrieval order. Tokens are estimated from the
+number of characters, a tokenizer can be passed with `count_tokens`. Each
+compression logs the tokens before and after as JSON.
+"""
+import json
+import logging
+import math
+import re
+from typing import Callable, Optional, Sequence
+
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"\w+")
+SENTENCE_PATTERN = re.compile(r"[^.!?\n]+(?:[.!?]+|\n+|$)")
+STOP_WORDS = frozenset(
+    "a an and are as at be by did do does for from has have how in is it its of on or"
+    " than that the their this to was were what when where which who why with".split()
+)
+# Claude tokens are about 3.5 to 4 characters of English text, underestimating
+# the characters per token keeps the estimate above the real count.
+CHARACTERS_PER_TOKEN = 3.5
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARACTERS_PER_TOKEN)
+
+
+def _shingles(text, size=3):
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i: i + size]) for i in range(len(words) - size + 1)}
+
+
+def _jaccard(shingles, other_shingles):
+    if not shingles or not other_shingles:
+        return 0.0
+    return len(shingles & other_shingles) / len(shingles | other_shingles)
+
+
+def _overlap_length(text, next_text, min_overlap):
+    """Length of the longest suffix of `text` that is a prefix of `next_text`."""
+    for length in range(min(len(text), len(next_text)), min_overlap - 1, -1):
+        if text.endswith(next_text[:length]):
+            return length
+    return 0
+
+
+def _split_sentences(text):
+    return [sentence for sentence in SENTENCE_PATTERN.findall(text) if sentence.strip()]
+
+
+def _query_terms(query):
+    return {word for word in WORD_PATTERN.findall(query.lower()) if word not in STOP_WORDS}
+
+
+class ContextCompressor(BaseDocumentCompressor):
+    """Fit the retrieved chunks into `max_tokens`, without overlaps and near-duplicates.
+
+    Args:
+        max_tokens (int): budget of the tokens of all the returned passages.
+        near_duplicate_threshold (float): minimum Jaccard similarity of the
+            word 3-shingles of two chunks for the lower ranked one to be dropped.
+        min_overlap_chars (int): minimum overlap between two chunks of the same
+            page to merge them.
+        extractive (bool): keep only the sentences sharing words with the question.
+        min_passage_tokens (int): the passage exceeding the budget is cut to the
+            remaining budget only when at least this many tokens remain.
+    """
+
+    max_tokens: int = 1500
+    near_duplicate_threshold: float = 0.85
+    min_overlap_chars: int = 20
+    extractive: bool = False
+    min_passage_tokens: int = 50
+    count_tokens: Callable[[str], int] = estimate_tokens
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        ranked = self._rank(documents)
+        unique = self._drop_near_duplicates(ranked)
+        passages = self._merge_overlapping(unique)
+        if self.extractive:
+            passages = [self._extract_sentences(passage, query) for passage in passages]
+        compressed = self._fit_budget(passages)
+
+        logger.info(
+            json.dumps(
+                {
+                    "event": "rag_context_compression",
+                    "chunks": len(documents),
+                    "near_duplicates": len(ranked) - len(unique),
+                    "passages": len(compressed),
+                    "tokens_before": sum(self.count_tokens(d.page_content) for d in documents),
+                    "tokens_after": sum(self.count_tokens(d.page_content) for d in compressed),
+                    "max_tokens": self.max_tokens,
+                }
+            )
+        )
+        return compressed
+
+    @staticmethod
+    def _rank(documents):
+        def score(item):
+            rank, document = item
+            return document.metadata.get("relevance_score", -rank)
+
+        return [document for _, document in sorted(enumerate(documents), key=score, reverse=True)]
+
+    def _drop_near_duplicates(self, documents):
+        kept, kept_shingles = [], []
+        for document in documents:
+            shingles = _shingles(document.page_content)
+            if any(
+                _jaccard(shingles, other) >= self.near_duplicate_threshold for other in kept_shingles
+            ):
+                continue
+            kept.append(document)
+            kept_shingles.append(shingles)
+        return kept
+
+    def _merge_overlapping(self, documents):
+        """Merge the chunks of a page overlapping each other, at the rank of the best one."""
+        passages = []
+        for document in documents:
+            page = (document.metadata.get("document_name"), document.metadata.get("page_number"))
+            text = document.page_content
+            for index, passage in enumerate(passages):
+                passage_page = (
+                    passage.metadata.get("document_name"), passage.metadata.get("page_number")
+                )
+                if page != passage_page or page == (None, None):
+                    continue
+                merged_text = self._merge_texts(passage.page_content, text)
+                if merged_text is not None:
+                    metadata = dict(passage.metadata)
+                    metadata["merged_chunks"] = metadata.get("merged_chunks", 1) + 1
+                    passages[index] = Document(page_content=merged_text, metadata=metadata)
+                    break
+            else:
+                passages.append(document)
+        return passages
+
+    def _merge_texts(self, text, other_text):
+        if other_text in text:
+            return text
+        if text in other_text:
+            return other_text
+        overlap = _overlap_length(text, other_text, self.min_overlap_chars)
+        if overlap:
+            return text + other_text[overlap:]
+        overlap = _overlap_length(other_text, text, self.min_overlap_chars)
+        if overlap:
+            return other_text + text[overlap:]
+        return None
+
+    @staticmethod
+    def _extract_sentences(document, query):
+        terms = _query_terms(query)
+        sentences = _split_sentences(document.page_content)
+        matching = [
+            sentence for sentence in sentences
+            if terms & set(WORD_PATTERN.findall(sentence.lower()))
+        ]
+        # A chunk retrieved without any word of the question is kept whole,
+        # it may be a semantic match.
+        if not matching or len(matching) == len(sentences):
+            return document
+        return Document(page_content=" ".join(s.strip() for s in matching), metadata=document.metadata)
+
+    def _fit_budget(self, passages):
+        compressed = []
+        remaining_tokens = self.max_tokens
+        for passage in passages:
+            num_tokens = self.count_tokens(passage.page_content)
+            if num_tokens <= remaining_tokens:
+                compressed.append(passage)
+                remaining_tokens -= num_tokens
+                continue
+            if remaining_tokens >= self.min_passage_tokens:
+                truncated_text = self._truncate(passage.page_content, remaining_tokens)
+                if truncated_text:
+                    compressed.append(Document(page_content=truncated_text, metadata=passage.metadata))
+            break
+        return compressed
+
+    def _truncate(self, text, max_tokens):
+        """Keep the first sentences of `text` fitting in `max_tokens`."""
+        kept = ""
+        for sentence in _split_sentences(text):
+            if self.count_tokens(kept + sentence) > max_tokens:
+                break
+            kept += sentence
+        return kept.strip()
@@ -0,0 +1,155 @@
+"""Route each request to the fastest model that can answer it.
+
+A cheap local classifier scores the complexity of the user input, without an
+extra LLM call: analytical terms (compare, growth, calculate...), multi-step
+connectors, several questions in one message, years, percentages and amounts
+make a request more complex, while greetings and short conversational turns
+make it simpler. Requests scoring below the threshold go to the fast tier,
+e.g. Claude 3 Haiku, and the others are escalated to the strong tier, e.g.
+Claude 3 Sonnet. Agentic requests get a bonus, since they usually call tools
+over several steps.
+
+Each routing decision and the latency of each tier are logged as JSON, e.g.
+to tune the threshold for p50 latency and cost with CloudWatch Logs Insights:
+
+    filter event = "model_latency" | stats pct(latency_seconds, 50) by tier
+"""
+import json
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+FAST_TIER = "fast"
+STRONG_TIER = "strong"
+MODEL_TIERS = (FAST_TIER, STRONG_TIER)
+
+ANALYTICAL_PATTERN = re.compile(
+    r"\b(compare[ds]?|comparison|versus|vs|trends?|growth|grew|increase[ds]?|decrease[ds]?"
+    r"|calculate|compute|ratios?|percent(age)?|average|total|sum|analy[sz]e|analysis"
+    r"|forecast|estimate|impact|why|correlat\w*|rank(ing)?|breakdown|step[- ]by[- ]step"
+    r"|pros and cons|trade-?offs?|how (much|many))\b",
+    re.IGNORECASE,
+)
+MULTI_STEP_PATTERN = re.compile(
+    r"\b(and then|then|after that|first|second|finally|both|each|respectively|as well as)\b",
+    re.IGNORECASE,
+)
+DATA_PATTERN = re.compile(r"\b(19|20)\d{2}\b|\d+(\.\d+)?\s*%|\$\s?\d")
+CONVERSATIONAL_PATTERN = re.compile(
+    r"^\s*(hi|hello|hey|thanks|thank you|ok(ay)?|great|cool|good (morning|afternoon|evening)"
+    r"|bye|who are you|what can you do)\b",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class RoutingDecision:
+    tier: str
+    score: int
+    reasons: list = field(default_factory=list)
+
+
+def score_complexity(user_input, chatbot_type="basic"):
+    """Return the complexity score of a request and the reasons contributing to it."""
+    reasons = []
+    score = 0
+
+    analytical_terms = {match.group(0).lower() for match in ANALYTICAL_PATTERN.finditer(user_input)}
+    if analytical_terms:
+        score += min(4, 2 * len(analytical_terms))
+        reasons.append(f"analytical: {', '.join(sorted(analytical_terms))}")
+
+    num_steps = len(MULTI_STEP_PATTERN.findall(user_input))
+    if num_steps:
+        score += min(2, num_steps)
+        reasons.append(f"{num_steps} multi-step connectors")
+
+    num_data_mentions = len(DATA_PATTERN.findall(user_input))
+    if num_data_mentions:
+        score += min(2, num_data_mentions)
+        reasons.append(f"{num_data_mentions} years, percentages or amounts")
+
+    num_questions = user_input.count("?")
+    if num_questions > 1:
+        score += 2
+        reasons.append(f"{num_questions} questions")
+
+    num_words = len(user_input.split())
+    if num_words > 40:
+        score += 1 if num_words <= 80 else 2
+        reasons.append(f"{num_words} words")
+    elif num_words < 8 and CONVERSATIONAL_PATTERN.search(user_input):
+        score -= 3
+        reasons.append("conversational")
+
+    if chatbot_type == "agentic":
+        score += 1
+        reasons.append("agentic")
+
+    return score, reasons
+
+
+class ModelRouter:
+    """Pick the model tier of each request and keep the latency of each tier.
+
+    Args:
+        threshold (int): requests with a complexity score at or above it go
+            to the strong tier.
+    """
+
+    def __init__(self, threshold=3):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.latencies = {tier: [] for tier in MODEL_TIERS}
+
+    def route(self, user_input, chatbot_type="basic", forced_tier=None):
+        """Return the RoutingDecision of a request, `forced_tier` overrides the classifier."""
+        score, reasons = score_complexity(user_input, chatbot_type)
+        if forced_tier in MODEL_TIERS:
+            tier = forced_tier
+            reasons = reasons + [f"forced {forced_tier}"]
+        else:
+            tier = STRONG_TIER if score >= self.threshold else FAST_TIER
+
+        decision = RoutingDecision(tier, score, reasons)
+        logger.info(
+            json.dumps(
+                {
+                    "event": "model_routing",
+                    "chatbot_type": chatbot_type,
+                    "tier": tier,
+                    "score": score,
+                    "threshold": self.threshold,
+                    "reasons": reasons,
+                    "num_words": len(user_input.split()),
+                }
+            )
+        )
+        return decision
+
+    def record_latency(self, decision, model_id, latency_seconds):
+        with self._lock:
+            self.latencies[decision.tier].append(latency_seconds)
+        logger.info(
+            json.dumps(
+                {
+                    "event": "model_latency",
+                    "tier": decision.tier,
+                    "model_id": model_id,
+                    "score": decision.score,
+                    "latency_seconds": round(latency_seconds, 3),
+                }
+            )
+        )
+
+    def report(self):
+        with self._lock:
+            latencies = {tier: sorted(values) for tier, values in self.latencies.items()}
+        return ", ".join(
+            f"{tier}: {len(values)} requests, p50 {values[len(values) // 2]:.2f}s"
+            if values else f"{tier}: 0 requests"
+            for tier, values in latencies.items()
+        )
@@ -0,0 +1,174 @@
+"""Speculative prefetch of the first tool call of the agent.
+
+In agentic mode, the first LLM iteration usually decides to call the
+SemanticSearch or SQLQA tool with an input very close to the user question.
+While the agent plans its first step, `start_prefetch` runs the registered
+prefetchers, e.g. the vector retrieval or the SQL schema loading, on the raw
+user input in a thread pool. When a tool is then called with an input similar
+enough to the user input, it takes the prefetched result with
+`consume_prefetch` instead of computing it again, waiting for it if it is
+still running. Otherwise the prefetch is cancelled if it has not started, or
+its result is dropped when it completes.
+
+Each request logs the prefetch hits, misses and the latency saved, i.e. the
+time the prefetched work took minus the time the tool still had to wait for it.
+"""
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Prefetch functions by stage, called with the user input.
+_prefetchers = {}
+_active_session = contextvars.ContextVar("active_prefetch_session", default=None)
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+_totals_lock = threading.Lock()
+_totals = {"hits": 0, "misses": 0, "unused": 0, "saved_seconds": 0.0}
+
+
+def register_prefetcher(stage, function):
+    """Prefetch `function(user_input)` at the start of each agentic request."""
+    _prefetchers[stage] = function
+
+
+def query_similarity(text, other_text):
+    """Jaccard similarity of the lowercase words of two texts."""
+    words = set(WORD_PATTERN.findall(text.lower()))
+    other_words = set(WORD_PATTERN.findall(other_text.lower()))
+    if not words and not other_words:
+        return 1.0
+    return len(words & other_words) / len(words | other_words)
+
+
+def _timed_call(function, user_input):
+    start = time.perf_counter()
+    result = function(user_input)
+    return result, time.perf_counter() - start
+
+
+class PrefetchSession:
+    """The prefetches of one request, each one can be consumed by a single tool call.
+
+    Args:
+        min_similarity (float): minimum word Jaccard similarity between the
+            user input and a tool input to serve the prefetched result.
+    """
+
+    def __init__(self, user_input, min_similarity=0.6):
+        self.user_input = user_input
+        self.min_similarity = min_similarity
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.stages = {}
+
+    def start(self, prefetchers):
+        for stage, function in prefetchers.items():
+            self._futures[stage] = _executor.submit(_timed_call, function, self.user_input)
+
+    def consume(self, stage, query):
+        """Return (True, prefetched result) when `query` matches the user input, else (False, None)."""
+        with self._lock:
+            future = self._futures.pop(stage, None)
+        if future is None:
+            return False, None
+
+        similarity = query_similarity(self.user_input, query)
+        if similarity < self.min_similarity:
+            future.cancel()
+            self.stages[stage] = {"outcome": "miss", "similarity": round(similarity, 3)}
+            return False, None
+
+        wait_start = time.perf_counter()
+        try:
+            result, duration = future.result()
+        except Exception as e:
+            self.stages[stage] = {"outcome": "error", "error": str(e)}
+            return False, None
+        waited = time.perf_counter() - wait_start
+        self.stages[stage] = {
+            "outcome": "hit",
+            "similarity": round(similarity, 3),
+            "saved_seconds": round(max(0.0, duration - waited), 3),
+        }
+        return True, result
+
+    def close(self):
+        """Drop the prefetches no tool asked for, and log the outcome of the request."""
+        with self._lock:
+            futures, self._futures = self._futures, {}
+        for stage, future in futures.items():
+            future.cancel()
+            self.stages[stage] = {"outcome": "unused"}
+        if not self.stages:
+            return
+
+        outcomes = [stage["outcome"] for stage in self.stages.values()]
+        saved_seconds = sum(stage.get("saved_seconds", 0.0) for stage in self.stages.values())
+        with _totals_lock:
+            _totals["hits"] += outcomes.count("hit")
+            _totals["misses"] += len(outcomes) - outcomes.count("hit") - outcomes.count("unused")
+            _totals["unused"] += outcomes.count("unused")
+            _totals["saved_seconds"] += saved_seconds
+            num_consumed = _totals["hits"] + _totals["misses"]
+            hit_rate = _totals["hits"] / num_consumed if num_consumed else None
+        logger.info(
+            json.dumps(
+                {
+                    "event": "speculative_prefetch",
+                    "stages": self.stages,
+                    "saved_seconds": round(saved_seconds, 3),
+                    "container_hit_rate": round(hit_rate, 3) if hit_rate is not None else None,
+                    "container_saved_seconds": round(_totals["saved_seconds"], 3),
+                }
+            )
+        )
+
+
+def start_prefetch(user_input, min_similarity=0.6):
+    """Start the registered prefetchers for a request, they serve the tools of the current context."""
+    session = PrefetchSession(user_input, min_similarity)
+    session.start(dict(_prefetchers))
+    _active_session.set(session)
+    return session
+
+
+def finish_prefetch(session):
+    _active_session.set(None)
+    session.close()
+
+
+def consume_prefetch(stage, query):
+    """Return (True, result) of the prefetch of a stage matching `query`, else (False, None)."""
+    session = _active_session.get()
+    if session is None:
+        return False, None
+    return session.consume(stage, query)
+
+
+class SpeculativeRetriever(BaseRetriever):
+    """Serve the prefetched documents of the user question, or retrieve them."""
+
+    retriever: BaseRetriever
+    stage: str = "retrieval"
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        hit, documents = consume_prefetch(self.stage, query)
+        if hit:
+            return documents
+        return self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+
+
+def speculative_retriever(retriever, stage="retrieval"):
+    """Wrap a retriever so that the documents of the user question are prefetched."""
+    register_prefetcher(stage, retriever.invoke)
+    return SpeculativeRetriever(retriever=retriever, stage=stage)
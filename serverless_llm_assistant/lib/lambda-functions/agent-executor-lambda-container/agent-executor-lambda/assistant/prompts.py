@@ -1,5 +1,5 @@
 from datetime import datetime
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 # ============================================================================
 # Claude basic chatbot prompt construction
@@ -42,5 +42,34 @@ messages = [
 
 CLAUDE_PROMPT = ChatPromptTemplate.from_messages(messages)
 
+# ============================================================================
+# Claude tool calling agent prompt construction
+# ============================================================================
+# The tools are sent to the model as JSON schemas with the Messages API tool
+# use, so the prompt neither lists them nor describes an output format.
+
+agent_system_message = f"""
+You are a polite AI assistant, you respond to the user input and questions accurately and concisely.
+You remain on the topic and leverage the available tools efficiently.
+Use a tool only when the question requires information or a computation you cannot provide yourself,
+and respond with your knowledge when the question does not correspond to any available tool.
+
+The conversation history is within the <chat_history> XML tags below, where Hu refers to human and AI refers to the assistant:
+<chat_history>
+{{chat_history}}
+</chat_history>
+
+The date today is {date_today}.
+"""
+
+# The agent scratchpad holds the tool use and tool result messages of the current question.
+agent_messages = [
+    ("system", agent_system_message),
+    ("human", "{input}"),
+    MessagesPlaceholder("agent_scratchpad"),
+]
+
+CLAUDE_TOOL_CALLING_AGENT_PROMPT = ChatPromptTemplate.from_messages(agent_messages)
+
 ## Placeholder for lab 3 - agent prompt code
 ## replace this placeholder with code from lab 3, step 2 as instructed.
@@ -40,7 +40,8 @@ def create_sql_query_generation_chain(
         "initial_context": lambda x: x["initial_context"],
         "tables_content_description": lambda x: x["tables_content_description"],
         "top_k": lambda _: k,
-        "table_info": lambda x: db.get_table_info(
+        # The table info can be passed in, e.g. when it was prefetched.
+        "table_info": lambda x: x.get("table_info") or db.get_table_info(
             table_names=x.get("table_names_to_use")
         ),
     }
@@ -0,0 +1,68 @@
+import sqlalchemy
+
+from .config import SQL_TABLE_CATALOG_NAME
+
+
+class SQLTableCatalog:
+    """Select the SQL tables relevant to a question from the table catalog.
+
+    The catalog holds an embedding of the description and columns of each
+    table, written by the data pipeline when the tables are loaded.
+
+    Note: Must use the same embedding model, and dimensions, used by the data
+    pipeline to build the catalog. Rows embedded with other dimensions are
+    skipped, comparing vectors of different sizes is an error in pgvector.
+    """
+
+    def __init__(self, engine, embedding_model, embedding_model_id, k=3):
+        self.engine = engine
+        self.embedding_model = embedding_model
+        self.embedding_model_id = embedding_model_id
+        self.k = k
+
+    def select_tables(self, question, usable_table_names):
+        """Return the k most relevant (table_name, description) pairs, or [] without a catalog."""
+        try:
+            question_embedding = self.embedding_model.embed_query(question)
+            with self.engine.connect() as connection:
+                rows = connection.execute(
+                    sqlalchemy.text(
+                        f"SELECT table_name, description FROM {SQL_TABLE_CATALOG_NAME}"
+                        " WHERE embedding_model_id = :embedding_model_id"
+                        " AND embedding_dimensions = :embedding_dimensions"
+                        " ORDER BY embedding <=> CAST(:embedding AS vector) LIMIT :k;"
+                    ),
+                    {
+                        "embedding_model_id": self.embedding_model_id,
+                        "embedding_dimensions": len(question_embedding),
+                        "embedding": str(list(question_embedding)),
+                        # Fetch more candidates in case some are not usable.
+                        "k": 2 * self.k,
+                    },
+                ).fetchall()
+        except Exception as e:
+            print(f"Warning: could not select tables from the table catalog: {e}")
+            return []
+
+        return [
+            (table_name, description)
+            for table_name, description in rows
+            if table_name in usable_table_names
+        ][:self.k]
+
+    def get_descriptions(self, table_names):
+        """Return the description of each table written in the catalog, or {} without a catalog."""
+        try:
+            with self.engine.connect() as connection:
+                rows = connection.execute(
+                    sqlalchemy.text(
+                        f"SELECT table_name, description FROM {SQL_TABLE_CATALOG_NAME}"
+                        " WHERE table_name = ANY(:table_names);"
+                    ),
+                    {"table_names": list(table_names)},
+                ).fetchall()
+        except Exception as e:
+            print(f"Warning: could not read the table descriptions from the table catalog: {e}")
+            return {}
+
+        return {table_name: description for table_name, description in rows if description}
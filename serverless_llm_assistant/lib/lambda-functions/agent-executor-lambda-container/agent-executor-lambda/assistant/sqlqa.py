@@ -1,17 +1,48 @@
+import re
+
+import boto3
 from langchain.prompts.prompt import PromptTemplate
+from langchain_aws import BedrockEmbeddings
 
-from .config import AgenticAssistantConfig
+from .coalescing import coalescing_key, request_coalescer
+from .config import SQL_AGGREGATE_VIEW_NAMES, SQL_TABLE_NAMES, AgenticAssistantConfig
+from .prefetch import consume_prefetch, register_prefetcher
 from .sql_chain import create_sql_query_generation_chain
+from .sql_table_catalog import SQLTableCatalog
 
 config = AgenticAssistantConfig()
 
+table_catalog = SQLTableCatalog(
+    config.sql_engine,
+    BedrockEmbeddings(
+        model_id=config.embedding_model_id,
+        client=boto3.client("bedrock-runtime", region_name=config.bedrock_region),
+        model_kwargs=config.embedding_model_kwargs,
+    ),
+    config.embedding_model_id,
+    k=config.num_sql_tables_in_prompt,
+)
+
+# The descriptions of the aggregate views are read from the table catalog,
+# written by the data pipeline from the definitions of the views.
 sql_tables_content_description = {
     "extracted_entities": (
         "Contains extracted information from multiple financial reports of companies."
         " The information includes revenue, number of employees and risks per company per year."
-    )
+    ),
 }
 
+# Questions asking for aggregates by company or year can be answered from the
+# precomputed views, which are then added to the prompt next to the base tables.
+AGGREGATE_QUESTION_PATTERN = re.compile(
+    r"\b(total|sum|average|avg|mean|median|max(imum)?|min(imum)?|highest|lowest|largest|smallest"
+    r"|growth|grew|grow(n|ing)?|increase[ds]?|decrease[ds]?|change[ds]?|trends?"
+    r"|year[- ]over[- ]year|yoy|per (year|company)|each (year|company)|over the years)\b",
+    re.IGNORECASE,
+)
+
+SQL_SCHEMA_PREFETCH_STAGE = "sql_schema"
+
 # ============================================================================
 # Prompt construction for SQL QA.
 # ============================================================================
@@ -27,6 +58,7 @@ You must follow the rules within the <rules></rules> XML tags below:
 7. End the SQL with a LIMIT clause. The limit value is inside the <limit></limit> XML tags below.
 8. When using GROUP BY, ensure that every column in the SELECT clause appears in the GROUP BY clause or that it is aggregated with an aggregation function such as AVG or SUM.
 9. Write the least complex SQL query that answers the questions and abides by the rules.
+10. When a precomputed aggregate view is in the table schema and answers the question, select from it instead of aggregating extracted_entities.
 </rules>
 
 Use the following format:
@@ -77,6 +109,36 @@ def prepare_tables_description(table_descriptions):
     return table_description
 
 
+def is_aggregate_question(user_question):
+    return bool(AGGREGATE_QUESTION_PATTERN.search(user_question))
+
+
+def get_tables_to_use(user_question, usable_table_names):
+    """Add the precomputed views for aggregate questions, and select the most relevant tables for others.
+
+    Returns:
+        (table names to include in the prompt or None to include them all,
+        descriptions of the tables from the table catalog)
+    """
+    aggregate_views = [name for name in SQL_AGGREGATE_VIEW_NAMES if name in usable_table_names]
+    if aggregate_views and is_aggregate_question(user_question):
+        # The base tables still answer the lookups the views do not cover.
+        base_table_names = [name for name in SQL_TABLE_NAMES if name in usable_table_names]
+        return aggregate_views + base_table_names, table_catalog.get_descriptions(aggregate_views)
+
+    # Small schemas fit in the prompt, skip the question embedding.
+    if len(usable_table_names) <= table_catalog.k:
+        return None, {}
+
+    selected_tables = table_catalog.select_tables(user_question, usable_table_names)
+    if not selected_tables:
+        return None, {}
+    return (
+        [table_name for table_name, _ in selected_tables],
+        {table_name: description for table_name, description in selected_tables if description},
+    )
+
+
 def get_text_to_sql_chain(config, llm):
     """Create an LLM chain to convert text input to SQL queries."""
     return create_sql_query_generation_chain(
@@ -89,13 +151,55 @@ def get_text_to_sql_chain(config, llm):
 
 
 def get_sql_qa_tool(user_question, text_to_sql_chain, initial_context=""):
+    # Identical concurrent questions share a single query generation and execution.
+    return request_coalescer.do(
+        coalescing_key("sql_qa", user_question, initial_context),
+        lambda: _run_sql_qa(user_question, text_to_sql_chain, initial_context),
+    )
+
+
+def load_sql_schema(user_question):
+    """Select the tables of a question and load their schema and sample rows."""
+    usable_table_names = set(config.entities_db.get_usable_table_names())
+    table_names_to_use, catalog_descriptions = get_tables_to_use(user_question, usable_table_names)
+    return {
+        "usable_table_names": usable_table_names,
+        "table_names_to_use": table_names_to_use,
+        "catalog_descriptions": catalog_descriptions,
+        "table_info": config.entities_db.get_table_info(table_names=table_names_to_use),
+        "aggregate_question": is_aggregate_question(user_question),
+    }
+
+
+# Loaded for the user question while the agent plans its first step.
+register_prefetcher(SQL_SCHEMA_PREFETCH_STAGE, load_sql_schema)
+
+
+def _run_sql_qa(user_question, text_to_sql_chain, initial_context):
+    hit, sql_schema = consume_prefetch(SQL_SCHEMA_PREFETCH_STAGE, user_question)
+    # The prefetched tables are only valid if the question is routed the same way.
+    if not hit or sql_schema["aggregate_question"] != is_aggregate_question(user_question):
+        sql_schema = load_sql_schema(user_question)
+    usable_table_names = sql_schema["usable_table_names"]
+    table_names_to_use = sql_schema["table_names_to_use"]
+    catalog_descriptions = sql_schema["catalog_descriptions"]
+    described_table_names = table_names_to_use or usable_table_names
+    tables_description = {**catalog_descriptions, **sql_tables_content_description}
+    print(f"SQL tables used: {table_names_to_use or 'all'}")
+
     sql_query = text_to_sql_chain.invoke(
         {
             "question": user_question,
             "initial_context": initial_context,
             "tables_content_description": prepare_tables_description(
-                sql_tables_content_description
+                {
+                    table: description
+                    for table, description in tables_description.items()
+                    if table in described_table_names
+                }
             ),
+            "table_names_to_use": table_names_to_use,
+            "table_info": sql_schema["table_info"],
         }
     )
     sql_query = sql_query.strip()
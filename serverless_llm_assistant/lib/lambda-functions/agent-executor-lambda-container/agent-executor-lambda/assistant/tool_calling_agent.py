@@ -0,0 +1,131 @@
+"""Agent built on the structured tool use of the Claude Messages API.
+
+The ReAct agent of lab 3 asks the completion model to write its next step as
+"Action:/Action Input:" text, parses it with regular expressions and, when the
+text is malformed, sends the whole scratchpad again with a correction message.
+Here the tools are bound to `ChatBedrock` as JSON schemas: the model answers
+with tool use blocks, the tool results are sent back as tool result messages,
+and no output text is ever parsed, so there is no parsing retry.
+
+Both agent modes report their iterations, i.e. LLM calls, with an
+`AgentIterationCounter`, to compare them, e.g. with the load generator of lab 2:
+
+    python3 invoke_assistant_lambda.py --questions questions.jsonl \
+        --chatbot-types agentic --agent-modes react tool_calling --output results.json
+"""
+from typing import List, Union
+
+from langchain.agents import AgentExecutor, Tool, create_tool_calling_agent
+from langchain_core.agents import AgentAction, AgentFinish
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.pydantic_v1 import Field, create_model
+
+from .prompts import CLAUDE_TOOL_CALLING_AGENT_PROMPT
+
+REACT_AGENT_MODE = "react"
+TOOL_CALLING_AGENT_MODE = "tool_calling"
+AGENT_MODES = (REACT_AGENT_MODE, TOOL_CALLING_AGENT_MODE)
+# Tool name of the steps the ReAct agent spends on malformed outputs.
+PARSING_ERROR_TOOL = "_Exception"
+
+
+class AgentIterationCounter(BaseCallbackHandler):
+    """Count the iterations, tool calls and parsing errors of an agent executor."""
+
+    def __init__(self):
+        self.iterations = 0
+        self.tool_calls = 0
+        self.parsing_errors = 0
+        self._last_message_log = None
+
+    def on_agent_action(self, action, **kwargs):
+        # The parallel tool calls of one iteration share the message of the model.
+        message_log = getattr(action, "message_log", None)
+        if not message_log or message_log != self._last_message_log:
+            self.iterations += 1
+        self._last_message_log = message_log
+        if action.tool == PARSING_ERROR_TOOL:
+            self.parsing_errors += 1
+        else:
+            self.tool_calls += 1
+
+    def on_agent_finish(self, finish, **kwargs):
+        self.iterations += 1
+        self._last_message_log = None
+
+    def counts(self):
+        return {
+            "agent_iterations": self.iterations,
+            "agent_tool_calls": self.tool_calls,
+            "agent_parsing_errors": self.parsing_errors,
+        }
+
+
+def with_args_schema(tool):
+    """Return the tool with an explicit single string argument schema, if it has none.
+
+    The JSON schema of a `Tool` built from a function without `args_schema`
+    has a single `__arg1` argument, a named and described argument helps the
+    model fill it.
+    """
+    if not isinstance(tool, Tool) or tool.args_schema is not None:
+        return tool
+    args_schema = create_model(
+        f"{tool.name}Input",
+        query=(str, Field(description=f"The input of the {tool.name} tool.")),
+    )
+    return Tool(
+        name=tool.name,
+        func=tool.func,
+        coroutine=tool.coroutine,
+        description=tool.description,
+        args_schema=args_schema,
+        return_direct=tool.return_direct,
+    )
+
+
+def _text_output(
+    step: Union[List[AgentAction], AgentFinish]
+) -> Union[List[AgentAction], AgentFinish]:
+    # The final message of the model can be a list of content blocks. The
+    # annotations keep the agent a multi-action agent for the AgentExecutor.
+    if isinstance(step, AgentFinish) and isinstance(step.return_values.get("output"), list):
+        text = "".join(
+            block.get("text", "") if isinstance(block, dict) else str(block)
+            for block in step.return_values["output"]
+        )
+        return AgentFinish({**step.return_values, "output": text}, step.log)
+    return step
+
+
+def create_tool_calling_agent_executor(
+    llm, tools, memory, prompt=CLAUDE_TOOL_CALLING_AGENT_PROMPT, verbose=True, max_iterations=10
+):
+    """Create an agent executor calling `tools` with the native tool use of a chat model.
+
+    Args:
+        llm: a chat model supporting `bind_tools`, e.g. `ChatBedrock` with Claude 3.
+        memory: memory with a `chat_history` string, like the ReAct agent.
+    """
+    tools = [with_args_schema(tool) for tool in tools]
+    agent = create_tool_calling_agent(llm, tools, prompt) | _text_output
+    return AgentExecutor(
+        agent=agent,
+        tools=tools,
+        memory=memory,
+        verbose=verbose,
+        max_iterations=max_iterations,
+        callbacks=[AgentIterationCounter()],
+    )
+
+
+def get_agent_iteration_counts(agent_executor):
+    """Return the counts of the AgentIterationCounter of an agent executor.
+
+    The counts are empty when the executor did not run, e.g. when its answer
+    was shared by an identical concurrent request.
+    """
+    for callback in agent_executor.callbacks or []:
+        if isinstance(callback, AgentIterationCounter) and callback.iterations:
+            return callback.counts()
+    return {}
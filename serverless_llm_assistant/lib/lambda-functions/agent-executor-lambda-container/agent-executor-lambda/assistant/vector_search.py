@@ -0,0 +1,105 @@
+"""Semantic search of the embeddings collection through its precision index.
+
+With `--storage-precision`, the data pipeline builds a partial HNSW index of
+the collection over `embedding::vector(n)`, `embedding::halfvec(n)` or
+`binary_quantize(embedding)::bit(n)`, see
+data_pipelines/utils/vector_precision.py. Postgres only uses such an
+expression index when the query orders by the same expression, which the
+`embedding <=> query` search of PGVector does not. `PrecisionIndexRetriever`
+embeds the question and runs the same query as the `similarity_search` of the
+pipeline, optionally re-ranking the candidates with the full precision cosine
+distance.
+"""
+from typing import Any, List, Optional
+
+import sqlalchemy
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.pydantic_v1 import PrivateAttr
+from langchain_core.retrievers import BaseRetriever
+
+# precision: (SQL expression over the embedding column, distance operator),
+# must match the index expressions of the data pipeline.
+EMBEDDING_PRECISIONS = {
+    "full": ("{column}::vector({dimensions})", "<=>"),
+    "half": ("{column}::halfvec({dimensions})", "<=>"),
+    "binary": ("binary_quantize({column})::bit({dimensions})", "<~>"),
+}
+
+
+def _precision_expression(precision, dimensions, column="embedding"):
+    expression, distance_operator = EMBEDDING_PRECISIONS[precision]
+    return expression.format(column=column, dimensions=dimensions), distance_operator
+
+
+class PrecisionIndexRetriever(BaseRetriever):
+    """Retrieve the k closest chunks of a collection with its precision index.
+
+    Args:
+        engine: SQLAlchemy engine of the vector store database.
+        embedding_model: must be the model, and dimensions, of the collection.
+        precision: "full", "half" or "binary", the `--storage-precision` of the pipeline.
+        rescore_factor: when set, fetch `k * rescore_factor` candidates with the
+            index and re-rank them with the full precision cosine distance.
+    """
+
+    engine: Any
+    embedding_model: Embeddings
+    collection_name: str
+    precision: str = "half"
+    k: int = 5
+    rescore_factor: Optional[int] = None
+    _collection_id: Optional[str] = PrivateAttr(default=None)
+
+    def _get_collection_id(self, connection):
+        # The partial index only applies when the collection id is a literal of the query.
+        if self._collection_id is None:
+            self._collection_id = str(
+                connection.execute(
+                    sqlalchemy.text("SELECT uuid FROM langchain_pg_collection WHERE name = :name;"),
+                    {"name": self.collection_name},
+                ).scalar_one()
+            )
+        return self._collection_id
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        query_embedding = self.embedding_model.embed_query(query)
+        dimensions = len(query_embedding)
+        expression, distance_operator = _precision_expression(self.precision, dimensions)
+        query_expression, _ = _precision_expression(
+            self.precision, dimensions, column="CAST(:query AS vector)"
+        )
+        parameters = {"query": str(list(query_embedding)), "k": self.k}
+
+        if self.rescore_factor:
+            parameters["num_candidates"] = self.k * self.rescore_factor
+            sql_query = f"""
+                WITH candidates AS (
+                    SELECT document, cmetadata, embedding
+                    FROM langchain_pg_embedding
+                    WHERE collection_id = :collection_id
+                    ORDER BY {expression} {distance_operator} {query_expression}
+                    LIMIT :num_candidates
+                )
+                SELECT document, cmetadata
+                FROM candidates
+                ORDER BY embedding <=> CAST(:query AS vector)
+                LIMIT :k;
+            """
+        else:
+            sql_query = f"""
+                SELECT document, cmetadata
+                FROM langchain_pg_embedding
+                WHERE collection_id = :collection_id
+                ORDER BY {expression} {distance_operator} {query_expression}
+                LIMIT :k;
+            """
+
+        with self.engine.connect() as connection:
+            parameters["collection_id"] = self._get_collection_id(connection)
+            rows = connection.execute(sqlalchemy.text(sql_query), parameters).fetchall()
+
+        return [Document(page_content=document, metadata=metadata or {}) for document, metadata in rows]
@@ -1,4 +1,5 @@
 import logging
+import time
 import traceback
 
 import boto3
@@ -8,7 +9,9 @@ from langchain_aws import ChatBedrock
 from langchain.memory import ConversationBufferMemory
 from langchain_community.chat_message_histories import DynamoDBChatMessageHistory
 
+from assistant.coalescing import invoke_conversation_chain
 from assistant.config import AgenticAssistantConfig
+from assistant.model_router import FAST_TIER, STRONG_TIER, ModelRouter
 from assistant.prompts import CLAUDE_PROMPT
 from assistant.utils import parse_markdown_content
 ## placeholder for lab 3, step 4.2, replace this with imports as instructed
@@ -32,9 +35,8 @@ claude_llm = BedrockLLM(
 )
 
 claude_chat_llm = ChatBedrock(
-    # model_id=config.llm_model_id,
     # transitioning to claude 3 with messages API
-    model_id="anthropic.claude-3-haiku-20240307-v1:0",
+    model_id=config.fast_llm_model_id,
     client=bedrock_runtime,
     model_kwargs={
         "max_tokens": 1000,
@@ -43,9 +45,27 @@ claude_chat_llm = ChatBedrock(
     },
 )
 
+claude_strong_chat_llm = ChatBedrock(
+    model_id=config.strong_llm_model_id,
+    client=bedrock_runtime,
+    model_kwargs={
+        "max_tokens": 1000,
+        "temperature": 0.0,
+        "top_p": 0.99
+    },
+)
+
+# Simple conversational turns are answered by the fast model, multi-step
+# analytical questions are escalated to the strong model.
+model_router = ModelRouter(threshold=config.model_routing_threshold)
+chat_llms = {FAST_TIER: claude_chat_llm, STRONG_TIER: claude_strong_chat_llm}
+# Models of the ReAct agent added in lab 3, which parses text completions.
+# The tool calling agent needs Messages API models with tool use, it uses chat_llms.
+agent_llms = {FAST_TIER: claude_chat_llm, STRONG_TIER: claude_llm}
+
 
 def get_basic_chatbot_conversation_chain(
-    user_input, session_id, clean_history, verbose=True
+    user_input, session_id, clean_history, llm=claude_chat_llm, verbose=True
 ):
     message_history = DynamoDBChatMessageHistory(
         table_name=config.chat_message_history_table_name, session_id=session_id
@@ -64,7 +84,7 @@ def get_basic_chatbot_conversation_chain(
     )
 
     conversation_chain = ConversationChain(
-        prompt=CLAUDE_PROMPT, llm=claude_chat_llm, verbose=verbose, memory=memory
+        prompt=CLAUDE_PROMPT, llm=llm, verbose=verbose, memory=memory
     )
 
     return conversation_chain
@@ -80,11 +100,14 @@ def lambda_handler(event, context):
     chatbot_type = event.get("chatbot_type", "basic")
     chatbot_types = ["basic", "agentic"]
     clean_history = event.get("clean_history", False)
+    # "fast" or "strong" bypasses the model router, e.g. to compare the tiers.
+    decision = model_router.route(user_input, chatbot_type, event.get("model_tier"))
 
     if chatbot_type == "basic":
+        llm = chat_llms[decision.tier]
         conversation_chain = get_basic_chatbot_conversation_chain(
-            user_input, session_id, clean_history
-        ).predict
+            user_input, session_id, clean_history, llm=llm
+        )
     elif chatbot_type == "agentic":
         return {
             "statusCode": 200,
@@ -103,7 +126,12 @@ def lambda_handler(event, context):
         }
 
     try:
-        response = conversation_chain(input=user_input)
+        start = time.perf_counter()
+        # Identical concurrent questions share a single LLM call.
+        response = invoke_conversation_chain(
+            conversation_chain, user_input, chatbot_type, llm.model_id
+        )["response"]
+        model_router.record_latency(decision, llm.model_id, time.perf_counter() - start)
         response = parse_markdown_content(response)
     except Exception:
         response = (
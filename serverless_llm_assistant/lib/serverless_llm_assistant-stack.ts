@@ -105,6 +105,26 @@ export class ServerlessLlmAssistantStack extends cdk.Stack {
       }
     );
 
+    // Short-lived lock and result items used to coalesce identical
+    // questions asked at the same time across Lambda containers.
+    // Opt-in, as it adds at least two DynamoDB writes to every request:
+    // npx cdk deploy -c enable_cross_container_coalescing=true
+    const enableCrossContainerCoalescing =
+      this.node.tryGetContext("enable_cross_container_coalescing") === "true" ||
+      this.node.tryGetContext("enable_cross_container_coalescing") === true;
+    const RequestCoalescingTable = enableCrossContainerCoalescing
+      ? new dynamodb.Table(this, "RequestCoalescingTable", {
+          partitionKey: {
+            name: "Key",
+            type: dynamodb.AttributeType.STRING,
+          },
+          billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+          timeToLiveAttribute: "ExpiresAt",
+          removalPolicy: cdk.RemovalPolicy.DESTROY,
+          encryption: dynamodb.TableEncryption.AWS_MANAGED,
+        })
+      : undefined;
+
     // -----------------------------------------------------------------------
     var currentNetworkMode = NetworkMode.DEFAULT;
     // if you run the cdk stack in SageMaker editor, you need to pass --network sagemaker
@@ -151,6 +171,15 @@ export class ServerlessLlmAssistantStack extends cdk.Stack {
     // to be able to read and update it as conversations progress.
     ChatMessageHistoryTable.grantReadWriteData(agent_executor_lambda);
 
+    // Without the table, identical questions are only coalesced within a container.
+    if (RequestCoalescingTable) {
+      agent_executor_lambda.addEnvironment(
+        "COALESCING_TABLE",
+        RequestCoalescingTable.tableName
+      );
+      RequestCoalescingTable.grantReadWriteData(agent_executor_lambda);
+    }
+
     // Allow the Lambda function to use Bedrock
     agent_executor_lambda.role?.addManagedPolicy(
       iam.ManagedPolicy.fromAwsManagedPolicyName("AmazonBedrockFullAccess")